@@ -0,0 +1,83 @@
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+class LRUCache:
+    """Bounded in-process cache with a per-entry TTL."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+class MemoryCacheBackend:
+    """Async cache interface over a process-local LRUCache."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = LRUCache(maxsize, ttl)
+
+    async def get(self, key: str):
+        return self._cache.get(key)
+
+    async def set(self, key: str, value):
+        self._cache.set(key, value)
+
+    async def delete(self, key: str):
+        self._cache.delete(key)
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+class RedisCacheBackend:
+    """Async cache interface over a Redis-protocol server, shared by all workers."""
+
+    def __init__(self, url: str, ttl: float, prefix: str = "healthdiary:"):
+        import redis.asyncio as redis
+        self._redis = redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get(self, key: str):
+        raw = await self._redis.get(self.prefix + key)
+        return None if raw is None else json.loads(raw)
+
+    async def set(self, key: str, value):
+        await self._redis.set(self.prefix + key, json.dumps(value, default=_json_default), ex=int(self.ttl))
+
+    async def delete(self, key: str):
+        await self._redis.delete(self.prefix + key)
+
+def make_cache(settings, maxsize: int, ttl: float):
+    if settings.cache_backend == 'redis':
+        return RedisCacheBackend(settings.cache_url, ttl)
+    return MemoryCacheBackend(maxsize, ttl)
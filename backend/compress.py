@@ -0,0 +1,79 @@
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # optional; responses fall back to gzip
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+class _StreamCompressor:
+    def __init__(self, encoding: str):
+        self._brotli = encoding == "br"
+        self._compressor = brotli.Compressor(quality=4) if self._brotli else zlib.compressobj(6, zlib.DEFLATED, 31)
+
+    def chunk(self, data: bytes) -> bytes:
+        if self._brotli:
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self._brotli:
+            return self._compressor.process(data) + self._compressor.finish()
+        return self._compressor.compress(data) + self._compressor.flush()
+
+class CompressionMiddleware:
+    """brotli or gzip for text responses of at least `minimum_size` bytes.
+    Streamed responses are compressed chunk by chunk, so NDJSON still streams."""
+
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        accept = Headers(scope=scope).get("accept-encoding", "")
+        encoding = "br" if brotli is not None and "br" in accept else "gzip" if "gzip" in accept else None
+        if encoding is None:
+            return await self.app(scope, receive, send)
+        state = {"start": None, "compressor": None}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["start"] = message  # held until the first body chunk decides
+                return
+            if message["type"] != "http.response.body":
+                return await send(message)
+            body, more_body = message.get("body", b""), message.get("more_body", False)
+            start, state["start"] = state["start"], None
+            if start is not None:
+                headers = MutableHeaders(raw=start.setdefault("headers", []))
+                compressible = (
+                    headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+                    and "content-encoding" not in headers
+                    and (more_body or len(body) >= self.minimum_size)
+                )
+                if compressible:
+                    state["compressor"] = _StreamCompressor(encoding)
+                    headers["Content-Encoding"] = encoding
+                    headers.add_vary_header("Accept-Encoding")
+                    if more_body:
+                        del headers["Content-Length"]
+                    else:
+                        # Whole body in hand: compress it now to set Content-Length
+                        message = {**message, "body": state["compressor"].finish(body)}
+                        headers["Content-Length"] = str(len(message["body"]))
+                        state["compressor"] = None
+                        await send(start)
+                        await send(message)
+                        return
+                await send(start)
+            compressor = state["compressor"]
+            if compressor is not None:
+                message = {**message, "body": compressor.chunk(body) if more_body else compressor.finish(body)}
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
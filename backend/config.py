@@ -0,0 +1,191 @@
+import os
+from dataclasses import dataclass, fields
+from pathlib import Path
+from typing import Optional
+
+from dotenv import load_dotenv
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+RECORDS_STORAGE_MODES = ("collection", "dual", "timeseries")
+
+@dataclass(frozen=True)
+class Settings:
+    """API and worker settings. Each field is read from the upper-cased
+    environment variable of the same name (e.g. JOB_WORKER_MODE), falling back
+    to the default here. Build one with Settings.from_env() and hand it to
+    server.create_app() or server.Runtime()."""
+
+    # MongoDB connection. The client is created and warmed when the app (or
+    # worker) starts, not at import time.
+    mongo_url: str
+    db_name: str
+    mongo_max_pool_size: int = 100
+    mongo_min_pool_size: int = 10
+    mongo_wait_queue_timeout_ms: int = 2000
+    mongo_server_selection_timeout_ms: int = 5000
+    mongo_connect_timeout_ms: int = 5000
+    mongo_socket_timeout_ms: int = 30000
+    mongo_read_preference: str = 'primary'
+    # Analytics reads tolerate replication lag, so they may go to secondaries
+    mongo_analytics_read_preference: str = 'secondaryPreferred'
+
+    # Instrumentation. Requests slower than slow_request_seconds are logged
+    # with the Mongo commands they issued and, if enabled, a query plan
+    # summary. Each query shape is explained at most once per
+    # explain_interval_seconds, with at most explain_concurrency in flight.
+    slow_request_seconds: float = 1.0
+    explain_slow_queries: bool = False
+    explain_interval_seconds: int = 300
+    explain_concurrency: int = 2
+
+    # Response compression (brotli needs the optional `brotli` package) and
+    # conditional GETs. ETags on lookback windows (no explicit `from`) also
+    # roll over every etag_window_seconds, as records age out of the window.
+    compress_min_size: int = 1024
+    etag_window_seconds: int = 300
+
+    jwt_secret: str = 'your-secret-key-change-in-production'
+
+    # Auth caches. Verified tokens are cached by hash until they expire; the
+    # revocation list is re-synced from Mongo at most every
+    # revocation_sync_seconds.
+    token_cache_size: int = 10000
+    profile_cache_size: int = 10000
+    profile_cache_ttl: int = 30
+    revocation_sync_seconds: float = 5.0
+    # Logins for emails not in the registered-email Bloom filter are rejected
+    # without a database lookup or a bcrypt check. Each sync re-reads sign-ups
+    # from email_filter_sync_overlap_seconds before the previous one, to cover
+    # insert latency and clock skew between workers.
+    email_filter_error_rate: float = 0.01
+    email_filter_min_capacity: int = 100000
+    email_filter_sync_seconds: float = 1.0
+    email_filter_sync_overlap_seconds: float = 60.0
+
+    # Password hashing pool. bcrypt releases the GIL, so threads keep it off
+    # the event loop; beyond workers + queue limit, requests are shed with a 503.
+    password_hash_workers: int = 4
+    password_hash_queue_limit: int = 32
+    password_hash_retry_after: int = 2
+
+    # Caching. cache_backend=redis points the shared caches at any
+    # Redis-protocol server given by cache_url (requires the optional `redis`
+    # package).
+    cache_backend: str = 'memory'
+    cache_url: str = 'redis://localhost:6379/0'
+    stats_cache_ttl: int = 60
+    stats_cache_size: int = 10000
+    insights_cache_ttl: int = 3600
+    insights_cache_size: int = 2000
+    # pandas/numpy are imported on first use. The API preloads them in the
+    # background once it is ready, so the first insights request doesn't wait.
+    preload_analytics: bool = True
+
+    # Rate limiting. Token buckets per route group, given as
+    # "requests/seconds": a bucket holds `requests` tokens and refills over
+    # `seconds`. Callers are keyed by user id from the bearer token, or by
+    # client IP (for login and register, and anonymous callers).
+    # rate_limit_backend=redis shares buckets between workers through
+    # cache_url; it defaults to cache_backend. Set rate_limit_proxy_hops to the
+    # number of trusted proxies in front of the API to take the IP from
+    # X-Forwarded-For.
+    rate_limit_enabled: bool = True
+    rate_limit_backend: Optional[str] = None
+    rate_limit_buckets: int = 100000
+    rate_limit_proxy_hops: int = 0
+    rate_limit_auth: str = '10/60'
+    rate_limit_writes: str = '120/60'
+    rate_limit_reads: str = '600/60'
+    rate_limit_analytics: str = '60/60'
+
+    bulk_max_items: int = 10000
+
+    # Health record storage. `collection` keeps one plain document per reading
+    # in health_records; `timeseries` keeps readings in a time-series
+    # collection (MongoDB 7.0+, for deletes by id) with user_id as the
+    # metaField. `dual` writes both and reads health_records while
+    # copy_records_to_timeseries backfills; see migrate_timeseries.py for the
+    # rollout.
+    records_storage: str = 'collection'
+    records_timeseries_collection: str = 'health_readings'
+    records_timeseries_granularity: str = 'minutes'
+
+    # Background jobs. job_worker_mode=inprocess runs a worker inside each API
+    # process; `external` leaves jobs to `python -m worker` processes.
+    job_worker_mode: str = 'inprocess'
+    job_worker_concurrency: int = 4
+    job_user_concurrency: int = 2
+    job_max_attempts: int = 5
+    job_retry_base_seconds: float = 2.0
+    job_lease_seconds: float = 300.0
+    job_poll_seconds: float = 1.0
+    job_retention_days: int = 7
+
+    # Caregiver cohorts. A cohort summary covers every patient linked to the
+    # caregiver and is cached per caregiver for cohort_cache_ttl seconds; the
+    # aggregation is cut off after cohort_max_time_ms so a panel load stays
+    # within a fixed latency budget.
+    cohort_max_patients: int = 1000
+    cohort_cache_ttl: int = 60
+    cohort_cache_size: int = 1000
+    cohort_max_time_ms: int = 2000
+
+    # Offline sync. Tokens older than the tombstone retention force a full
+    # resync. A reservation of sequence numbers left pending by a worker that
+    # died mid-write stops holding back /sync after sync_pending_seconds.
+    sync_page_size: int = 1000
+    sync_tombstone_days: int = 90
+    sync_pending_seconds: float = 60.0
+
+    # A migration claim with no heartbeat for this long is taken over
+    migration_lock_seconds: float = 60.0
+
+    # Medication reminders. Doses missed while no worker was running are
+    # counted at startup, up to reminder_catchup_days back.
+    reminder_default_timezone: str = 'UTC'
+    reminder_sync_seconds: float = 10.0
+    reminder_catchup_days: int = 30
+
+    cors_origins: str = '*'  # comma-separated
+
+    def __post_init__(self):
+        if self.records_storage not in RECORDS_STORAGE_MODES:
+            raise ValueError(f"records_storage must be one of {', '.join(RECORDS_STORAGE_MODES)}")
+        if self.rate_limit_backend is None:
+            object.__setattr__(self, 'rate_limit_backend', self.cache_backend)
+
+    @classmethod
+    def from_env(cls, **overrides) -> "Settings":
+        """Settings from the environment, with `overrides` taking precedence."""
+        names = {f.name: f for f in fields(cls)}
+        unknown = set(overrides) - set(names)
+        if unknown:
+            raise ValueError(f"Unknown setting {', '.join(sorted(unknown))}")
+        values = {}
+        for name, f in names.items():
+            raw = os.environ.get(name.upper())
+            if raw is not None:
+                values[name] = _parse(f.type, raw)
+        values.update(overrides)
+        for name in ("mongo_url", "db_name"):
+            if name not in values:
+                raise ValueError(f"{name.upper()} is not set")
+        return cls(**values)
+
+    @property
+    def rate_limits(self) -> dict:
+        return {
+            "auth": self.rate_limit_auth,
+            "writes": self.rate_limit_writes,
+            "reads": self.rate_limit_reads,
+            "analytics": self.rate_limit_analytics,
+        }
+
+def _parse(kind, raw: str):
+    if kind is bool:
+        return raw.lower() == 'true'
+    if kind in (int, float):
+        return kind(raw)
+    return raw
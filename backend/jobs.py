@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from runtime import current_runtime, db, settings
+
+logger = logging.getLogger(__name__)
+
+# Background jobs live in the jobs collection. Workers claim due jobs with a
+# lease they keep renewing; a job whose lease lapses (its worker died) is
+# requeued. job_slots holds each user's running-job count, which caps how many
+# of one user's jobs run at once across all workers. Handlers run on the
+# worker's event loop, so CPU-heavy work in them belongs in a thread.
+JOB_HANDLERS = {}
+USER_JOB_TYPES = set()  # job types users may enqueue through the API
+
+def job_handler(job_type: str, user_facing: bool = False):
+    def register(func):
+        JOB_HANDLERS[job_type] = func
+        if user_facing:
+            USER_JOB_TYPES.add(job_type)
+        return func
+    return register
+
+async def enqueue_job(user_id: str, job_type: str, params: Optional[dict] = None, max_attempts: Optional[int] = None) -> dict:
+    now = datetime.now(timezone.utc)
+    job = {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "type": job_type,
+        "params": params or {},
+        "status": "queued",
+        "attempts": 0,
+        "max_attempts": max_attempts or settings.job_max_attempts,
+        "run_at": now,
+        "created_at": now,
+        "started_at": None,
+        "finished_at": None,
+        "locked_until": None,
+        "worker": None,
+        "result": None,
+        "error": None,
+    }
+    await db.jobs.insert_one(job)
+    job.pop('_id', None)
+    current_runtime().job_wakeup.set()
+    return job
+
+async def _reserve_job_slot(user_id: str) -> bool:
+    try:
+        await db.job_slots.update_one(
+            {"_id": user_id, "running": {"$lt": settings.job_user_concurrency}},
+            {"$inc": {"running": 1}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False  # the user's slots are all taken
+
+async def _release_job_slot(user_id: str):
+    await db.job_slots.update_one({"_id": user_id, "running": {"$gt": 0}}, {"$inc": {"running": -1}})
+
+class JobWorker:
+    """Claims and runs due jobs, up to `concurrency` at a time (by default
+    job_worker_concurrency). Create it with the runtime it serves active."""
+
+    def __init__(self, concurrency: Optional[int] = None):
+        runtime = current_runtime()
+        self.name = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.concurrency = concurrency or runtime.settings.job_worker_concurrency
+        self.lease_seconds = runtime.settings.job_lease_seconds
+        self.wakeup = runtime.job_wakeup
+        self.running = set()
+        self._stopping = False
+
+    def stop(self):
+        self._stopping = True
+        self.wakeup.set()
+
+    async def claim(self) -> Optional[dict]:
+        saturated = []
+        for _ in range(10):
+            now = datetime.now(timezone.utc)
+            candidate = await db.jobs.find_one(
+                {"status": "queued", "run_at": {"$lte": now}, "user_id": {"$nin": saturated}},
+                {"_id": 0, "id": 1, "user_id": 1},
+                sort=[("run_at", ASCENDING)]
+            )
+            if candidate is None:
+                return None
+            if not await _reserve_job_slot(candidate['user_id']):
+                saturated.append(candidate['user_id'])
+                continue
+            job = await db.jobs.find_one_and_update(
+                {"id": candidate['id'], "status": "queued"},
+                {"$set": {"status": "running", "worker": self.name, "started_at": now,
+                          "locked_until": now + timedelta(seconds=self.lease_seconds)},
+                 "$inc": {"attempts": 1}},
+                return_document=ReturnDocument.AFTER
+            )
+            if job is not None:
+                job.pop('_id')
+                return job
+            await _release_job_slot(candidate['user_id'])  # another worker won it
+        return None
+
+    async def reap(self):
+        """Requeue (or fail, when out of attempts) jobs whose lease expired."""
+        now = datetime.now(timezone.utc)
+        expired = {"status": "running", "locked_until": {"$lt": now}}
+        async for job in db.jobs.find(expired, {"_id": 0, "id": 1, "user_id": 1, "attempts": 1, "max_attempts": 1}).limit(100):
+            if job['attempts'] >= job['max_attempts']:
+                update = {"status": "failed", "finished_at": now}
+            else:
+                update = {"status": "queued", "run_at": now}
+            result = await db.jobs.update_one(
+                {"id": job['id'], **expired},
+                {"$set": {**update, "worker": None, "locked_until": None, "error": "Worker lease expired"}}
+            )
+            if result.modified_count:
+                await _release_job_slot(job['user_id'])
+
+    async def _heartbeat(self, job_id: str):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            await db.jobs.update_one(
+                {"id": job_id, "worker": self.name},
+                {"$set": {"locked_until": datetime.now(timezone.utc) + timedelta(seconds=self.lease_seconds)}}
+            )
+
+    async def execute(self, job: dict):
+        heartbeat = asyncio.create_task(self._heartbeat(job['id']))
+        handler = JOB_HANDLERS.get(job['type'])
+        try:
+            if handler is None:
+                raise LookupError(f"No handler for job type {job['type']!r}")
+            result = await handler(job['user_id'], job['params'])
+            update = {"status": "succeeded", "result": result, "error": None,
+                      "finished_at": datetime.now(timezone.utc)}
+        except Exception as e:
+            logger.exception("Job %s (%s) failed on attempt %d", job['id'], job['type'], job['attempts'])
+            update = {"error": f"{type(e).__name__}: {e}"}
+            now = datetime.now(timezone.utc)
+            if handler is not None and job['attempts'] < job['max_attempts']:
+                # Exponential backoff with jitter
+                delay = settings.job_retry_base_seconds * 2 ** (job['attempts'] - 1) * random.uniform(0.8, 1.2)
+                update.update(status="queued", run_at=now + timedelta(seconds=delay))
+            else:
+                update.update(status="failed", finished_at=now)
+        finally:
+            heartbeat.cancel()
+        result = await db.jobs.update_one(
+            {"id": job['id'], "worker": self.name},
+            {"$set": {**update, "worker": None, "locked_until": None}}
+        )
+        # If our lease lapsed, the reaper already released the slot
+        if result.matched_count:
+            await _release_job_slot(job['user_id'])
+
+    def _finished(self, task):
+        self.running.discard(task)
+        self.wakeup.set()
+
+    async def run(self):
+        next_reap = 0.0
+        while not self._stopping:
+            self.wakeup.clear()
+            try:
+                if time.monotonic() >= next_reap:
+                    await self.reap()
+                    next_reap = time.monotonic() + self.lease_seconds / 3
+                while len(self.running) < self.concurrency and not self._stopping:
+                    job = await self.claim()
+                    if job is None:
+                        break
+                    task = asyncio.create_task(self.execute(job))
+                    self.running.add(task)
+                    task.add_done_callback(self._finished)
+            except Exception:
+                logger.exception("Job worker %s poll failed", self.name)
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), settings.job_poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+        if self.running:
+            await asyncio.gather(*self.running, return_exceptions=True)
+
+def job_view(job: dict) -> dict:
+    return {key: job.get(key) for key in (
+        "id", "type", "params", "status", "attempts", "max_attempts", "run_at",
+        "created_at", "started_at", "finished_at", "result", "error",
+    )}
@@ -0,0 +1,340 @@
+import asyncio
+import bisect
+import contextvars
+import json
+import logging
+import threading
+import time
+
+from pymongo import monitoring
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Counts open and checked-out connections across the client's pools."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.open = 0
+        self.in_use = 0
+        self.wait_timeouts = 0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.open -= 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        if event.reason == monitoring.ConnectionCheckOutFailedReason.TIMEOUT:
+            self.wait_timeouts += 1
+
+    def connection_checked_out(self, event):
+        self.in_use += 1
+
+    def connection_checked_in(self, event):
+        self.in_use -= 1
+
+    def stats(self) -> dict:
+        return {
+            "max_size": self.max_size,
+            "open": self.open,
+            "in_use": self.in_use,
+            "utilization": round(self.in_use / self.max_size, 3),
+            "wait_queue_timeouts": self.wait_timeouts,
+        }
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+class Histogram:
+    """Prometheus-style histogram; safe to observe from Motor's worker threads."""
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+
+    def render(self, name: str, labels: str) -> list:
+        sep = "," if labels else ""
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+        cumulative += self.counts[-1]
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {cumulative}')
+        return lines
+
+class Metrics:
+    """An app's request and Mongo metrics, rendered in Prometheus text format."""
+
+    def __init__(self, pool_monitor: PoolMonitor):
+        self.pool_monitor = pool_monitor
+        self.in_flight = 0
+        self.request_latency = {}
+        self.response_size = {}
+        self.command_latency = {}
+        self.documents_returned = {}
+        self.route_db = {}  # route -> [commands, seconds, documents]
+        self._lock = threading.Lock()
+
+    def _histogram(self, family: dict, key: tuple, buckets: tuple) -> Histogram:
+        histogram = family.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = family.setdefault(key, Histogram(buckets))
+        return histogram
+
+    def observe_request(self, method: str, route: str, status_code: int, seconds: float, size: int, trace):
+        self._histogram(self.request_latency, (method, route, str(status_code)), LATENCY_BUCKETS).observe(seconds)
+        self._histogram(self.response_size, (method, route), SIZE_BUCKETS).observe(size)
+        if trace.commands:
+            with self._lock:
+                totals = self.route_db.setdefault(route, [0, 0.0, 0])
+                totals[0] += len(trace.commands)
+                totals[1] += sum(c['seconds'] for c in trace.commands)
+                totals[2] += sum(c['documents'] for c in trace.commands)
+
+    def observe_command(self, command: str, collection: str, seconds: float, documents: int):
+        key = (command, collection)
+        self._histogram(self.command_latency, key, LATENCY_BUCKETS).observe(seconds)
+        with self._lock:
+            self.documents_returned[key] = self.documents_returned.get(key, 0) + documents
+
+    def render(self) -> str:
+        def labels(**values):
+            return ",".join(f'{k}="{_escape_label(v)}"' for k, v in values.items())
+        lines = [
+            "# HELP http_requests_in_flight Requests currently being served.",
+            "# TYPE http_requests_in_flight gauge",
+            f"http_requests_in_flight {self.in_flight}",
+            "# HELP http_request_duration_seconds Request latency by route.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, route, code), histogram in list(self.request_latency.items()):
+            lines += histogram.render("http_request_duration_seconds", labels(method=method, route=route, status=code))
+        lines += ["# HELP http_response_size_bytes Response body size by route.", "# TYPE http_response_size_bytes histogram"]
+        for (method, route), histogram in list(self.response_size.items()):
+            lines += histogram.render("http_response_size_bytes", labels(method=method, route=route))
+        lines += ["# HELP mongodb_command_duration_seconds Mongo command latency.", "# TYPE mongodb_command_duration_seconds histogram"]
+        for (command, collection), histogram in list(self.command_latency.items()):
+            lines += histogram.render("mongodb_command_duration_seconds", labels(command=command, collection=collection))
+        lines += ["# HELP mongodb_documents_returned_total Documents returned by Mongo commands.", "# TYPE mongodb_documents_returned_total counter"]
+        for (command, collection), count in list(self.documents_returned.items()):
+            lines.append(f"mongodb_documents_returned_total{{{labels(command=command, collection=collection)}}} {count}")
+        route_families = (
+            ("mongodb_route_commands_total", "Mongo commands issued per route.", 0),
+            ("mongodb_route_duration_seconds_total", "Time spent in Mongo per route.", 1),
+            ("mongodb_route_documents_returned_total", "Documents returned to each route.", 2),
+        )
+        for name, help_text, index in route_families:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for route, totals in list(self.route_db.items()):
+                lines.append(f"{name}{{{labels(route=route)}}} {totals[index]}")
+        pool = self.pool_monitor.stats()
+        lines += [
+            "# TYPE mongodb_pool_connections_open gauge", f"mongodb_pool_connections_open {pool['open']}",
+            "# TYPE mongodb_pool_connections_in_use gauge", f"mongodb_pool_connections_in_use {pool['in_use']}",
+            "# TYPE mongodb_pool_wait_queue_timeouts_total counter", f"mongodb_pool_wait_queue_timeouts_total {pool['wait_queue_timeouts']}",
+        ]
+        return "\n".join(lines) + "\n"
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class RequestTrace:
+    """Mongo commands issued while serving one request."""
+
+    def __init__(self):
+        self.commands = []
+
+# Motor copies the caller's context into its executor threads, so command
+# events can be attributed to the request that issued them.
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+# Commands worth explaining when a request turns out to be slow
+EXPLAINABLE_COMMANDS = {
+    "find": ("find", "filter", "sort", "projection", "limit", "hint"),
+    "aggregate": ("aggregate", "pipeline", "cursor", "hint"),
+    "count": ("count", "query", "hint"),
+}
+
+class CommandMonitor(monitoring.CommandListener):
+    """Times every Mongo command and records it against the current request."""
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+        self._pending = {}
+
+    def started(self, event):
+        command = event.command.get(event.command_name)
+        self._pending[(event.connection_id, event.request_id)] = (
+            command if isinstance(command, str) else "",
+            event.command if event.command_name in EXPLAINABLE_COMMANDS else None,
+        )
+
+    def succeeded(self, event):
+        self._finish(event, _documents_returned(event.reply))
+
+    def failed(self, event):
+        self._finish(event, 0)
+
+    def _finish(self, event, documents: int):
+        collection, command_doc = self._pending.pop((event.connection_id, event.request_id), ("", None))
+        seconds = event.duration_micros / 1e6
+        self.metrics.observe_command(event.command_name, collection, seconds, documents)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.commands.append({
+                "command": event.command_name,
+                "collection": collection,
+                "database": event.database_name,
+                "seconds": seconds,
+                "documents": documents,
+                "spec": command_doc,
+            })
+
+def _documents_returned(reply) -> int:
+    cursor = reply.get("cursor")
+    if cursor:
+        return len(cursor.get("firstBatch") or cursor.get("nextBatch") or [])
+    return 1 if "n" in reply or "value" in reply else 0
+
+def _plan_summary(plan: dict) -> str:
+    """Condense an explain winningPlan into e.g. 'LIMIT <- FETCH <- IXSCAN {user_id: 1, ...}'."""
+    stages = []
+    while plan:
+        stage = plan.get("stage", "?")
+        if "keyPattern" in plan:
+            stage += " " + json.dumps(plan["keyPattern"])
+        stages.append(stage)
+        plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0]
+    return " <- ".join(stages)
+
+def _query_shape(value):
+    """A command with its literal values replaced by their type names."""
+    if isinstance(value, dict):
+        return {k: _query_shape(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_query_shape(v) for v in value[:1]]
+    return type(value).__name__
+
+class PlanExplainer:
+    """Query plan summaries for slow requests. Each query shape is explained
+    at most once per `interval` seconds, with at most `concurrency` explains
+    in flight; commands past that are reported as skipped."""
+
+    def __init__(self, interval: float, concurrency: int):
+        # Query shape -> plan summary
+        self.plans = LRUCache(1000, ttl=interval)
+        self.slots = asyncio.Semaphore(concurrency)
+
+    async def explain(self, client, command: dict) -> str:
+        fields = EXPLAINABLE_COMMANDS[command['command']]
+        spec = {k: v for k, v in command['spec'].items() if k in fields}
+        shape = json.dumps(
+            [command['database'], command['command'], command['collection'], _query_shape(spec)],
+            sort_keys=True, default=str,
+        )
+        plan = self.plans.get(shape)
+        if plan is not None:
+            return plan
+        if self.slots.locked():
+            return "skipped"
+        async with self.slots:
+            try:
+                explained = await client[command['database']].command({"explain": spec, "verbosity": "queryPlanner"})
+                plan = _plan_summary(explained.get("queryPlanner", {}).get("winningPlan", {}))
+            except Exception as e:
+                plan = f"unavailable ({e})"
+        self.plans.set(shape, plan)
+        return plan
+
+async def log_slow_request(method: str, path: str, seconds: float, trace: RequestTrace, explain=None):
+    """Log a slow request's Mongo commands, with plans from `explain` (an
+    async callable taking a traced command) when given."""
+    summaries = []
+    for command in trace.commands:
+        summary = (
+            f"{command['command']} {command['collection']} "
+            f"{command['seconds'] * 1000:.1f}ms docs={command['documents']}"
+        )
+        if explain is not None and command['spec'] is not None:
+            summary += " plan=" + await explain(command)
+        summaries.append(summary)
+    logger.warning("Slow request %s %s took %.0fms: %s", method, path, seconds * 1000, "; ".join(summaries) or "no db calls")
+
+_background_tasks = set()
+
+class MetricsMiddleware:
+    """Records latency, in-flight count, response size and Mongo usage per route."""
+
+    def __init__(self, app, metrics: Metrics, slow_request_seconds: float = 1.0, explain=None):
+        self.app = app
+        self.metrics = metrics
+        self.slow_request_seconds = slow_request_seconds
+        self.explain = explain
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        metrics = self.metrics
+        trace = RequestTrace()
+        token = current_trace.set(trace)
+        response = {"status": 500, "size": 0}
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                db_seconds = sum(c['seconds'] for c in trace.commands)
+                message.setdefault("headers", []).append(
+                    (b"server-timing", f'db;dur={db_seconds * 1000:.1f};desc="{len(trace.commands)} commands"'.encode())
+                )
+            elif message["type"] == "http.response.body":
+                response["size"] += len(message.get("body", b""))
+            await send(message)
+
+        metrics.in_flight += 1
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            metrics.in_flight -= 1
+            current_trace.reset(token)
+            seconds = time.perf_counter() - started
+            route = scope.get("route")
+            route_path = route.path if route is not None else "unmatched"
+            metrics.observe_request(scope["method"], route_path, response["status"], seconds, response["size"], trace)
+            if seconds >= self.slow_request_seconds:
+                task = asyncio.create_task(log_slow_request(scope["method"], scope["path"], seconds, trace, self.explain))
+                _background_tasks.add(task)
+                task.add_done_callback(_background_tasks.discard)
+
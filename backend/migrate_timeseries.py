@@ -0,0 +1,40 @@
+"""Copy health records into the time-series collection while the API stays up.
+
+    1. Set RECORDS_STORAGE=dual on every API process and restart them. New
+       records are now written to both layouts; reads still use health_records.
+    2. cd backend && RECORDS_STORAGE=dual python -m migrate_timeseries
+       Copies older records in batches. Safe to stop and rerun; it resumes
+       from its checkpoint and skips records that are already copied.
+    3. Set RECORDS_STORAGE=timeseries on the API processes and restart them.
+
+health_records is left in place, so going back is just step 3 in reverse.
+"""
+import argparse
+import asyncio
+import json
+
+import server
+from config import Settings
+
+
+async def main(args):
+    settings = Settings.from_env()
+    if settings.records_storage == 'collection':
+        raise SystemExit("Run the API with RECORDS_STORAGE=dual first, then rerun with it set here too")
+    async with server.Runtime(settings).running() as runtime:
+        if args.restart:
+            await runtime.db.migrations.delete_one({"_id": "timeseries_copy"})
+        result = await server.copy_records_to_timeseries(batch_size=args.batch_size, pause=args.pause)
+        source, copy = await asyncio.gather(
+            runtime.db.health_records.estimated_document_count(),
+            runtime.db[settings.records_timeseries_collection].count_documents({}),
+        )
+        print(json.dumps({**result, "health_records": source, settings.records_timeseries_collection: copy}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--pause", type=float, default=0.05, help="seconds to sleep between batches")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start a new copy")
+    asyncio.run(main(parser.parse_args()))
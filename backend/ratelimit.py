@@ -0,0 +1,151 @@
+import logging
+import math
+import time
+from typing import Optional
+
+import jwt
+from starlette.datastructures import Headers
+from starlette.routing import Match
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+class MemoryRateLimitStore:
+    """Token buckets in process memory, so limits apply per worker. A bucket is
+    dropped once it has refilled, since a missing bucket counts as full."""
+
+    def __init__(self, maxsize: int = 100000):
+        self._buckets = LRUCache(maxsize, ttl=0)
+
+    async def take(self, key: str, capacity: int, rate: float, now: float) -> tuple:
+        """Take one token. Returns (allowed, tokens left)."""
+        tokens, updated = self._buckets.get(key) or (capacity, now)
+        tokens = min(capacity, tokens + (now - updated) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets.set(key, (tokens, now), ttl=(capacity - tokens) / rate)
+        return allowed, tokens
+
+# Refill and take in one round trip, atomically across workers
+_TAKE_TOKEN_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+class RedisRateLimitStore:
+    """Token buckets in a Redis-protocol server, shared by all workers."""
+
+    def __init__(self, url: str, prefix: str = "healthdiary:ratelimit:"):
+        import redis.asyncio as redis
+        self._redis = redis.from_url(url)
+        self._take = self._redis.register_script(_TAKE_TOKEN_SCRIPT)
+        self.prefix = prefix
+
+    async def take(self, key: str, capacity: int, rate: float, now: float) -> tuple:
+        allowed, tokens = await self._take(keys=[self.prefix + key], args=[capacity, rate, now])
+        return bool(allowed), float(tokens)
+
+def make_rate_limit_store(settings):
+    if settings.rate_limit_backend == 'redis':
+        return RedisRateLimitStore(settings.cache_url)
+    return MemoryRateLimitStore(settings.rate_limit_buckets)
+
+RATE_LIMIT_IP_PATHS = {"/api/auth/login", "/api/auth/register"}
+RATE_LIMIT_EXEMPT_PATHS = {"/api/healthz", "/api/readyz"}
+
+def rate_limit_group(method: str, path: str) -> Optional[str]:
+    if method == "OPTIONS" or not path.startswith("/api/") or path in RATE_LIMIT_EXEMPT_PATHS:
+        return None
+    if path in RATE_LIMIT_IP_PATHS:
+        return "auth"
+    if path.startswith(("/api/analytics/", "/api/cohort/", "/api/search")):
+        return "analytics"
+    return "reads" if method in ("GET", "HEAD") else "writes"
+
+def client_ip(scope, proxy_hops: int = 0) -> str:
+    if proxy_hops:
+        forwarded = [hop.strip() for hop in Headers(scope=scope).get("x-forwarded-for", "").split(",") if hop.strip()]
+        if len(forwarded) >= proxy_hops:
+            return forwarded[-proxy_hops]
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+class RateLimitMiddleware:
+    """Token-bucket limits per route group (`limits`, group -> "requests/seconds"),
+    with RateLimit-* headers on every limited response and Retry-After on a
+    429. Callers are keyed by the user id `verify_token` returns for their
+    bearer token, else by IP. If the store is unreachable, requests go
+    through unlimited."""
+
+    def __init__(self, app, store, limits: dict, verify_token, proxy_hops: int = 0):
+        self.app = app
+        self.store = store
+        self.verify_token = verify_token
+        self.proxy_hops = proxy_hops
+        self.limits = {}
+        for group, spec in limits.items():
+            requests, _, seconds = spec.partition("/")
+            capacity, window = int(requests), float(seconds or 1)
+            self.limits[group] = (capacity, capacity / window, f"{capacity};w={window:g}".encode())
+
+    def _identity(self, scope, group: str) -> str:
+        if group != "auth":
+            scheme, _, token = Headers(scope=scope).get("authorization", "").partition(" ")
+            if scheme.lower() == "bearer":
+                try:
+                    return "user:" + self.verify_token(token)
+                except jwt.InvalidTokenError:
+                    pass
+        return "ip:" + client_ip(scope, self.proxy_hops)
+
+    async def __call__(self, scope, receive, send):
+        group = rate_limit_group(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if group is None:
+            return await self.app(scope, receive, send)
+        capacity, rate, policy = self.limits[group]
+        try:
+            allowed, tokens = await self.store.take(f"{group}:{self._identity(scope, group)}", capacity, rate, time.time())
+        except Exception as e:
+            logger.warning("Rate limit store unavailable, not limiting: %s", e)
+            return await self.app(scope, receive, send)
+        headers = [
+            (b"ratelimit-limit", str(capacity).encode()),
+            (b"ratelimit-remaining", str(int(tokens)).encode()),
+            (b"ratelimit-reset", str(math.ceil((capacity - tokens) / rate)).encode()),
+            (b"ratelimit-policy", policy),
+        ]
+        if not allowed:
+            for route in scope["app"].router.routes:
+                if route.matches(scope)[0] == Match.FULL:
+                    scope["route"] = route  # so metrics label the 429 by route
+                    break
+            body = b'{"detail":"Too many requests"}'
+            await send({"type": "http.response.start", "status": 429, "headers": headers + [
+                (b"retry-after", str(math.ceil((1 - tokens) / rate)).encode()),
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ]})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", []).extend(headers)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
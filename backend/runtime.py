@@ -0,0 +1,42 @@
+import contextvars
+from contextlib import contextmanager
+
+# The server.Runtime serving the current request or background task. Each app
+# sets its own for every request and for its lifespan, so tasks started from
+# either inherit it and two apps in one process never share state.
+_current = contextvars.ContextVar("runtime", default=None)
+
+def current_runtime():
+    runtime = _current.get()
+    if runtime is None:
+        raise RuntimeError("No runtime is active; serve through create_app() or enter Runtime.running()")
+    return runtime
+
+@contextmanager
+def use_runtime(runtime):
+    token = _current.set(runtime)
+    try:
+        yield runtime
+    finally:
+        _current.reset(token)
+
+class RuntimeProxy:
+    """Stands in for one attribute of the active runtime, so module code can
+    keep writing `db.users` or `settings.bulk_max_items`."""
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(getattr(current_runtime(), self._name), attr)
+
+    def __getitem__(self, key):
+        return getattr(current_runtime(), self._name)[key]
+
+    def __repr__(self):
+        return f"<active runtime's {self._name}>"
+
+settings = RuntimeProxy("settings")
+client = RuntimeProxy("client")
+db = RuntimeProxy("db")
+analytics_db = RuntimeProxy("analytics_db")
@@ -0,0 +1,221 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from runtime import db
+from util import as_utc, cursor_batches
+
+logger = logging.getLogger(__name__)
+
+# Medication reminders. Every active medication's time_of_day slots sit in
+# one min-heap per app, keyed by the next due dose. Entries carry the
+# medication's version, so an update or delete just bumps or drops the
+# version and stale entries are skipped when they surface.
+REMINDER_TIMES = {"Morning": (8, 0), "Afternoon": (14, 0), "Evening": (18, 0), "Night": (21, 0)}
+REMINDER_LOAD_BATCH_SIZE = 5000
+
+def _slot_time(slot: str) -> tuple:
+    """Map a time_of_day entry ("Morning" or "HH:MM") to (hour, minute)."""
+    if slot in REMINDER_TIMES:
+        return REMINDER_TIMES[slot]
+    try:
+        hour, minute = (int(part) for part in slot.split(":"))
+        if 0 <= hour < 24 and 0 <= minute < 60:
+            return hour, minute
+    except ValueError:
+        pass
+    return REMINDER_TIMES["Morning"]
+
+def slot_key(slot: str) -> str:
+    return "{:02d}{:02d}".format(*_slot_time(slot))
+
+class ScheduledMedication:
+    __slots__ = ("id", "user_id", "name", "dosage", "slots", "zone", "first_day", "last_day", "version")
+
+    def __init__(self, doc: dict, version: int, default_zone: str = 'UTC'):
+        self.id = doc['id']
+        self.user_id = doc['user_id']
+        self.name = doc['name']
+        self.dosage = doc['dosage']
+        self.slots = tuple(dict.fromkeys(doc.get('time_of_day') or ()))
+        self.zone = ZoneInfo(doc.get('timezone') or default_zone)
+        # start/end dates are calendar days (the UI sends midnight UTC)
+        self.first_day = as_utc(doc['start_date']).date()
+        self.last_day = as_utc(doc['end_date']).date() if doc.get('end_date') else date.max
+        self.version = version
+
+    def next_dose(self, slot: str, after: datetime) -> Optional[datetime]:
+        """First dose of `slot` strictly after `after`, or None once the course ends."""
+        hour, minute = _slot_time(slot)
+        day = max(after.astimezone(self.zone).date(), self.first_day)
+        while day <= self.last_day:
+            due = datetime(day.year, day.month, day.day, hour, minute, tzinfo=self.zone).astimezone(timezone.utc)
+            if due > after:
+                return due
+            day += timedelta(days=1)
+        return None
+
+class ReminderScheduler:
+    """In-memory index of upcoming doses across all active medications.
+    Medications without a timezone are scheduled in `default_zone`; changes
+    made by other workers are picked up every `sync_seconds`, and missed()
+    looks back at most `catchup_days`."""
+
+    def __init__(self, default_zone: str = 'UTC', sync_seconds: float = 10, catchup_days: int = 30):
+        self.default_zone = default_zone
+        self.sync_seconds = sync_seconds
+        self.catchup_days = catchup_days
+        self.medications = {}  # medication id -> ScheduledMedication
+        self.by_user = {}  # user id -> set of medication ids
+        self.heap = []  # (due timestamp, medication id, version, slot)
+        self.handlers = []  # async callables taking [(medication, slot, due_at), ...] as doses come due
+        self.slot_count = 0
+        self._versions = itertools.count()
+        self._synced_at = None
+        self.loaded_at = None
+        self._wakeup = asyncio.Event()
+
+    def _schedule(self, medication: ScheduledMedication, now: datetime) -> list:
+        entries = []
+        for slot in medication.slots:
+            due = medication.next_dose(slot, now)
+            if due is not None:
+                entries.append((due.timestamp(), medication.id, medication.version, slot))
+        return entries
+
+    def _add(self, doc: dict, now: datetime) -> list:
+        self.remove(doc['id'])
+        if not doc.get('active', True):
+            return []
+        medication = ScheduledMedication(doc, next(self._versions), self.default_zone)
+        entries = self._schedule(medication, now)
+        if entries:
+            self.medications[medication.id] = medication
+            self.by_user.setdefault(medication.user_id, set()).add(medication.id)
+            self.slot_count += len(medication.slots)
+        return entries
+
+    def upsert(self, doc: dict):
+        """(Re)schedule a medication document; inactive or finished ones are dropped."""
+        for entry in self._add(doc, datetime.now(timezone.utc)):
+            heapq.heappush(self.heap, entry)
+        self._compact()
+        self._wakeup.set()
+
+    def remove(self, medication_id: str):
+        medication = self.medications.pop(medication_id, None)
+        if medication is None:
+            return
+        self.slot_count -= len(medication.slots)
+        user_meds = self.by_user.get(medication.user_id)
+        if user_meds is not None:
+            user_meds.discard(medication_id)
+            if not user_meds:
+                del self.by_user[medication.user_id]
+
+    def _live(self, entry: tuple) -> bool:
+        medication = self.medications.get(entry[1])
+        return medication is not None and medication.version == entry[2]
+
+    def _compact(self):
+        # Drop stale entries once they outnumber the live ones
+        if len(self.heap) > max(1024, 2 * self.slot_count):
+            self.heap = [entry for entry in self.heap if self._live(entry)]
+            heapq.heapify(self.heap)
+
+    async def load(self):
+        """Build the index from every active medication in one pass."""
+        self.medications, self.by_user, self.heap, self.slot_count = {}, {}, [], 0
+        self._synced_at = self.loaded_at = datetime.now(timezone.utc)
+        now = self._synced_at
+        projection = {"_id": 0, "id": 1, "user_id": 1, "name": 1, "dosage": 1, "time_of_day": 1,
+                      "start_date": 1, "end_date": 1, "timezone": 1}
+        cursor = db.medications.find({"active": True}, projection)
+        async for batch in cursor_batches(cursor, REMINDER_LOAD_BATCH_SIZE):
+            for doc in batch:
+                self.heap.extend(self._add(doc, now))
+        heapq.heapify(self.heap)
+
+    async def sync(self):
+        """Apply medications created or changed by any worker since the last sync."""
+        since = self._synced_at - timedelta(seconds=self.sync_seconds)
+        self._synced_at = datetime.now(timezone.utc)
+        async for doc in db.medications.find({"updated_at": {"$gte": since}}, {"_id": 0}):
+            self.upsert(doc)
+
+    def missed(self, since: dict, now: datetime) -> list:
+        """Doses that came due after each slot's `since` entry (keyed by
+        (medication id, slot)) and up to `now`, as (medication, slot, due_at).
+        Slots without an entry are skipped."""
+        floor = now - timedelta(days=self.catchup_days)
+        fired = []
+        for medication in self.medications.values():
+            for slot in medication.slots:
+                start = since.get((medication.id, slot))
+                if start is None:
+                    continue
+                due = medication.next_dose(slot, max(start, floor))
+                while due is not None and due <= now:
+                    fired.append((medication, slot, due))
+                    due = medication.next_dose(slot, due)
+        return fired
+
+    def due(self, user_id: str, start: datetime, end: datetime) -> list:
+        """Doses for one user falling in (start, end], soonest first."""
+        doses = []
+        for medication_id in self.by_user.get(user_id, ()):
+            medication = self.medications[medication_id]
+            for slot in medication.slots:
+                due = medication.next_dose(slot, start)
+                while due is not None and due <= end:
+                    doses.append({"medication_id": medication.id, "name": medication.name,
+                                  "dosage": medication.dosage, "time_of_day": slot, "due_at": due})
+                    due = medication.next_dose(slot, due)
+        doses.sort(key=lambda dose: dose['due_at'])
+        return doses
+
+    async def fire_due(self, now: float):
+        """Pop every dose due by `now`, reschedule its next one and run the handlers."""
+        fired = []
+        while self.heap and self.heap[0][0] <= now:
+            entry = heapq.heappop(self.heap)
+            if not self._live(entry):
+                continue
+            medication, slot = self.medications[entry[1]], entry[3]
+            due_at = datetime.fromtimestamp(entry[0], timezone.utc)
+            next_due = medication.next_dose(slot, due_at)
+            if next_due is not None:
+                heapq.heappush(self.heap, (next_due.timestamp(), medication.id, medication.version, slot))
+            fired.append((medication, slot, due_at))
+        if not fired:
+            return
+        for handler in self.handlers:
+            try:
+                await handler(fired)
+            except Exception:
+                logger.exception("Reminder handler %s failed", handler.__name__)
+
+    async def run(self):
+        next_sync = time.monotonic() + self.sync_seconds
+        while True:
+            try:
+                await self.fire_due(time.time())
+                if time.monotonic() >= next_sync:
+                    await self.sync()
+                    next_sync = time.monotonic() + self.sync_seconds
+            except Exception:
+                logger.exception("Reminder scheduler tick failed")
+            timeout = next_sync - time.monotonic()
+            if self.heap:
+                timeout = min(timeout, self.heap[0][0] - time.time())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(timeout, 0))
+            except asyncio.TimeoutError:
+                pass
+
@@ -1,53 +1,259 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, Response, status
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
-import os
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel, ReadPreference, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, ExecutionTimeout, OperationFailure
 import logging
-from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, ValidationError, field_validator
+from typing import List, Literal, Optional
 import uuid
-from datetime import datetime, timezone, timedelta
+import hashlib
+import io
+import csv
+import json
+import re
+import base64
+import asyncio
+import time
+import threading
+import heapq
+import math
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 import bcrypt
 import jwt
+import orjson
+from bson import ObjectId
+from starlette.datastructures import Headers
 
-ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / '.env')
+from cache import LRUCache, make_cache
+from compress import CompressionMiddleware
+from config import Settings
+from jobs import USER_JOB_TYPES, JobWorker, enqueue_job, job_handler, job_view
+from metrics import CommandMonitor, Metrics, MetricsMiddleware, PlanExplainer, PoolMonitor
+from ratelimit import RateLimitMiddleware, make_rate_limit_store
+from runtime import RuntimeProxy, analytics_db, current_runtime, db, settings, use_runtime
+from scheduler import ReminderScheduler, slot_key
+from util import as_utc, cursor_batches
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Conditional GETs. Only endpoints that read from the primary get ETags: a
+# lagging secondary could serve pre-write data under the post-write version.
+ETAG_PATHS = {
+    "/api/health-records": True,  # path -> has a lookback window
+    "/api/medications": False,
+    "/api/analytics/trends": True,
+    "/api/analytics/stats": False,
+}
 
-# JWT Secret
-JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key-change-in-production')
+READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+class Runtime:
+    """Everything one app (or worker process) builds from its Settings: the
+    Mongo client, caches, the password pool and the reminder index. Runtimes
+    share nothing, so apps built with different settings can live side by
+    side. Module code reaches the active one through the proxies below."""
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.client = self.db = self.analytics_db = None
+        self.ready = False
+        self.pool_monitor = PoolMonitor(settings.mongo_max_pool_size)
+        self.metrics = Metrics(self.pool_monitor)
+        self.command_monitor = CommandMonitor(self.metrics)
+        self.explainer = PlanExplainer(settings.explain_interval_seconds, settings.explain_concurrency)
+        self.password_executor = self._password_executor()
+        self.password_jobs = 0
+        self.password_jobs_lock = threading.Lock()
+        self.stats_cache = make_cache(settings, settings.stats_cache_size, settings.stats_cache_ttl)
+        self.insights_cache = make_cache(settings, settings.insights_cache_size, settings.insights_cache_ttl)
+        self.cohort_cache = make_cache(settings, settings.cohort_cache_size, settings.cohort_cache_ttl)
+        self.verified_tokens = LRUCache(settings.token_cache_size, ttl=JWT_EXPIRATION_HOURS * 3600)
+        self.profile_cache = LRUCache(settings.profile_cache_size, ttl=settings.profile_cache_ttl)
+        self.revoked_tokens = {}  # token hash -> expiry timestamp
+        self.revoked_users = {}  # user id -> tokens issued before this timestamp are revoked
+        self.revocations_synced_at = None  # (monotonic, wall clock) of the last sync
+        self.registered_emails = RegisteredEmails()
+        self.reminder_scheduler = ReminderScheduler(
+            settings.reminder_default_timezone, settings.reminder_sync_seconds, settings.reminder_catchup_days
+        )
+        self.reminder_scheduler.handlers.append(count_scheduled_doses)
+        self.job_wakeup = asyncio.Event()
+
+    def _password_executor(self) -> ThreadPoolExecutor:
+        return ThreadPoolExecutor(max_workers=self.settings.password_hash_workers, thread_name_prefix="bcrypt")
+
+    async def open(self):
+        """Connect, warm the pool and bring indexes and migrations up to date."""
+        settings = self.settings
+        self.client = AsyncIOMotorClient(
+            settings.mongo_url,
+            tz_aware=True,  # BSON dates come back as UTC-aware datetimes
+            tzinfo=timezone.utc,
+            maxPoolSize=settings.mongo_max_pool_size,
+            minPoolSize=settings.mongo_min_pool_size,
+            waitQueueTimeoutMS=settings.mongo_wait_queue_timeout_ms,
+            serverSelectionTimeoutMS=settings.mongo_server_selection_timeout_ms,
+            connectTimeoutMS=settings.mongo_connect_timeout_ms,
+            socketTimeoutMS=settings.mongo_socket_timeout_ms,
+            readPreference=settings.mongo_read_preference,
+            event_listeners=[self.pool_monitor, self.command_monitor],
+        )
+        self.db = self.client[settings.db_name]
+        self.analytics_db = self.client.get_database(
+            settings.db_name, read_preference=READ_PREFERENCES[settings.mongo_analytics_read_preference]
+        )
+        if self.password_executor is None:
+            self.password_executor = self._password_executor()
+        # Open minPoolSize connections up front so the first requests don't pay for them
+        await asyncio.gather(*(self.client.admin.command("ping") for _ in range(max(1, settings.mongo_min_pool_size))))
+        await ensure_indexes()
+        await run_migrations()
+
+    def close(self):
+        self.client.close()
+        # Only this runtime's pool; other apps in the process keep theirs
+        self.password_executor.shutdown(wait=False)
+        self.password_executor = None
+
+    @asynccontextmanager
+    async def running(self):
+        """Make this the active runtime and hold its connection open for the
+        block. Shared by the API lifespan, the job worker and scripts."""
+        with use_runtime(self):
+            await self.open()
+            try:
+                yield self
+            finally:
+                self.close()
+
+    async def explain_plan(self, command: dict) -> str:
+        return await self.explainer.explain(self.client, command)
+
+stats_cache = RuntimeProxy("stats_cache")
+insights_cache = RuntimeProxy("insights_cache")
+cohort_cache = RuntimeProxy("cohort_cache")
+verified_tokens = RuntimeProxy("verified_tokens")
+profile_cache = RuntimeProxy("profile_cache")
+registered_emails = RuntimeProxy("registered_emails")
+reminder_scheduler = RuntimeProxy("reminder_scheduler")
+metrics = RuntimeProxy("metrics")
+pool_monitor = RuntimeProxy("pool_monitor")
+
+def app_lifespan(runtime: Runtime):
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        async with runtime.running():
+            await sync_revocations()
+            await runtime.registered_emails.load()
+            await runtime.reminder_scheduler.load()
+            await count_missed_doses()
+            reminder_task = asyncio.create_task(runtime.reminder_scheduler.run())
+            job_worker = JobWorker() if runtime.settings.job_worker_mode == 'inprocess' else None
+            job_task = asyncio.create_task(job_worker.run()) if job_worker else None
+            if runtime.settings.preload_analytics:
+                # Imported before reporting ready, so the first analytics
+                # request doesn't pay for it
+                await asyncio.to_thread(preload_analytics)
+            runtime.ready = True
+            yield
+            runtime.ready = False
+            reminder_task.cancel()
+            if job_worker:
+                # Unfinished jobs are requeued by another worker once their lease expires
+                job_worker.stop()
+                await asyncio.wait([job_task], timeout=JOB_SHUTDOWN_SECONDS)
+                job_task.cancel()
+    return lifespan
+
+def preload_analytics():
+    import numpy  # noqa: F401
+    import pandas  # noqa: F401
+
+# JWT
 JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_HOURS = 72
 
+# Pagination
+PAGE_SIZE_DEFAULT = 500
+PAGE_SIZE_MAX = 1000
+STREAM_BATCH_SIZE = 500
+
+# Export
+EXPORT_BATCH_SIZE = 1000
+EXPORT_ROW_GROUP_SIZE = 10000
+
+# Bulk ingest
+BULK_CHUNK_SIZE = 500
+
+# Health record storage
+# Records newer than this when a copy starts are left to the dual writes
+RECORDS_COPY_SETTLE_SECONDS = 60
+
+# How long shutdown waits for the in-process job worker's running jobs
+JOB_SHUTDOWN_SECONDS = 10
+
+# Notes search
+SEARCH_PAGE_SIZE = 20
+SEARCH_PAGE_MAX = 100
+SEARCH_MAX_OFFSET = 1000
+# result type -> (collection, date field used for from/to and in results)
+SEARCH_SOURCES = {
+    "health_record": (None, "recorded_at"),  # records_collection(db)
+    "medication": ("medications", "start_date"),
+}
+
+# Caregiver cohorts
+COHORT_WINDOW_DAYS_MAX = 90
+
 # Security
 security = HTTPBearer()
 
-# Create the main app
-app = FastAPI()
 api_router = APIRouter(prefix="/api")
 
 # Models
+def _validate_timezone(value: Optional[str]) -> Optional[str]:
+    if value is not None:
+        try:
+            ZoneInfo(value)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"Unknown timezone: {value}")
+    return value
+
 class UserRegister(BaseModel):
     name: str
     email: EmailStr
     password: str
+    timezone: Optional[str] = None  # IANA name streak days are counted in
+
+    _check_timezone = field_validator("timezone")(_validate_timezone)
 
 class UserLogin(BaseModel):
     email: EmailStr
     password: str
+    timezone: Optional[str] = None
+
+    _check_timezone = field_validator("timezone")(_validate_timezone)
+
+class PasswordChange(BaseModel):
+    current_password: str
+    new_password: str
 
 class User(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
     email: EmailStr
+    timezone: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class HealthRecordCreate(BaseModel):
@@ -59,6 +265,7 @@ class HealthRecordCreate(BaseModel):
     heart_rate: Optional[int] = None
     notes: Optional[str] = None
     recorded_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    idempotency_key: Optional[str] = Field(None, max_length=128)
 
 class HealthRecord(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -72,6 +279,7 @@ class HealthRecord(BaseModel):
     heart_rate: Optional[int] = None
     notes: Optional[str] = None
     recorded_at: datetime
+    idempotency_key: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class MedicationCreate(BaseModel):
@@ -82,6 +290,9 @@ class MedicationCreate(BaseModel):
     start_date: datetime
     end_date: Optional[datetime] = None
     notes: Optional[str] = None
+    timezone: Optional[str] = None  # IANA name reminders are scheduled in
+
+    _check_timezone = field_validator("timezone")(_validate_timezone)
 
 class Medication(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -94,8 +305,1212 @@ class Medication(BaseModel):
     start_date: datetime
     end_date: Optional[datetime] = None
     notes: Optional[str] = None
+    timezone: Optional[str] = None
     active: bool = True
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+# Endpoints that skip response_model validation project documents down to
+# the model's fields, so bookkeeping fields such as sync_seq stay internal
+def model_projection(model) -> dict:
+    return {"_id": 0, **{name: 1 for name in model.model_fields}}
+
+RECORD_PROJECTION = model_projection(HealthRecord)
+MEDICATION_PROJECTION = model_projection(Medication)
+
+class DueDose(BaseModel):
+    medication_id: str
+    name: str
+    dosage: str
+    time_of_day: str
+    due_at: datetime
+
+class DoseCreate(BaseModel):
+    scheduled_for: datetime
+    status: Literal["taken", "skipped"] = "taken"
+    taken_at: Optional[datetime] = None
+    notes: Optional[str] = None
+
+class DoseEvent(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str
+    medication_id: str
+    scheduled_for: datetime
+    status: str
+    taken_at: Optional[datetime] = None
+    notes: Optional[str] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class JobCreate(BaseModel):
+    type: str
+    params: dict = Field(default_factory=dict)
+
+class CareLinkCreate(BaseModel):
+    caregiver_email: EmailStr
+
+class CareLink(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    caregiver_id: str
+    patient_id: str
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class CareInvitation(BaseModel):
+    """A pending care link, addressed by email until the caregiver accepts it."""
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    patient_id: str
+    caregiver_email: str
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+VITAL_FIELDS = ("systolic_bp", "diastolic_bp", "blood_sugar", "weight", "temperature", "heart_rate")
+
+# Indexes created at startup. Window queries on health records are
+# answered from the (user_id, recorded_at) index, so their cost depends on
+# the size of the window rather than on the user's whole history.
+def collection_indexes() -> dict:
+    # Built when ensure_indexes runs, so the TTLs follow the active settings
+    return {
+        "users": [
+            IndexModel([("email", ASCENDING)], unique=True),
+            IndexModel([("id", ASCENDING)], unique=True),
+            IndexModel([("created_at", ASCENDING)]),
+        ],
+        "health_records": [
+            IndexModel([("user_id", ASCENDING), ("recorded_at", DESCENDING), ("id", DESCENDING)]),
+            IndexModel([("id", ASCENDING)], unique=True),
+            IndexModel([("user_id", ASCENDING), ("sync_seq", ASCENDING)]),
+            # Lets device syncs retry safely: a key is written at most once per user
+            IndexModel(
+                [("user_id", ASCENDING), ("idempotency_key", ASCENDING)],
+                unique=True,
+                partialFilterExpression={"idempotency_key": {"$type": "string"}}
+            ),
+            # The user_id prefix keeps note searches inside one user's entries
+            IndexModel([("user_id", ASCENDING), ("notes", TEXT)]),
+        ],
+        "medications": [
+            IndexModel([("user_id", ASCENDING), ("active", ASCENDING), ("created_at", DESCENDING)]),
+            IndexModel([("id", ASCENDING)], unique=True),
+            # Lets each worker's reminder scheduler pick up changes made elsewhere
+            IndexModel([("updated_at", ASCENDING)]),
+            IndexModel([("user_id", ASCENDING), ("sync_seq", ASCENDING)]),
+            IndexModel([("user_id", ASCENDING), ("notes", TEXT)]),
+        ],
+        "jobs": [
+            IndexModel([("id", ASCENDING)], unique=True),
+            IndexModel([("status", ASCENDING), ("run_at", ASCENDING)]),
+            IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)]),
+            IndexModel([("finished_at", ASCENDING)], expireAfterSeconds=settings.job_retention_days * 86400),
+        ],
+        "sync_tombstones": [
+            IndexModel([("user_id", ASCENDING), ("sync_seq", ASCENDING)]),
+            IndexModel([("deleted_at", ASCENDING)], expireAfterSeconds=settings.sync_tombstone_days * 86400),
+        ],
+        "user_progress": [
+            IndexModel([("user_id", ASCENDING)], unique=True),
+        ],
+        "medication_doses": [
+            # One outcome per scheduled dose
+            IndexModel([("medication_id", ASCENDING), ("scheduled_for", ASCENDING)], unique=True),
+            IndexModel([("user_id", ASCENDING), ("scheduled_for", DESCENDING)]),
+        ],
+        "adherence_summaries": [
+            IndexModel([("user_id", ASCENDING)], unique=True),
+        ],
+        "care_links": [
+            IndexModel([("caregiver_id", ASCENDING), ("patient_id", ASCENDING)], unique=True),
+            IndexModel([("patient_id", ASCENDING)]),
+            IndexModel([("id", ASCENDING)], unique=True),
+        ],
+        "care_invitations": [
+            IndexModel([("patient_id", ASCENDING), ("caregiver_email", ASCENDING)], unique=True),
+            IndexModel([("caregiver_email", ASCENDING)]),
+            IndexModel([("id", ASCENDING)], unique=True),
+        ],
+        "revoked_tokens": [
+            IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+            IndexModel([("revoked_at", ASCENDING)]),
+        ],
+        # Time-series collections can't hold unique indexes, so idempotency keys
+        # for readings stored there are claimed here first
+        "record_keys": [
+            IndexModel([("user_id", ASCENDING), ("idempotency_key", ASCENDING)], unique=True),
+            IndexModel([("user_id", ASCENDING), ("id", ASCENDING)]),
+        ],
+    }
+
+# Secondary indexes on the time-series collection (text indexes aren't supported there)
+TIMESERIES_INDEXES = [
+    IndexModel([("user_id", ASCENDING), ("recorded_at", DESCENDING)]),
+    IndexModel([("user_id", ASCENDING), ("id", ASCENDING)]),
+    IndexModel([("user_id", ASCENDING), ("sync_seq", ASCENDING)]),
+    IndexModel([("user_id", ASCENDING), ("idempotency_key", ASCENDING)]),
+    IndexModel([("id", ASCENDING)]),
+]
+
+async def ensure_indexes():
+    for collection_name, indexes in collection_indexes().items():
+        try:
+            await db[collection_name].create_indexes(indexes)
+        except DuplicateKeyError as e:
+            # Keep serving; the unique indexes are built once the duplicates are resolved
+            logger.error("Existing %s documents violate a unique index, not created: %s", collection_name, e)
+    if settings.records_storage != 'collection':
+        await ensure_timeseries_collection()
+
+async def ensure_timeseries_collection():
+    try:
+        await db.create_collection(settings.records_timeseries_collection, timeseries={
+            "timeField": "recorded_at",
+            "metaField": "user_id",
+            "granularity": settings.records_timeseries_granularity,
+        })
+    except CollectionInvalid:
+        pass  # already exists
+    await db[settings.records_timeseries_collection].create_indexes(TIMESERIES_INDEXES)
+
+# Fields that older versions of the API stored as ISO strings
+DATETIME_FIELDS = {
+    "users": ("created_at",),
+    "health_records": ("recorded_at", "created_at"),
+    "medications": ("start_date", "end_date", "created_at"),
+}
+
+async def migrate_iso_dates(batch_size: int = 1000):
+    """Convert ISO string dates to native BSON datetimes."""
+    for collection_name, fields in DATETIME_FIELDS.items():
+        collection = db[collection_name]
+        for field in fields:
+            ops = []
+            cursor = collection.find({field: {"$type": "string"}}, {"_id": 1, field: 1})
+            async for doc in cursor:
+                try:
+                    value = datetime.fromisoformat(doc[field])
+                except ValueError:
+                    logger.warning("Skipping unparseable %s.%s on %s", collection_name, field, doc['_id'])
+                    continue
+                ops.append(UpdateOne({"_id": doc['_id']}, {"$set": {field: value}}))
+                if len(ops) >= batch_size:
+                    await collection.bulk_write(ops, ordered=False)
+                    ops = []
+            if ops:
+                await collection.bulk_write(ops, ordered=False)
+
+async def backfill_user_progress(for_user: Optional[str] = None):
+    """Build user_progress documents from existing health records and medications,
+    for every user or just `for_user`."""
+    match = [{"$match": {"user_id": for_user}}] if for_user else []
+    # Bucket each user's days in their own timezone; users that never sent
+    # one stay on UTC
+    pipeline = match + [
+        {"$lookup": {"from": "users", "localField": "user_id", "foreignField": "id", "as": "_owner"}},
+        {"$addFields": {"_tz": {"$ifNull": [{"$arrayElemAt": ["$_owner.timezone", 0]}, "UTC"]}}},
+        {"$group": {
+            "_id": {"user_id": "$user_id", "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$recorded_at", "timezone": "$_tz"}}},
+            "count": {"$sum": 1},
+        }},
+    ]
+    days_by_user = {}
+    async for row in records_collection(db).aggregate(pipeline, allowDiskUse=True):
+        days_by_user.setdefault(row['_id']['user_id'], {})[row['_id']['day']] = row['count']
+    meds_by_user = {}
+    async for row in db.medications.aggregate(match + [{"$group": {"_id": "$user_id", "count": {"$sum": 1}}}]):
+        meds_by_user[row['_id']] = row['count']
+    for user_id in set(days_by_user) | set(meds_by_user) | ({for_user} if for_user else set()):
+        days = days_by_user.get(user_id, {})
+        progress = {
+            "days": days,
+            "total_records": sum(days.values()),
+            "medications_added": meds_by_user.get(user_id, 0),
+            "version": 1,
+            "summary_version": 1,
+            **summarize_days(days),
+        }
+        # Rebuilds (e.g. after a timezone change) keep existing unlock times
+        existing = await db.user_progress.find_one({"user_id": user_id}, {"_id": 0, "achievements": 1}) or {}
+        progress["achievements"] = existing.get('achievements') or {}
+        now = datetime.now(timezone.utc)
+        progress["achievements"].update({aid: now for aid in newly_unlocked(progress)})
+        await db.user_progress.update_one({"user_id": user_id}, {"$set": progress}, upsert=True)
+
+async def backfill_medication_timezones(for_user: Optional[str] = None):
+    """Give medications created without a timezone their owner's, so reminders
+    fire in local time rather than UTC."""
+    query = {"id": for_user} if for_user else {}
+    async for user in db.users.find({**query, "timezone": {"$ne": None}}, {"_id": 0, "id": 1, "timezone": 1}):
+        # Bumping updated_at lets every worker's reminder refresh pick it up
+        result = await db.medications.update_many(
+            {"user_id": user['id'], "timezone": None},
+            {"$set": {"timezone": user['timezone'], "updated_at": datetime.now(timezone.utc)}},
+        )
+        if result.modified_count:
+            await touch_data_version(user['id'])
+
+async def backfill_sync_seqs(batch_size: int = 1000):
+    """Stamp existing records and medications with per-user change sequence
+    numbers, reserved through the same counters live writes use."""
+    for collection_name in ("health_records", "medications"):
+        collection = db[collection_name]
+        cursor = collection.find({"sync_seq": {"$exists": False}}, {"_id": 1, "user_id": 1})
+        async for batch in cursor_batches(cursor, batch_size):
+            by_user = {}
+            for doc in batch:
+                by_user.setdefault(doc['user_id'], []).append(doc)
+            for user_id, docs in by_user.items():
+                async with sync_stamped(user_id, docs):
+                    await collection.bulk_write(
+                        [UpdateOne({"_id": doc['_id']}, {"$set": {"sync_seq": doc['sync_seq']}}) for doc in docs],
+                        ordered=False,
+                    )
+
+# Applied in order, once per database; progress is recorded in db.migrations.
+# A worker claims a migration by inserting its document and keeps the claim
+# fresh while it runs; the others wait for applied_at, and take over a claim
+# that has gone migration_lock_seconds without a heartbeat.
+MIGRATIONS = [
+    ("0001_iso_dates_to_bson", migrate_iso_dates),
+    ("0002_user_progress", backfill_user_progress),
+    ("0003_sync_seqs", backfill_sync_seqs),
+    ("0004_medication_timezones", backfill_medication_timezones),
+]
+
+async def claim_migration(name: str) -> bool:
+    now = datetime.now(timezone.utc)
+    try:
+        await db.migrations.insert_one({"_id": name, "claimed_at": now})
+        return True
+    except DuplicateKeyError:
+        stale = await db.migrations.find_one_and_update(
+            {"_id": name, "applied_at": {"$exists": False},
+             "claimed_at": {"$lt": now - timedelta(seconds=settings.migration_lock_seconds)}},
+            {"$set": {"claimed_at": now}},
+        )
+        return stale is not None
+
+async def _hold_migration_claim(name: str):
+    while True:
+        await asyncio.sleep(settings.migration_lock_seconds / 3)
+        await db.migrations.update_one({"_id": name}, {"$set": {"claimed_at": datetime.now(timezone.utc)}})
+
+async def run_migrations():
+    for name, migration in MIGRATIONS:
+        while not await claim_migration(name):
+            if (await db.migrations.find_one({"_id": name}) or {}).get('applied_at'):
+                break
+            logger.info("Waiting for migration %s to finish elsewhere", name)
+            await asyncio.sleep(1)
+        else:
+            logger.info("Applying migration %s", name)
+            heartbeat = asyncio.create_task(_hold_migration_claim(name))
+            try:
+                await migration()
+            finally:
+                heartbeat.cancel()
+            await db.migrations.update_one({"_id": name}, {"$set": {"applied_at": datetime.now(timezone.utc)}})
+
+def resolve_window(days: int, start: Optional[datetime], end: Optional[datetime]) -> dict:
+    """Build a recorded_at range filter from either from/to or a days lookback."""
+    if start is None:
+        start = datetime.now(timezone.utc) - timedelta(days=days)
+    window = {"$gte": as_utc(start)}
+    if end is not None:
+        window["$lte"] = as_utc(end)
+    return window
+
+# Keyset pagination over (recorded_at, id). Cursors are opaque to clients.
+def encode_cursor(recorded_at: datetime, record_id: str) -> str:
+    raw = json.dumps([as_utc(recorded_at).isoformat(), record_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        recorded_at, record_id = json.loads(raw)
+        if not isinstance(recorded_at, str) or not isinstance(record_id, str):
+            raise ValueError("cursor fields must be strings")
+        return as_utc(datetime.fromisoformat(recorded_at)), record_id
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def apply_cursor(query: dict, cursor: Optional[str], descending: bool = True) -> dict:
+    """Restrict a recorded_at-windowed query to records past the cursor."""
+    if not cursor:
+        return query
+    recorded_at, record_id = decode_cursor(cursor)
+    bound, strict, tighter = ("$lte", "$lt", min) if descending else ("$gte", "$gt", max)
+    window = dict(query.get("recorded_at", {}))
+    window[bound] = tighter(window[bound], recorded_at) if bound in window else recorded_at
+    query["recorded_at"] = window
+    query["$or"] = [
+        {"recorded_at": {strict: recorded_at}},
+        {"recorded_at": recorded_at, "id": {strict: record_id}},
+    ]
+    return query
+
+async def ndjson_lines(cursor, batch_size: int = STREAM_BATCH_SIZE):
+    """Yield a Motor cursor as NDJSON, one chunk per batch of documents."""
+    async for batch in cursor_batches(cursor, batch_size):
+        yield b''.join(orjson.dumps(doc, option=orjson.OPT_APPEND_NEWLINE) for doc in batch)
+
+# Export formats. Every row carries its record id, which is what `since`
+# takes to resume an interrupted download.
+EXPORT_FIELDS = ("id", "recorded_at", *VITAL_FIELDS, "notes", "created_at")
+
+def _csv_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+async def csv_export(cursor):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    async for batch in cursor_batches(cursor, EXPORT_BATCH_SIZE):
+        writer.writerows([_csv_value(doc.get(field)) for field in EXPORT_FIELDS] for doc in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands back whatever was written since the last drain."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def _parquet_schema():
+    import pyarrow as pa
+    types = {
+        "systolic_bp": pa.int64(), "diastolic_bp": pa.int64(), "heart_rate": pa.int64(),
+        "blood_sugar": pa.float64(), "weight": pa.float64(), "temperature": pa.float64(),
+        "recorded_at": pa.timestamp("ms", tz="UTC"), "created_at": pa.timestamp("ms", tz="UTC"),
+    }
+    return pa.schema([(field, types.get(field, pa.string())) for field in EXPORT_FIELDS])
+
+async def parquet_export(cursor):
+    """Stream a Parquet file, one row group per EXPORT_ROW_GROUP_SIZE records."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = _parquet_schema()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    
+    def write_row_group(batch):
+        columns = {field: [doc.get(field) for doc in batch] for field in EXPORT_FIELDS}
+        writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+        return sink.drain()
+    
+    async for batch in cursor_batches(cursor, EXPORT_ROW_GROUP_SIZE):
+        yield await asyncio.to_thread(write_row_group, batch)
+    writer.close()
+    yield sink.drain()
+
+EXPORT_FORMATS = {
+    "csv": (csv_export, "text/csv"),
+    "ndjson": (ndjson_lines, "application/x-ndjson"),
+    "parquet": (parquet_export, "application/vnd.apache.parquet"),
+}
+
+def rollup_pipeline(match: dict, granularity: str, zone: str = "UTC") -> list:
+    """Aggregate readings into per-bucket min/max/mean/count for each vital.
+    Buckets start at local midnight in `zone`, like the user's streak days."""
+    bucket = {"date": "$recorded_at", "unit": granularity, "timezone": zone}
+    if granularity == "week":
+        bucket["startOfWeek"] = "monday"
+    group = {"_id": {"$dateTrunc": bucket}, "readings": {"$sum": 1}}
+    project = {"_id": 0, "bucket": "$_id", "readings": 1}
+    for field in VITAL_FIELDS:
+        group[f"{field}_min"] = {"$min": f"${field}"}
+        group[f"{field}_max"] = {"$max": f"${field}"}
+        group[f"{field}_mean"] = {"$avg": f"${field}"}
+        group[f"{field}_count"] = {"$sum": {"$cond": [{"$isNumber": f"${field}"}, 1, 0]}}
+        project[field] = {
+            "min": f"${field}_min",
+            "max": f"${field}_max",
+            "mean": f"${field}_mean",
+            "count": f"${field}_count",
+        }
+    return [
+        {"$match": match},
+        {"$group": group},
+        {"$sort": {"_id": 1}},
+        {"$project": project},
+    ]
+
+# Stats are cached under the user's data version, so a write on any worker
+# moves every reader to a fresh key. They are filled from the primary: an
+# aggregate from a lagging secondary would be pinned under the post-write
+# version for as long as the entry lives. The cache keeps those reads rare.
+
+def _stats_key(user_id: str, version: int) -> str:
+    return f"stats:{user_id}:{version}"
+
+# Vitals insights. A user's whole series is loaded into a pandas frame (one
+# float64 column per vital) and summarized with vectorized operations. Rolling
+# windows are anchored at the latest reading, so a result only goes stale
+# when the user's records change. Cache keys carry the user's data version,
+# so any worker's write makes every worker's cached result unreachable.
+VITAL_RANGES = {
+    "systolic_bp": (90, 140),
+    "diastolic_bp": (60, 90),
+    "blood_sugar": (70, 180),
+    "temperature": (36.1, 37.8),
+    "heart_rate": (50, 100),
+}
+ANOMALY_THRESHOLD = 3.5  # robust z-score (median/MAD)
+INSIGHTS_ANOMALY_LIMIT = 20
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+
+
+def _insights_key(user_id: str, version: int) -> str:
+    return f"insights:{user_id}:{version}"
+
+async def refresh_insights(user_id: str, version: Optional[int] = None) -> dict:
+    if version is None:
+        version = await data_version(user_id)
+    # Read from the primary: the version is bumped once a write commits, so a
+    # lagging secondary could cache pre-write data under the new version
+    docs = await records_collection(db).find(
+        {"user_id": user_id}, {"_id": 0, "recorded_at": 1, **{field: 1 for field in VITAL_FIELDS}}
+    ).sort("recorded_at", 1).to_list(None)
+    insights = await asyncio.to_thread(compute_insights, docs)
+    await insights_cache.set(_insights_key(user_id, version), insights)
+    return insights
+
+def _number(value) -> Optional[float]:
+    return None if value is None or value != value else round(float(value), 2)
+
+def compute_insights(docs: list) -> dict:
+    """Summarize a user's readings (sorted by recorded_at) per vital field."""
+    import numpy as np
+    import pandas as pd
+
+    if not docs:
+        return {"records": 0, "first_reading": None, "last_reading": None, "fields": {}}
+    frame = pd.DataFrame.from_records(docs, columns=["recorded_at", *VITAL_FIELDS])
+    frame.index = pd.DatetimeIndex(pd.to_datetime(frame.pop("recorded_at"), utc=True))
+    frame = frame.astype("float64")
+
+    values = frame.to_numpy()
+    present = ~np.isnan(values)
+    counts = frame.count()
+    means = frame.mean()
+    stds = frame.std()
+    # Average real variability: mean absolute change between consecutive readings
+    arv = {
+        field: np.abs(np.diff(values[present[:, i], i])).mean() if counts[field] > 1 else None
+        for i, field in enumerate(VITAL_FIELDS)
+    }
+    # Rolling means of daily means, as of the latest reading's day
+    daily = frame.resample("D").mean()
+    rolling_7 = daily.iloc[-7:].mean()
+    rolling_30 = daily.iloc[-30:].mean()
+    by_weekday = frame.groupby(frame.index.dayofweek).mean()
+    medians = frame.median()
+    mad = (frame - medians).abs().median()
+    robust_z = 0.6745 * (frame - medians) / mad.replace(0, np.nan)
+
+    fields = {}
+    for field in VITAL_FIELDS:
+        if not counts[field]:
+            continue
+        summary = {
+            "count": int(counts[field]),
+            "mean": _number(means[field]),
+            "std": _number(stds[field]),
+            "cv": _number(stds[field] / means[field]) if means[field] else None,
+            "arv": _number(arv[field]),
+            "rolling_7d": _number(rolling_7[field]),
+            "rolling_30d": _number(rolling_30[field]),
+            "day_of_week": {WEEKDAYS[day]: _number(value) for day, value in by_weekday[field].dropna().items()},
+        }
+        column = frame[field]
+        if field in VITAL_RANGES:
+            low, high = VITAL_RANGES[field]
+            summary["range"] = {"low": low, "high": high}
+            summary["below_range"] = int((column < low).sum())
+            summary["above_range"] = int((column > high).sum())
+        flagged = robust_z[field].abs() > ANOMALY_THRESHOLD
+        summary["anomaly_count"] = int(flagged.sum())
+        summary["anomalies"] = [
+            {"recorded_at": when.isoformat(), "value": _number(value), "z": _number(z)}
+            for when, value, z in zip(
+                column.index[flagged][-INSIGHTS_ANOMALY_LIMIT:],
+                column[flagged].to_numpy()[-INSIGHTS_ANOMALY_LIMIT:],
+                robust_z[field][flagged].to_numpy()[-INSIGHTS_ANOMALY_LIMIT:],
+            )
+        ]
+        fields[field] = summary
+    return {
+        "records": len(frame),
+        "first_reading": frame.index[0].isoformat(),
+        "last_reading": frame.index[-1].isoformat(),
+        "fields": fields,
+    }
+
+# Streaks and achievements. Each user has a user_progress document holding a
+# per-day record count (days are UTC dates) that is $inc'd on every write,
+# plus the streak summary derived from it. `version` is bumped with every
+# change to `days` and `summary_version` records which version the summary
+# reflects, so a stale summary is never extended incrementally.
+ACHIEVEMENTS = [
+    {"id": "first_record", "title": "Getting Started", "description": "Log your first health record", "icon": "🎯"},
+    {"id": "week_streak", "title": "Week Warrior", "description": "Log records for 7 consecutive days", "icon": "🔥"},
+    {"id": "month_streak", "title": "Monthly Master", "description": "Log records for 30 consecutive days", "icon": "⭐"},
+    {"id": "ten_records", "title": "Health Enthusiast", "description": "Log 10 health records", "icon": "💪"},
+    {"id": "first_medication", "title": "Medication Manager", "description": "Add your first medication", "icon": "💊"},
+    {"id": "consistent_tracker", "title": "Consistency Champion", "description": "Log records for 14 consecutive days", "icon": "🏆"},
+]
+
+ACHIEVEMENT_RULES = {
+    "first_record": lambda p: p.get('total_records', 0) >= 1,
+    "week_streak": lambda p: p.get('longest_streak', 0) >= 7,
+    "month_streak": lambda p: p.get('longest_streak', 0) >= 30,
+    "ten_records": lambda p: p.get('total_records', 0) >= 10,
+    "first_medication": lambda p: p.get('medications_added', 0) >= 1,
+    "consistent_tracker": lambda p: p.get('longest_streak', 0) >= 14,
+}
+
+def _day_key(value: datetime, zone: ZoneInfo = ZoneInfo("UTC")) -> str:
+    return as_utc(value).astimezone(zone).date().isoformat()
+
+async def user_zone(user_id: str) -> ZoneInfo:
+    """The zone a user's days are counted in (streaks, trend buckets), UTC
+    until the client sends one."""
+    user = profile_cache.get(user_id)
+    if user is None:
+        user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0}) or {}
+        if user:
+            profile_cache.set(user_id, user)
+    return ZoneInfo(user.get('timezone') or "UTC")
+
+def summarize_days(days: dict) -> dict:
+    """Compute the longest streak and the most recent run from a day -> count map."""
+    longest = run = 0
+    previous = None
+    for ordinal in sorted(date.fromisoformat(day).toordinal() for day, count in days.items() if count > 0):
+        run = run + 1 if previous is not None and ordinal == previous + 1 else 1
+        longest = max(longest, run)
+        previous = ordinal
+    return {
+        "longest_streak": longest,
+        "last_active_day": date.fromordinal(previous).isoformat() if previous else None,
+        "last_run_length": run,
+    }
+
+def _extend_summary(before: dict, added_days: list) -> Optional[dict]:
+    """Extend a current summary with days that all fall on or after its last
+    active day. Returns None when a full rescan is needed instead."""
+    if before.get('summary_version') != before.get('version'):
+        return None
+    last = before.get('last_active_day')
+    summary = {
+        "longest_streak": before.get('longest_streak', 0),
+        "last_active_day": last,
+        "last_run_length": before.get('last_run_length', 0),
+    }
+    for day in sorted(added_days):
+        if last is not None and day < last:
+            return None
+        if day == last:
+            continue
+        adjacent = last is not None and date.fromisoformat(day).toordinal() == date.fromisoformat(last).toordinal() + 1
+        summary['last_run_length'] = summary['last_run_length'] + 1 if adjacent else 1
+        summary['longest_streak'] = max(summary['longest_streak'], summary['last_run_length'])
+        summary['last_active_day'] = last = day
+    return summary
+
+def newly_unlocked(progress: dict) -> list:
+    unlocked = progress.get('achievements') or {}
+    return [aid for aid, rule in ACHIEVEMENT_RULES.items() if aid not in unlocked and rule(progress)]
+
+def current_streak(progress: dict, zone: ZoneInfo = ZoneInfo("UTC")) -> int:
+    # Matches the dashboard's rule: the streak only counts if it includes today
+    if progress.get('last_active_day') == datetime.now(zone).date().isoformat():
+        return progress.get('last_run_length', 0)
+    return 0
+
+async def _apply_progress_change(user_id: str, inc: dict, added_days: list = (), removed_days: list = ()):
+    """Apply counter increments to a user's progress and refresh the derived
+    streak summary and achievements."""
+    before = await db.user_progress.find_one_and_update(
+        {"user_id": user_id},
+        {"$inc": {**inc, "version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE,
+    ) or {}
+    after = dict(before)
+    after['days'] = days = dict(before.get('days', {}))
+    for key, delta in inc.items():
+        if key.startswith('days.'):
+            days[key[5:]] = days.get(key[5:], 0) + delta
+        else:
+            after[key] = after.get(key, 0) + delta
+    after['version'] = before.get('version', 0) + 1
+    
+    emptied = [day for day in removed_days if days.get(day, 0) <= 0]
+    summary = None
+    if not emptied:
+        summary = _extend_summary(before, [day for day in added_days if not before.get('days', {}).get(day)])
+    if summary is None:
+        summary = summarize_days(days)
+    after.update(summary)
+    
+    update = {"$set": {**summary, "summary_version": after['version']}}
+    await db.user_progress.update_one({"user_id": user_id, "version": after['version']}, update)
+    for day in emptied:
+        await db.user_progress.update_one({"user_id": user_id, f"days.{day}": {"$lte": 0}}, {"$unset": {f"days.{day}": ""}})
+    
+    unlocked = newly_unlocked(after)
+    if unlocked:
+        now = datetime.now(timezone.utc)
+        await db.user_progress.update_one(
+            {"user_id": user_id},
+            {"$set": {f"achievements.{aid}": now for aid in unlocked}}
+        )
+
+async def progress_records_created(user_id: str, records: list):
+    zone = await user_zone(user_id)
+    inc = {"total_records": len(records)}
+    for record in records:
+        key = f"days.{_day_key(record['recorded_at'], zone)}"
+        inc[key] = inc.get(key, 0) + 1
+    await _apply_progress_change(user_id, inc, added_days=[key[5:] for key in inc if key.startswith('days.')])
+
+async def progress_record_deleted(user_id: str, recorded_at: datetime):
+    day = _day_key(recorded_at, await user_zone(user_id))
+    await _apply_progress_change(user_id, {"total_records": -1, f"days.{day}": -1}, removed_days=[day])
+
+async def progress_medication_added(user_id: str):
+    await _apply_progress_change(user_id, {"medications_added": 1})
+
+def records_collection(database):
+    """The collection health record reads go to under the records_storage setting."""
+    if settings.records_storage == 'timeseries':
+        return database[settings.records_timeseries_collection]
+    return database.health_records
+
+def _write_errors(e: BulkWriteError) -> dict:
+    return {err['index']: err for err in e.details.get('writeErrors', [])}
+
+async def claim_record_keys(docs: list, ignore_duplicates: bool = False) -> dict:
+    """Claim the idempotency keys of `docs` in record_keys. Returns write errors
+    by index in `docs`, as insert_many would report them."""
+    keyed = [i for i, doc in enumerate(docs) if doc.get('idempotency_key')]
+    if not keyed:
+        return {}
+    try:
+        await db.record_keys.insert_many([
+            {"user_id": docs[i]['user_id'], "idempotency_key": docs[i]['idempotency_key'], "id": docs[i]['id']}
+            for i in keyed
+        ], ordered=False)
+    except BulkWriteError as e:
+        if ignore_duplicates:
+            return {}
+        return {keyed[index]: err for index, err in _write_errors(e).items()}
+    return {}
+
+async def insert_readings(docs: list) -> dict:
+    if not docs:
+        return {}
+    readings = [{k: v for k, v in doc.items() if k != '_id'} for doc in docs]
+    try:
+        await db[settings.records_timeseries_collection].insert_many(readings, ordered=False)
+    except BulkWriteError as e:
+        return _write_errors(e)
+    return {}
+
+async def insert_records(docs: list) -> dict:
+    """Write health records to the configured storage, unordered. Returns write
+    errors by index; a repeated idempotency key is reported with code 11000."""
+    if settings.records_storage == 'timeseries':
+        failed = await claim_record_keys(docs)
+        pending = [i for i in range(len(docs)) if i not in failed]
+        errors = await insert_readings([docs[i] for i in pending])
+        if errors:
+            lost = [docs[pending[index]] for index in errors]
+            await db.record_keys.delete_many({"user_id": lost[0]['user_id'], "id": {"$in": [doc['id'] for doc in lost]}})
+            failed.update({pending[index]: err for index, err in errors.items()})
+        return failed
+    failed = {}
+    try:
+        await db.health_records.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        failed = _write_errors(e)
+    if settings.records_storage == 'dual':
+        # health_records stays authoritative; a reading that fails here is
+        # picked up again by the next copy
+        written = [doc for i, doc in enumerate(docs) if i not in failed]
+        await claim_record_keys(written, ignore_duplicates=True)
+        if await insert_readings(written):
+            logger.warning("Dual write to %s failed for some records", settings.records_timeseries_collection)
+    return failed
+
+async def delete_record(user_id: str, record_id: str) -> Optional[dict]:
+    """Delete a health record from every layout it is stored in. Returns its id
+    and recorded_at, or None if the user has no such record."""
+    query = {"id": record_id, "user_id": user_id}
+    projection = {"_id": 0, "id": 1, "recorded_at": 1}
+    if settings.records_storage == 'timeseries':
+        # Time-series collections don't support find-and-modify
+        deleted = await db[settings.records_timeseries_collection].find_one(query, projection)
+        if deleted:
+            result = await db[settings.records_timeseries_collection].delete_many(query)
+            deleted = deleted if result.deleted_count else None
+    else:
+        deleted = await db.health_records.find_one_and_delete(query, projection=projection)
+        if deleted and settings.records_storage == 'dual':
+            await db[settings.records_timeseries_collection].delete_many(query)
+    if deleted and settings.records_storage != 'collection':
+        await db.record_keys.delete_many(query)
+    return deleted
+
+async def copy_records_to_timeseries(batch_size: int = 1000, pause: float = 0.0,
+                                     settle_seconds: float = RECORDS_COPY_SETTLE_SECONDS) -> dict:
+    """Copy health_records into the time-series collection in _id order, in
+    batches, while the API keeps serving in `dual` mode. Records already
+    present there (by id) are skipped and progress is checkpointed in
+    db.migrations, so the copy can be stopped and rerun."""
+    await ensure_timeseries_collection()
+    state = await db.migrations.find_one({"_id": "timeseries_copy"}) or {}
+    # Anything newer than the cutoff was written by dual-mode API processes
+    cutoff = state.get('cutoff') or ObjectId.from_datetime(
+        datetime.now(timezone.utc) - timedelta(seconds=settle_seconds)
+    )
+    last_id = state.get('last_id')
+    readings = db[settings.records_timeseries_collection]
+    copied = state.get('copied', 0)
+    skipped = state.get('skipped', 0)
+    while True:
+        query = {"_id": {"$lte": cutoff, **({"$gt": last_id} if last_id else {})}}
+        batch = await db.health_records.find(query).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+        ids = [doc['id'] for doc in batch]
+        present = {doc['id'] async for doc in readings.find({"id": {"$in": ids}}, {"_id": 0, "id": 1})}
+        missing = [doc for doc in batch if doc['id'] not in present]
+        if missing:
+            errors = await insert_readings(missing)
+            if errors:
+                raise RuntimeError(f"Copying {len(errors)} records failed, first error: {next(iter(errors.values()))}")
+            await claim_record_keys(missing, ignore_duplicates=True)
+            # A record deleted while its batch was in flight must not come back
+            remaining = {doc['id'] async for doc in db.health_records.find(
+                {"id": {"$in": [doc['id'] for doc in missing]}}, {"_id": 0, "id": 1}
+            )}
+            gone = [doc['id'] for doc in missing if doc['id'] not in remaining]
+            if gone:
+                await readings.delete_many({"id": {"$in": gone}})
+        copied += len(missing)
+        skipped += len(batch) - len(missing)
+        last_id = batch[-1]['_id']
+        await db.migrations.update_one(
+            {"_id": "timeseries_copy"},
+            {"$set": {"cutoff": cutoff, "last_id": last_id, "copied": copied, "skipped": skipped}},
+            upsert=True
+        )
+        if pause:
+            await asyncio.sleep(pause)
+    await db.migrations.update_one(
+        {"_id": "timeseries_copy"},
+        {"$set": {"cutoff": cutoff, "copied": copied, "skipped": skipped, "applied_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    return {"copied": copied, "skipped": skipped}
+
+def record_document(record: HealthRecord) -> dict:
+    doc = record.model_dump()
+    # Keyless records stay out of the partial unique index entirely
+    if doc['idempotency_key'] is None:
+        del doc['idempotency_key']
+    return doc
+
+# Change sequence for offline sync. Every health record and medication write
+# is stamped with the next value of the user's counter in sync_counters, and a
+# deleted record leaves a tombstone with its own sequence number, so
+# `sync_seq > token` selects exactly what changed since the client's last sync.
+# Numbers are reserved before the write, so each reservation is recorded under
+# `pending` until the write returns; /sync only reads up to the first number
+# still pending, and a token never skips past a change that lands later.
+async def allocate_sync_seqs(user_id: str, count: int = 1) -> tuple:
+    """Reserve `count` consecutive sequence numbers as one pending
+    reservation. Returns (first, reservation id)."""
+    reservation = uuid.uuid4().hex
+    while True:
+        current = (await db.sync_counters.find_one({"_id": user_id}, {"seq": 1}) or {}).get('seq')
+        first = (current or 0) + 1
+        try:
+            # Compare-and-set, so the reservation is recorded with its first
+            # number in the same write that takes it
+            result = await db.sync_counters.update_one(
+                {"_id": user_id, "seq": current if current is not None else {"$exists": False}},
+                {"$set": {"seq": first + count - 1,
+                          f"pending.{reservation}": {"first": first, "at": datetime.now(timezone.utc)}}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            continue  # another writer moved the counter first
+        if result.matched_count or result.upserted_id is not None:
+            return first, reservation
+
+@asynccontextmanager
+async def sync_stamped(user_id: str, docs: list):
+    """Stamp `docs` with sequence numbers that stay pending until the block,
+    which should perform their write, exits."""
+    if not docs:
+        yield
+        return
+    first, reservation = await allocate_sync_seqs(user_id, len(docs))
+    for offset, doc in enumerate(docs):
+        doc['sync_seq'] = first + offset
+    try:
+        yield
+    finally:
+        await db.sync_counters.update_one({"_id": user_id}, {"$unset": {f"pending.{reservation}": ""}})
+
+async def committed_seq(user_id: str) -> int:
+    """The highest sequence number at or below which every write has finished."""
+    counter = await db.sync_counters.find_one({"_id": user_id}, {"seq": 1, "pending": 1}) or {}
+    cutoff = counter.get('seq', 0)
+    abandoned_before = datetime.now(timezone.utc) - timedelta(seconds=settings.sync_pending_seconds)
+    abandoned = []
+    for reservation, entry in (counter.get('pending') or {}).items():
+        if as_utc(entry['at']) < abandoned_before:
+            abandoned.append(reservation)
+        else:
+            cutoff = min(cutoff, entry['first'] - 1)
+    if abandoned:
+        await db.sync_counters.update_one({"_id": user_id}, {"$unset": {f"pending.{r}": "" for r in abandoned}})
+    return cutoff
+
+async def touch_data_version(user_id: str):
+    """Bump the user's data version once a write has committed. Unlike sync_seq,
+    which is reserved before the write, this never runs ahead of the data, so
+    it is safe to derive ETags from."""
+    await db.sync_counters.update_one({"_id": user_id}, {"$inc": {"version": 1}}, upsert=True)
+
+async def data_version(user_id: str) -> int:
+    counter = await db.sync_counters.find_one({"_id": user_id}, {"version": 1})
+    return (counter or {}).get('version', 0)
+
+def encode_sync_token(seq: int) -> str:
+    raw = json.dumps([seq, int(time.time())]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_sync_token(token: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        seq, issued_at = json.loads(raw)
+        return int(seq), float(issued_at)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+
+# Hooks run after health records are written. The data version is bumped
+# last, once everything derived from the write is up to date.
+async def after_records_created(user_id: str, records: list):
+    if not records:
+        return
+    await progress_records_created(user_id, records)
+    await touch_data_version(user_id)
+
+async def after_record_deleted(user_id: str, record: dict):
+    tombstone = {"user_id": user_id, "collection": "health_records", "id": record['id'],
+                 "deleted_at": datetime.now(timezone.utc)}
+    async with sync_stamped(user_id, [tombstone]):
+        await db.sync_tombstones.insert_one(tombstone)
+    await progress_record_deleted(user_id, record['recorded_at'])
+    await touch_data_version(user_id)
+
+def parse_bulk_body(body: bytes, content_type: str) -> list:
+    """Split a bulk request body into raw items. NDJSON lines that are not
+    valid JSON are returned as exceptions so they can be reported per item."""
+    if content_type.startswith("application/x-ndjson"):
+        items = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                items.append(e)
+        return items
+    try:
+        items = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+    return items
+
+def write_result(index: int, doc_id: Optional[str], err: Optional[dict] = None, duplicate: bool = False) -> dict:
+    """Per-item result for a bulk write, shared by every bulk endpoint."""
+    if err is None:
+        return {"index": index, "status": "created", "id": doc_id}
+    if duplicate:
+        return {"index": index, "status": "duplicate", "id": doc_id}
+    return {"index": index, "status": "error", "errors": [{"msg": err.get('errmsg', 'Write failed')}]}
+
+def bulk_summary(results: list) -> dict:
+    counts = {status_name: 0 for status_name in ("created", "duplicate", "invalid", "error")}
+    for result in results:
+        counts[result['status']] += 1
+    return {**counts, "results": results}
+
+async def insert_records_chunk(user_id: str, docs: list, indexes: list, results: list) -> list:
+    """Insert one chunk unordered and fill in per-item results. Returns the docs
+    that were written."""
+    failed = await insert_records(docs)
+    
+    duplicates = {i for i, err in failed.items() if err.get('code') == 11000 and docs[i].get('idempotency_key')}
+    duplicate_keys = [docs[i]['idempotency_key'] for i in duplicates]
+    existing = {}
+    if duplicate_keys:
+        # In time-series mode record_keys holds the id even while the original
+        # reading is still being written
+        keys = db.record_keys if settings.records_storage == 'timeseries' else records_collection(db)
+        async for doc in keys.find(
+            {"user_id": user_id, "idempotency_key": {"$in": duplicate_keys}},
+            {"_id": 0, "id": 1, "idempotency_key": 1}
+        ):
+            existing[doc['idempotency_key']] = doc['id']
+    
+    written = []
+    for i, doc in enumerate(docs):
+        err = failed.get(i)
+        if i in duplicates:
+            results[indexes[i]] = write_result(indexes[i], existing.get(doc['idempotency_key']), err, duplicate=True)
+            continue
+        results[indexes[i]] = write_result(indexes[i], doc['id'], err)
+        if err is None:
+            written.append(doc)
+    return written
+
+# Longest look-ahead for /medications/due
+DUE_WINDOW_MAX_MINUTES = 7 * 24 * 60
+
+# Medication adherence. Each user has one adherence_summaries document with
+# scheduled/taken/skipped counters per medication, per month and per ISO
+# week. Counters are bumped with $inc as doses come due and as outcomes are
+# logged, so reading rates never touches the raw dose events.
+def adherence_periods(when: datetime, zone) -> tuple:
+    local = when.astimezone(zone)
+    year, week, _ = local.isocalendar()
+    return local.strftime("%Y-%m"), f"{year}-W{week:02d}"
+
+def add_adherence(inc: dict, medication_id: str, field: str, when: datetime, zone):
+    """Accumulate the $inc paths for one dose into `inc`."""
+    base = f"medications.{medication_id}"
+    for path in (base, *(f"{base}.periods.{period}" for period in adherence_periods(when, zone))):
+        inc[f"{path}.{field}"] = inc.get(f"{path}.{field}", 0) + 1
+
+async def ensure_adherence_summaries(user_ids):
+    try:
+        await db.adherence_summaries.bulk_write([
+            UpdateOne({"user_id": user_id}, {"$setOnInsert": {"medications": {}}}, upsert=True)
+            for user_id in user_ids
+        ], ordered=False)
+    except BulkWriteError:
+        pass  # created concurrently by another request or worker
+
+async def count_scheduled_doses(fired: list):
+    """Reminder handler: count doses that came due. The per-slot last_due guard
+    keeps workers that fire the same dose from counting it twice."""
+    await ensure_adherence_summaries({medication.user_id for medication, _, _ in fired})
+    # One guarded update per slot, so several doses of a slot in one batch
+    # can't race each other in the unordered bulk write
+    by_slot = {}
+    for medication, slot, due_at in fired:
+        by_slot.setdefault((medication.id, slot_key(slot)), (medication, []))[1].append(due_at)
+    updates = []
+    for (medication_id, key), (medication, dues) in by_slot.items():
+        last_due = f"medications.{medication_id}.last_due.{key}"
+        inc = {}
+        for due_at in dues:
+            add_adherence(inc, medication_id, "scheduled", due_at, medication.zone)
+        updates.append(UpdateOne(
+            {"user_id": medication.user_id, "$or": [{last_due: {"$lt": min(dues)}}, {last_due: {"$exists": False}}]},
+            {"$inc": inc, "$set": {last_due: max(dues)}}
+        ))
+    for start in range(0, len(updates), BULK_CHUNK_SIZE):
+        await db.adherence_summaries.bulk_write(updates[start:start + BULK_CHUNK_SIZE], ordered=False)
+
+
+async def count_missed_doses():
+    """Count doses that came due while no worker was running: everything
+    between each slot's last_due and the scheduler's load time. A slot with
+    no last_due counts from when a worker first loaded it (counted_from),
+    so doses from before counting began are never back-filled."""
+    last_due, counted_from = {}, {}
+    user_ids = list(reminder_scheduler.by_user)
+    for start in range(0, len(user_ids), BULK_CHUNK_SIZE):
+        cursor = db.adherence_summaries.find({"user_id": {"$in": user_ids[start:start + BULK_CHUNK_SIZE]}}, {"_id": 0, "medications": 1})
+        async for summary in cursor:
+            for medication_id, counters in (summary.get('medications') or {}).items():
+                last_due[medication_id] = counters.get('last_due') or {}
+                counted_from[medication_id] = counters.get('counted_from') or {}
+    loaded_at = reminder_scheduler.loaded_at
+    since, first_loads = {}, []
+    for medication in reminder_scheduler.medications.values():
+        for slot in medication.slots:
+            key = slot_key(slot)
+            start = last_due.get(medication.id, {}).get(key) or counted_from.get(medication.id, {}).get(key)
+            if start is not None:
+                since[(medication.id, slot)] = as_utc(start)
+            else:
+                # $min: the earliest worker to load the slot wins
+                first_loads.append((medication.user_id, UpdateOne(
+                    {"user_id": medication.user_id},
+                    {"$min": {f"medications.{medication.id}.counted_from.{key}": loaded_at}}
+                )))
+    if first_loads:
+        await ensure_adherence_summaries({user_id for user_id, _ in first_loads})
+        for start in range(0, len(first_loads), BULK_CHUNK_SIZE):
+            await db.adherence_summaries.bulk_write([update for _, update in first_loads[start:start + BULK_CHUNK_SIZE]], ordered=False)
+    fired = reminder_scheduler.missed(since, loaded_at)
+    if fired:
+        await count_scheduled_doses(fired)
+
+def _with_rate(counts: dict) -> dict:
+    scheduled = counts.get('scheduled', 0)
+    summary = {field: counts.get(field, 0) for field in ("scheduled", "taken", "skipped")}
+    summary['rate'] = round(min(1.0, summary['taken'] / scheduled), 4) if scheduled else None
+    return summary
+
+def adherence_report(summary: Optional[dict]) -> dict:
+    medications = {}
+    for medication_id, counts in ((summary or {}).get('medications') or {}).items():
+        medications[medication_id] = {
+            **_with_rate(counts),
+            "periods": {period: _with_rate(c) for period, c in sorted((counts.get('periods') or {}).items())},
+        }
+    return {"medications": medications}
+
+# Caregiver cohorts. Patients invite a caregiver by email (care_invitations);
+# once the caregiver accepts, the link lives in care_links. Each caregiver's
+# link count is kept in care_link_counts, so the cohort_max_patients cap holds
+# under concurrent accepts. A cohort summary is built from one aggregation over every linked
+# patient's recent records (answered from the (user_id, recorded_at) index)
+# plus one read each of users and adherence_summaries, not per-patient calls.
+
+def _cohort_key(caregiver_id: str) -> str:
+    # One entry per caregiver, holding a summary per window length
+    return f"cohort:{caregiver_id}"
+
+async def invalidate_cohort(caregiver_id: str):
+    await cohort_cache.delete(_cohort_key(caregiver_id))
+
+async def reserve_care_slot(caregiver_id: str) -> bool:
+    """Take one of the caregiver's cohort_max_patients link slots, or return
+    False when they are all in use."""
+    if not await db.care_link_counts.find_one({"_id": caregiver_id}, {"_id": 1}):
+        # Seeded once from links made before the counter existed
+        linked = await db.care_links.count_documents({"caregiver_id": caregiver_id})
+        try:
+            await db.care_link_counts.update_one({"_id": caregiver_id}, {"$setOnInsert": {"patients": linked}}, upsert=True)
+        except DuplicateKeyError:
+            pass  # seeded concurrently
+    result = await db.care_link_counts.update_one(
+        {"_id": caregiver_id, "patients": {"$lt": settings.cohort_max_patients}},
+        {"$inc": {"patients": 1}}
+    )
+    return result.modified_count == 1
+
+async def release_care_slot(caregiver_id: str):
+    await db.care_link_counts.update_one({"_id": caregiver_id, "patients": {"$gt": 0}}, {"$inc": {"patients": -1}})
+
+def _out_of_range(field: str, low: float, high: float) -> dict:
+    value = f"${field}"
+    return {"$and": [{"$isNumber": value}, {"$or": [{"$lt": [value, low]}, {"$gt": [value, high]}]}]}
+
+def cohort_pipeline(patient_ids: list, since: datetime) -> list:
+    """Latest reading, reading count and out-of-range counts per patient."""
+    return [
+        {"$match": {"user_id": {"$in": patient_ids}, "recorded_at": {"$gte": since}}},
+        {"$sort": {"user_id": 1, "recorded_at": -1}},
+        {"$group": {
+            "_id": "$user_id",
+            "latest": {"$first": {field: f"${field}" for field in ("id", "recorded_at", *VITAL_FIELDS)}},
+            "readings": {"$sum": 1},
+            **{
+                f"{field}_out_of_range": {"$sum": {"$cond": [_out_of_range(field, low, high), 1, 0]}}
+                for field, (low, high) in VITAL_RANGES.items()
+            },
+        }},
+    ]
+
+def cohort_adherence(summary: Optional[dict], month: str) -> dict:
+    """Adherence across all of a patient's medications, overall and for `month`."""
+    overall, current = {}, {}
+    for counts in ((summary or {}).get('medications') or {}).values():
+        for field in ("scheduled", "taken", "skipped"):
+            overall[field] = overall.get(field, 0) + counts.get(field, 0)
+            current[field] = current.get(field, 0) + ((counts.get('periods') or {}).get(month) or {}).get(field, 0)
+    return {**_with_rate(overall), "month": _with_rate(current)}
+
+async def build_cohort_summary(caregiver_id: str, days: int) -> dict:
+    links = await db.care_links.find({"caregiver_id": caregiver_id}, {"_id": 0, "patient_id": 1}).to_list(settings.cohort_max_patients)
+    patient_ids = [link['patient_id'] for link in links]
+    now = datetime.now(timezone.utc)
+    month = now.strftime("%Y-%m")
+    users, rows, summaries = await asyncio.gather(
+        db.users.find({"id": {"$in": patient_ids}}, {"_id": 0, "id": 1, "name": 1, "email": 1}).to_list(None),
+        records_collection(analytics_db).aggregate(
+            cohort_pipeline(patient_ids, now - timedelta(days=days)), maxTimeMS=settings.cohort_max_time_ms
+        ).to_list(None),
+        analytics_db.adherence_summaries.find(
+            {"user_id": {"$in": patient_ids}}, {"_id": 0, "user_id": 1, "medications": 1}
+        ).to_list(None),
+    )
+    users = {user['id']: user for user in users}
+    rows = {row['_id']: row for row in rows}
+    summaries = {summary['user_id']: summary for summary in summaries}
+
+    patients = []
+    for patient_id in patient_ids:
+        user = users.get(patient_id)
+        if user is None:
+            continue
+        row = rows.get(patient_id) or {}
+        latest = row.get('latest') or {}
+        patients.append({
+            "patient_id": patient_id,
+            "name": user['name'],
+            "email": user['email'],
+            "readings": row.get('readings', 0),
+            "latest_vitals": latest,
+            "out_of_range": [
+                field for field, (low, high) in VITAL_RANGES.items()
+                if isinstance(latest.get(field), (int, float)) and not low <= latest[field] <= high
+            ],
+            "out_of_range_readings": {field: row.get(f"{field}_out_of_range", 0) for field in VITAL_RANGES},
+            "adherence": cohort_adherence(summaries.get(patient_id), month),
+        })
+    # Patients needing attention first
+    patients.sort(key=lambda p: (-len(p['out_of_range']), -sum(p['out_of_range_readings'].values()), p['name']))
+    return {"days": days, "generated_at": now, "patients": patients}
+
+@job_handler("insights", user_facing=True)
+async def insights_job(user_id: str, params: dict) -> dict:
+    return await refresh_insights(user_id)
+
+@job_handler("rebuild_progress", user_facing=True)
+async def rebuild_progress_job(user_id: str, params: dict) -> dict:
+    await backfill_user_progress(user_id)
+    progress = await db.user_progress.find_one({"user_id": user_id}, {"_id": 0, "days": 0}) or {}
+    return {"total_records": progress.get('total_records', 0), "longest_streak": progress.get('longest_streak', 0)}
 
 # Auth helpers
 def hash_password(password: str) -> str:
@@ -104,101 +1519,389 @@ def hash_password(password: str) -> str:
 def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
+async def run_password_job(func, *args):
+    """Run a bcrypt call on the password pool, shedding load when it is saturated."""
+    runtime = current_runtime()
+    with runtime.password_jobs_lock:
+        if runtime.password_jobs >= settings.password_hash_workers + settings.password_hash_queue_limit:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server busy, please retry",
+                headers={"Retry-After": str(settings.password_hash_retry_after)}
+            )
+        runtime.password_jobs += 1
+    # The slot is released when the bcrypt call itself finishes, not when the
+    # request does: a client that disconnects cancels the await, but the
+    # thread keeps running and still occupies the pool
+    future = runtime.password_executor.submit(func, *args)
+    future.add_done_callback(lambda _: _password_job_done(runtime))
+    return await asyncio.wrap_future(future)
+
+def _password_job_done(runtime: Runtime):
+    with runtime.password_jobs_lock:
+        runtime.password_jobs -= 1
+
 def create_token(user_id: str) -> str:
     payload = {
         'user_id': user_id,
-        'exp': datetime.now(timezone.utc) + timedelta(hours=JWT_EXPIRATION_HOURS)
+        'exp': datetime.now(timezone.utc) + timedelta(hours=JWT_EXPIRATION_HOURS),
+        # Sub-second, so a token issued just after revoke_user_tokens survives it
+        'iat': time.time(),
     }
-    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    return jwt.encode(payload, settings.jwt_secret, algorithm=JWT_ALGORITHM)
+
+def token_key(token: str) -> str:
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def verify_token(token: str) -> str:
+    """Return the token's user id, decoding and verifying it only on a cache miss."""
+    runtime = current_runtime()
+    key = token_key(token)
+    if key in runtime.revoked_tokens:
+        raise jwt.InvalidTokenError("Token revoked")
+    cached = verified_tokens.get(key)
+    if cached is None or cached[1] <= time.time():
+        payload = jwt.decode(token, settings.jwt_secret, algorithms=[JWT_ALGORITHM])
+        cached = (payload['user_id'], payload['exp'], payload.get('iat', 0))
+        verified_tokens.set(key, cached, ttl=payload['exp'] - time.time())
+    user_id, _, issued_at = cached
+    # Checked on cache hits too: the cache is keyed by token, not by user
+    if issued_at < runtime.revoked_users.get(user_id, 0):
+        raise jwt.InvalidTokenError("Token revoked")
+    return user_id
+
+async def sync_revocations():
+    """Pull tokens revoked by any worker since the last sync."""
+    runtime = current_runtime()
+    synced_at, revoked_tokens, revoked_users = runtime.revocations_synced_at, runtime.revoked_tokens, runtime.revoked_users
+    if synced_at and time.monotonic() - synced_at[0] < settings.revocation_sync_seconds:
+        return
+    query = {}
+    if synced_at:
+        # Overlap the window so revocations committed mid-sync are not missed
+        query["revoked_at"] = {"$gte": synced_at[1] - timedelta(seconds=settings.revocation_sync_seconds)}
+    runtime.revocations_synced_at = (time.monotonic(), datetime.now(timezone.utc))
+    now = time.time()
+    async for doc in db.revoked_tokens.find(query, {"_id": 1, "user_id": 1, "expires_at": 1, "issued_before": 1}):
+        if 'issued_before' in doc:
+            revoked_users[doc['user_id']] = as_utc(doc['issued_before']).timestamp()
+            profile_cache.delete(doc['user_id'])
+            continue
+        revoked_tokens[doc['_id']] = doc['expires_at'].timestamp()
+        verified_tokens.delete(doc['_id'])
+    for key in [key for key, expires in revoked_tokens.items() if expires <= now]:
+        del revoked_tokens[key]
+    # Once every token issued before the cutoff has expired it has nothing left to reject
+    lifetime = JWT_EXPIRATION_HOURS * 3600
+    for user_id in [user_id for user_id, cutoff in revoked_users.items() if cutoff + lifetime <= now]:
+        del revoked_users[user_id]
+
+async def revoke_token(token: str):
+    key = token_key(token)
+    try:
+        payload = jwt.decode(token, settings.jwt_secret, algorithms=[JWT_ALGORITHM], options={"verify_exp": False})
+        expires_at = datetime.fromtimestamp(payload['exp'], timezone.utc)
+    except jwt.InvalidTokenError:
+        return
+    await db.revoked_tokens.update_one(
+        {"_id": key},
+        {"$set": {"user_id": payload.get('user_id'), "expires_at": expires_at, "revoked_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    current_runtime().revoked_tokens[key] = expires_at.timestamp()
+    verified_tokens.delete(key)
+
+async def revoke_user_tokens(user_id: str):
+    """Reject every token issued to the user so far and drop their cached
+    profile. Called when their credentials change."""
+    issued_before = datetime.now(timezone.utc)
+    await db.revoked_tokens.update_one(
+        {"_id": f"user:{user_id}"},
+        {"$set": {
+            "user_id": user_id,
+            "issued_before": issued_before,
+            "expires_at": issued_before + timedelta(hours=JWT_EXPIRATION_HOURS),
+            "revoked_at": issued_before,
+        }},
+        upsert=True
+    )
+    current_runtime().revoked_users[user_id] = issued_before.timestamp()
+    profile_cache.delete(user_id)
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
+    await sync_revocations()
     try:
-        token = credentials.credentials
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        return payload['user_id']
+        return verify_token(credentials.credentials)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
+class BloomFilter:
+    """Fixed-size Bloom filter over strings: no false negatives, and about
+    `error_rate` false positives until more than `capacity` items are added."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size = max(1024, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value: str):
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, value: str):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+class RegisteredEmails:
+    """Negative-lookup cache of registered emails. Sign-ups on other workers
+    are picked up by polling users.created_at, at most every
+    email_filter_sync_seconds and only when an email misses the filter."""
+
+    def __init__(self):
+        self.filter = None
+        self._synced_at = None  # (monotonic, wall clock) of the last sync
+        self._sync_lock = asyncio.Lock()
+
+    async def load(self):
+        count = await db.users.estimated_document_count()
+        emails = BloomFilter(max(settings.email_filter_min_capacity, 2 * count), settings.email_filter_error_rate)
+        self._synced_at = (time.monotonic(), datetime.now(timezone.utc))
+        async for user in db.users.find({}, {"_id": 0, "email": 1}):
+            emails.add(user['email'].lower())
+        self.filter = emails
+
+    def add(self, email: str):
+        if self.filter is not None:
+            self.filter.add(email.lower())
+
+    async def sync(self, requested_at: float):
+        """Make sure a sync has started since `requested_at` (monotonic). Misses
+        inside the throttle interval wait for the next sync, which they all
+        share, rather than trusting a filter that predates them."""
+        async with self._sync_lock:
+            if self._synced_at[0] >= requested_at:
+                return
+            delay = self._synced_at[0] + settings.email_filter_sync_seconds - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            since = self._synced_at[1] - timedelta(seconds=settings.email_filter_sync_overlap_seconds)
+            self._synced_at = (time.monotonic(), datetime.now(timezone.utc))
+            async for user in db.users.find({"created_at": {"$gte": since}}, {"_id": 0, "email": 1}):
+                self.add(user['email'])
+            if self.filter.count > self.filter.capacity:
+                await self.load()
+
+    async def may_contain(self, email: str) -> bool:
+        if self.filter is None:
+            return True
+        if email.lower() in self.filter:
+            return True
+        await self.sync(time.monotonic())
+        return email.lower() in self.filter
+
+
 # Auth endpoints
 @api_router.post("/auth/register")
 async def register(user_data: UserRegister):
-    existing = await db.users.find_one({"email": user_data.email})
-    if existing:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    
-    user = User(name=user_data.name, email=user_data.email)
+    user = User(name=user_data.name, email=user_data.email, timezone=user_data.timezone)
     user_dict = user.model_dump()
-    user_dict['created_at'] = user_dict['created_at'].isoformat()
-    user_dict['password_hash'] = hash_password(user_data.password)
+    user_dict['password_hash'] = await run_password_job(hash_password, user_data.password)
+    # Other workers' email filters poll created_at, so stamp it as close to the
+    # insert as possible rather than before the queued bcrypt call
+    user_dict['created_at'] = datetime.now(timezone.utc)
     
-    await db.users.insert_one(user_dict)
+    # The unique email index makes concurrent sign-ups for one address safe
+    try:
+        await db.users.insert_one(user_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    registered_emails.add(user.email)
     token = create_token(user.id)
     
     return {"token": token, "user": {"id": user.id, "name": user.name, "email": user.email}}
 
 @api_router.post("/auth/login")
 async def login(credentials: UserLogin):
+    if not await registered_emails.may_contain(credentials.email):
+        raise HTTPException(status_code=401, detail="Invalid credentials")
     user = await db.users.find_one({"email": credentials.email})
-    if not user or not verify_password(credentials.password, user['password_hash']):
+    if not user or not await run_password_job(verify_password, credentials.password, user['password_hash']):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
+    if credentials.timezone and credentials.timezone != user.get('timezone'):
+        # Streak days are bucketed in the user's zone, so re-bucket existing ones
+        await db.users.update_one({"id": user['id']}, {"$set": {"timezone": credentials.timezone}})
+        profile_cache.delete(user['id'])
+        await enqueue_job(user['id'], "rebuild_progress")
+        await backfill_medication_timezones(user['id'])
+    
     token = create_token(user['id'])
     return {"token": token, "user": {"id": user['id'], "name": user['name'], "email": user['email']}}
 
 @api_router.get("/auth/me")
 async def get_me(user_id: str = Depends(get_current_user)):
+    user = profile_cache.get(user_id)
+    if user is not None:
+        return user
     user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    profile_cache.set(user_id, user)
     return user
 
+@api_router.post("/auth/password")
+async def change_password(change: PasswordChange, user_id: str = Depends(get_current_user)):
+    """Replace the user's password, sign out their other sessions and return a
+    fresh token for this one."""
+    user = await db.users.find_one({"id": user_id}, {"password_hash": 1})
+    if not user or not await run_password_job(verify_password, change.current_password, user['password_hash']):
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    password_hash = await run_password_job(hash_password, change.new_password)
+    await db.users.update_one({"id": user_id}, {"$set": {"password_hash": password_hash}})
+    await revoke_user_tokens(user_id)
+    return {"token": create_token(user_id)}
+
+@api_router.post("/auth/logout")
+async def logout(credentials: HTTPAuthorizationCredentials = Depends(security), user_id: str = Depends(get_current_user)):
+    await revoke_token(credentials.credentials)
+    return {"message": "Logged out"}
+
 # Health Records endpoints
 @api_router.post("/health-records", response_model=HealthRecord)
 async def create_health_record(record: HealthRecordCreate, user_id: str = Depends(get_current_user)):
     health_record = HealthRecord(user_id=user_id, **record.model_dump())
-    record_dict = health_record.model_dump()
-    record_dict['recorded_at'] = record_dict['recorded_at'].isoformat()
-    record_dict['created_at'] = record_dict['created_at'].isoformat()
-    
-    await db.health_records.insert_one(record_dict)
+    record_dict = record_document(health_record)
+    async with sync_stamped(user_id, [record_dict]):
+        failed = await insert_records([record_dict])
+    if failed:
+        error = failed[0]
+        if error.get('code') != 11000 or record.idempotency_key is None:
+            raise OperationFailure(error.get('errmsg', ''), error.get('code'), error)
+        # A retried write with the same idempotency key returns the original
+        existing = await records_collection(db).find_one(
+            {"user_id": user_id, "idempotency_key": record.idempotency_key},
+            {"_id": 0}
+        )
+        if not existing:
+            # Time-series mode claims the key before the reading lands, so a
+            # concurrent retry can find the key taken and no record yet
+            raise HTTPException(status_code=409, detail="A write with this idempotency key is in progress",
+                                headers={"Retry-After": "1"})
+        return existing
+    await after_records_created(user_id, [record_dict])
     return health_record
 
+@api_router.post("/health-records/bulk")
+async def create_health_records_bulk(request: Request, user_id: str = Depends(get_current_user)):
+    items = parse_bulk_body(await request.body(), request.headers.get("content-type", ""))
+    if len(items) > settings.bulk_max_items:
+        raise HTTPException(status_code=413, detail=f"At most {settings.bulk_max_items} records per request")
+    
+    results = [None] * len(items)
+    docs, indexes = [], []
+    for i, item in enumerate(items):
+        if isinstance(item, Exception):
+            results[i] = {"index": i, "status": "invalid", "errors": [{"msg": f"Invalid JSON: {item}"}]}
+            continue
+        try:
+            record = HealthRecordCreate.model_validate(item)
+        except ValidationError as e:
+            results[i] = {"index": i, "status": "invalid", "errors": e.errors(include_url=False, include_context=False)}
+            continue
+        docs.append(record_document(HealthRecord(user_id=user_id, **record.model_dump())))
+        indexes.append(i)
+    
+    # Sequence numbers are reserved per chunk, so /sync is held back only
+    # while that chunk is being written
+    written = []
+    for start in range(0, len(docs), BULK_CHUNK_SIZE):
+        chunk = docs[start:start + BULK_CHUNK_SIZE]
+        async with sync_stamped(user_id, chunk):
+            written += await insert_records_chunk(user_id, chunk, indexes[start:start + BULK_CHUNK_SIZE], results)
+    await after_records_created(user_id, written)
+    
+    return bulk_summary(results)
+
 @api_router.get("/health-records", response_model=List[HealthRecord])
-async def get_health_records(user_id: str = Depends(get_current_user), days: int = 30):
-    start_date = datetime.now(timezone.utc) - timedelta(days=days)
-    records = await db.health_records.find(
-        {"user_id": user_id},
-        {"_id": 0}
-    ).sort("recorded_at", -1).to_list(1000)
+async def get_health_records(
+    user_id: str = Depends(get_current_user),
+    days: int = 30,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    limit: Optional[int] = Query(None, ge=1, le=PAGE_SIZE_MAX),
+    cursor: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+):
+    query = apply_cursor({"user_id": user_id, "recorded_at": resolve_window(days, start, end)}, cursor)
+    db_cursor = records_collection(db).find(query, RECORD_PROJECTION).sort([("recorded_at", -1), ("id", -1)])
     
-    for record in records:
-        if isinstance(record.get('recorded_at'), str):
-            record['recorded_at'] = datetime.fromisoformat(record['recorded_at'])
-        if isinstance(record.get('created_at'), str):
-            record['created_at'] = datetime.fromisoformat(record['created_at'])
+    # NDJSON streams the whole window (or `limit` records) straight off the cursor
+    if format == "ndjson":
+        if limit:
+            db_cursor = db_cursor.limit(limit)
+        return StreamingResponse(ndjson_lines(db_cursor), media_type="application/x-ndjson")
+    
+    page_size = limit or PAGE_SIZE_DEFAULT
+    records = await db_cursor.limit(page_size + 1).to_list(page_size + 1)
+    headers = {}
+    if len(records) > page_size:
+        records = records[:page_size]
+        headers["X-Next-Cursor"] = encode_cursor(records[-1]['recorded_at'], records[-1]['id'])
     
-    return records
+    return ORJSONResponse(records, headers=headers)
+
+@api_router.get("/health-records/export")
+async def export_health_records(
+    user_id: str = Depends(get_current_user),
+    format: str = Query("csv", pattern="^(csv|ndjson|parquet)$"),
+    since: Optional[str] = None,
+):
+    """Stream the user's full history, oldest first. Pass the id of the last
+    record received as `since` to resume an interrupted download."""
+    if format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=501, detail="Parquet export is not available on this server")
+    
+    query = {"user_id": user_id}
+    if since:
+        last = await records_collection(db).find_one({"id": since, "user_id": user_id}, {"recorded_at": 1})
+        if not last:
+            raise HTTPException(status_code=400, detail="Unknown since record")
+        query = apply_cursor(query, encode_cursor(last['recorded_at'], since), descending=False)
+    db_cursor = records_collection(db).find(query, RECORD_PROJECTION).sort([("recorded_at", 1), ("id", 1)])
+    
+    writer, media_type = EXPORT_FORMATS[format]
+    return StreamingResponse(
+        writer(db_cursor),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="health-records.{format}"'}
+    )
 
 @api_router.get("/health-records/{record_id}", response_model=HealthRecord)
 async def get_health_record(record_id: str, user_id: str = Depends(get_current_user)):
-    record = await db.health_records.find_one({"id": record_id, "user_id": user_id}, {"_id": 0})
+    record = await records_collection(db).find_one({"id": record_id, "user_id": user_id}, RECORD_PROJECTION)
     if not record:
         raise HTTPException(status_code=404, detail="Record not found")
-    
-    if isinstance(record.get('recorded_at'), str):
-        record['recorded_at'] = datetime.fromisoformat(record['recorded_at'])
-    if isinstance(record.get('created_at'), str):
-        record['created_at'] = datetime.fromisoformat(record['created_at'])
-    
-    return record
+    return ORJSONResponse(record)
 
 @api_router.delete("/health-records/{record_id}")
 async def delete_health_record(record_id: str, user_id: str = Depends(get_current_user)):
-    result = await db.health_records.delete_one({"id": record_id, "user_id": user_id})
-    if result.deleted_count == 0:
+    deleted = await delete_record(user_id, record_id)
+    if not deleted:
         raise HTTPException(status_code=404, detail="Record not found")
+    await after_record_deleted(user_id, deleted)
     return {"message": "Record deleted"}
 
 # Medications endpoints
@@ -206,12 +1909,11 @@ async def delete_health_record(record_id: str, user_id: str = Depends(get_curren
 async def create_medication(med: MedicationCreate, user_id: str = Depends(get_current_user)):
     medication = Medication(user_id=user_id, **med.model_dump())
     med_dict = medication.model_dump()
-    med_dict['start_date'] = med_dict['start_date'].isoformat()
-    if med_dict.get('end_date'):
-        med_dict['end_date'] = med_dict['end_date'].isoformat()
-    med_dict['created_at'] = med_dict['created_at'].isoformat()
-    
-    await db.medications.insert_one(med_dict)
+    async with sync_stamped(user_id, [med_dict]):
+        await db.medications.insert_one(med_dict)
+    reminder_scheduler.upsert(med_dict)
+    await progress_medication_added(user_id)
+    await touch_data_version(user_id)
     return medication
 
 @api_router.get("/medications", response_model=List[Medication])
@@ -220,88 +1922,547 @@ async def get_medications(user_id: str = Depends(get_current_user), active_only:
     if active_only:
         query["active"] = True
     
-    medications = await db.medications.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    medications = await db.medications.find(query, MEDICATION_PROJECTION).sort("created_at", -1).to_list(1000)
+    return ORJSONResponse(medications)
+
+@api_router.get("/medications/due", response_model=List[DueDose])
+async def get_due_medications(
+    user_id: str = Depends(get_current_user),
+    window: int = Query(60, ge=1, le=DUE_WINDOW_MAX_MINUTES, description="minutes ahead to look")
+):
+    """Doses coming due in the next `window` minutes, from the reminder index."""
+    now = datetime.now(timezone.utc)
+    return reminder_scheduler.due(user_id, now, now + timedelta(minutes=window))
+
+@api_router.get("/medications/adherence")
+async def get_adherence(user_id: str = Depends(get_current_user)):
+    """Adherence counts and rates per medication, month and ISO week."""
+    summary = await db.adherence_summaries.find_one({"user_id": user_id}, {"_id": 0})
+    return adherence_report(summary)
+
+@api_router.post("/medications/{med_id}/doses")
+async def log_doses(med_id: str, request: Request, user_id: str = Depends(get_current_user)):
+    """Record taken/skipped outcomes for one or more scheduled doses."""
+    medication = await db.medications.find_one({"id": med_id, "user_id": user_id}, {"_id": 0, "timezone": 1})
+    if medication is None:
+        raise HTTPException(status_code=404, detail="Medication not found")
+    zone = ZoneInfo(medication.get('timezone') or settings.reminder_default_timezone)
+    
+    items = parse_bulk_body(await request.body(), request.headers.get("content-type", ""))
+    if len(items) > settings.bulk_max_items:
+        raise HTTPException(status_code=413, detail=f"At most {settings.bulk_max_items} doses per request")
+    results = [None] * len(items)
+    docs, indexes = [], []
+    for i, item in enumerate(items):
+        if isinstance(item, Exception):
+            results[i] = {"index": i, "status": "invalid", "errors": [{"msg": f"Invalid JSON: {item}"}]}
+            continue
+        try:
+            dose = DoseCreate.model_validate(item)
+        except ValidationError as e:
+            results[i] = {"index": i, "status": "invalid", "errors": e.errors(include_url=False, include_context=False)}
+            continue
+        docs.append(DoseEvent(user_id=user_id, medication_id=med_id, **dose.model_dump()).model_dump())
+        indexes.append(i)
     
-    for med in medications:
-        if isinstance(med.get('start_date'), str):
-            med['start_date'] = datetime.fromisoformat(med['start_date'])
-        if med.get('end_date') and isinstance(med['end_date'], str):
-            med['end_date'] = datetime.fromisoformat(med['end_date'])
-        if isinstance(med.get('created_at'), str):
-            med['created_at'] = datetime.fromisoformat(med['created_at'])
+    failed = {}
+    if docs:
+        try:
+            await db.medication_doses.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            failed = _write_errors(e)
+    duplicates = {i for i, err in failed.items() if err.get('code') == 11000}
+    existing = {}
+    if duplicates:
+        async for doc in db.medication_doses.find(
+            {"medication_id": med_id, "scheduled_for": {"$in": [docs[i]['scheduled_for'] for i in duplicates]}},
+            {"_id": 0, "id": 1, "scheduled_for": 1}
+        ):
+            existing[as_utc(doc['scheduled_for'])] = doc['id']
+    inc = {}
+    for i, doc in enumerate(docs):
+        err = failed.get(i)
+        if i in duplicates:
+            results[indexes[i]] = write_result(indexes[i], existing.get(as_utc(doc['scheduled_for'])), err, duplicate=True)
+            continue
+        results[indexes[i]] = write_result(indexes[i], doc['id'], err)
+        if err is None:
+            add_adherence(inc, med_id, doc['status'], doc['scheduled_for'], zone)
+    if inc:
+        try:
+            await db.adherence_summaries.update_one({"user_id": user_id}, {"$inc": inc}, upsert=True)
+        except DuplicateKeyError:
+            # Lost the upsert race to a concurrent writer; the summary exists now
+            await db.adherence_summaries.update_one({"user_id": user_id}, {"$inc": inc})
     
-    return medications
+    return bulk_summary(results)
 
 @api_router.put("/medications/{med_id}")
 async def update_medication(med_id: str, updates: MedicationCreate, user_id: str = Depends(get_current_user)):
     update_dict = updates.model_dump()
-    update_dict['start_date'] = update_dict['start_date'].isoformat()
-    if update_dict.get('end_date'):
-        update_dict['end_date'] = update_dict['end_date'].isoformat()
-    
-    result = await db.medications.update_one(
-        {"id": med_id, "user_id": user_id},
-        {"$set": update_dict}
-    )
-    if result.matched_count == 0:
+    if update_dict["timezone"] is None:
+        # Older clients don't send one; keep the medication's current zone
+        del update_dict["timezone"]
+    update_dict["updated_at"] = datetime.now(timezone.utc)
+    async with sync_stamped(user_id, [update_dict]):
+        medication = await db.medications.find_one_and_update(
+            {"id": med_id, "user_id": user_id},
+            {"$set": update_dict},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+    if medication is None:
         raise HTTPException(status_code=404, detail="Medication not found")
+    reminder_scheduler.upsert(medication)
+    await touch_data_version(user_id)
     return {"message": "Medication updated"}
 
 @api_router.delete("/medications/{med_id}")
 async def delete_medication(med_id: str, user_id: str = Depends(get_current_user)):
-    result = await db.medications.update_one(
-        {"id": med_id, "user_id": user_id},
-        {"$set": {"active": False}}
-    )
+    deactivate = {"active": False, "updated_at": datetime.now(timezone.utc)}
+    async with sync_stamped(user_id, [deactivate]):
+        result = await db.medications.update_one(
+            {"id": med_id, "user_id": user_id},
+            {"$set": deactivate}
+        )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Medication not found")
+    reminder_scheduler.remove(med_id)
+    await touch_data_version(user_id)
     return {"message": "Medication deleted"}
 
+# Sync endpoint
+@api_router.get("/sync")
+async def sync_changes(
+    user_id: str = Depends(get_current_user),
+    since: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+):
+    """Health records and medications changed since `since`, with deletes as
+    tombstones. Omit `since` for a full snapshot; follow `next` while has_more.
+    `limit` defaults to, and is capped at, the sync_page_size setting."""
+    limit = min(limit or settings.sync_page_size, settings.sync_page_size)
+    seq = 0
+    if since:
+        seq, issued_at = decode_sync_token(since)
+        if time.time() - issued_at > settings.sync_tombstone_days * 86400:
+            raise HTTPException(status_code=410, detail="Sync token expired, resync without `since`")
+    # Stop below the first write still in flight, so the token never moves
+    # past a change that has yet to land
+    query = {"user_id": user_id, "sync_seq": {"$gt": seq, "$lte": await committed_seq(user_id)}}
+    # sync_seq orders the merge and is dropped before documents go out
+    records, medications, tombstones = await asyncio.gather(
+        records_collection(db).find(query, {**RECORD_PROJECTION, "sync_seq": 1}).sort("sync_seq", 1).to_list(limit + 1),
+        db.medications.find(query, {**MEDICATION_PROJECTION, "sync_seq": 1}).sort("sync_seq", 1).to_list(limit + 1),
+        db.sync_tombstones.find(query, {"_id": 0, "user_id": 0}).sort("sync_seq", 1).to_list(limit + 1),
+    )
+    changes = heapq.merge(
+        (("health_records", doc) for doc in records),
+        (("medications", doc) for doc in medications),
+        (("tombstone", doc) for doc in tombstones),
+        key=lambda change: change[1]['sync_seq']
+    )
+    result = {"health_records": [], "medications": [], "deleted": []}
+    count, has_more = 0, False
+    for kind, doc in changes:
+        if count == limit:
+            has_more = True
+            break
+        if kind == "tombstone":
+            result["deleted"].append({"collection": doc['collection'], "id": doc['id'], "deleted_at": doc['deleted_at']})
+        elif kind == "medications" and not doc.get('active', True):
+            result["deleted"].append({"collection": "medications", "id": doc['id'], "deleted_at": doc.get('updated_at')})
+        else:
+            result[kind].append(doc)
+        seq = doc.pop('sync_seq')
+        count += 1
+    return ORJSONResponse({**result, "next": encode_sync_token(seq), "has_more": has_more})
+
+# Search endpoint
+def search_query(user_id: str, q: str, date_field: str, start: Optional[datetime], end: Optional[datetime],
+                 ranked: bool = True) -> dict:
+    """Filter for one search source: the user's documents dated within
+    [start, end] whose notes match `q`, through the text index when `ranked`
+    and as a case-insensitive substring otherwise."""
+    query = {"user_id": user_id}
+    if start or end:
+        query[date_field] = {
+            **({"$gte": as_utc(start)} if start else {}),
+            **({"$lte": as_utc(end)} if end else {}),
+        }
+    if ranked:
+        query["$text"] = {"$search": q}
+    else:
+        query["notes"] = {"$regex": re.escape(q), "$options": "i"}
+    return query
+
+@api_router.get("/search")
+async def search_notes(
+    user_id: str = Depends(get_current_user),
+    q: str = Query(..., min_length=1, max_length=200),
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    type: Optional[str] = Query(None, pattern="^(health_record|medication)$"),
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_PAGE_MAX),
+    offset: int = Query(0, ge=0, le=SEARCH_MAX_OFFSET),
+):
+    """Full-text search over the user's record and medication notes, best match first."""
+    async def search(kind: str) -> list:
+        collection_name, date_field = SEARCH_SOURCES[kind]
+        collection = db[collection_name] if collection_name else records_collection(db)
+        projection = MEDICATION_PROJECTION if collection_name else RECORD_PROJECTION
+        # No text indexes on time-series collections: unranked substring
+        # match, newest first, after every ranked hit
+        ranked = collection.name != settings.records_timeseries_collection
+        query = search_query(user_id, q, date_field, start, end, ranked)
+        # Either source may fill the whole page, so each returns offset + limit + 1 hits
+        if not ranked:
+            cursor = collection.find(query, projection).sort([(date_field, -1)])
+            docs = [{**doc, "score": 0.0} for doc in await cursor.limit(offset + limit + 1).to_list(None)]
+        else:
+            score = {"$meta": "textScore"}
+            cursor = collection.find(query, {**projection, "score": score}).sort([("score", score)])
+            docs = await cursor.limit(offset + limit + 1).to_list(None)
+        return [
+            {"type": kind, "id": doc['id'], "score": doc.pop('score'), "date": doc.get(date_field), "document": doc}
+            for doc in docs
+        ]
+
+    kinds = [type] if type else list(SEARCH_SOURCES)
+    hits = [hit for hits in await asyncio.gather(*(search(kind) for kind in kinds)) for hit in hits]
+    hits.sort(key=lambda hit: hit['score'], reverse=True)
+    has_more = len(hits) > offset + limit
+    return ORJSONResponse({
+        "results": hits[offset:offset + limit],
+        "has_more": has_more,
+        "next_offset": offset + limit if has_more else None,
+    })
+
+# Care link endpoints
+async def user_email(user_id: str) -> Optional[str]:
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "email": 1})
+    return user['email'] if user else None
+
+@api_router.post("/care-links", status_code=202)
+async def create_care_link(body: CareLinkCreate, user_id: str = Depends(get_current_user)):
+    """Invite `caregiver_email` to see the caller's data. The response is the
+    same whether or not the address has an account, so it can't be used to
+    probe for registered emails; the link starts once the caregiver accepts."""
+    if body.caregiver_email == await user_email(user_id):
+        raise HTTPException(status_code=400, detail="Cannot link your own account")
+    invitation = CareInvitation(patient_id=user_id, caregiver_email=body.caregiver_email)
+    try:
+        await db.care_invitations.update_one(
+            {"patient_id": user_id, "caregiver_email": body.caregiver_email},
+            {"$setOnInsert": invitation.model_dump()},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        pass  # the same invitation, sent concurrently
+    return {"message": "Invitation sent"}
+
+@api_router.get("/care-links")
+async def get_care_links(user_id: str = Depends(get_current_user)):
+    """Links where the caller is the patient (`caregivers`) or the caregiver
+    (`patients`), and invitations still waiting on a caregiver."""
+    email = await user_email(user_id)
+    caregivers, patients, sent, received = await asyncio.gather(
+        db.care_links.find({"patient_id": user_id}, {"_id": 0}).to_list(settings.cohort_max_patients),
+        db.care_links.find({"caregiver_id": user_id}, {"_id": 0}).to_list(settings.cohort_max_patients),
+        db.care_invitations.find({"patient_id": user_id}, {"_id": 0}).to_list(settings.cohort_max_patients),
+        db.care_invitations.find({"caregiver_email": email}, {"_id": 0}).to_list(settings.cohort_max_patients),
+    )
+    return ORJSONResponse({
+        "caregivers": caregivers,
+        "patients": patients,
+        "invitations_sent": sent,
+        "invitations_received": received,
+    })
+
+@api_router.post("/care-links/invitations/{invitation_id}/accept", response_model=CareLink)
+async def accept_care_invitation(invitation_id: str, user_id: str = Depends(get_current_user)):
+    """Accept an invitation addressed to the caller's email."""
+    invitation = await db.care_invitations.find_one(
+        {"id": invitation_id, "caregiver_email": await user_email(user_id)}, {"_id": 0}
+    )
+    if not invitation:
+        raise HTTPException(status_code=404, detail="Invitation not found")
+    if not await reserve_care_slot(user_id):
+        raise HTTPException(status_code=400, detail=f"You already have {settings.cohort_max_patients} linked patients")
+    link = CareLink(caregiver_id=user_id, patient_id=invitation['patient_id'])
+    try:
+        await db.care_links.insert_one(link.model_dump())
+    except DuplicateKeyError:
+        await release_care_slot(user_id)
+        await db.care_invitations.delete_one({"id": invitation_id})
+        raise HTTPException(status_code=400, detail="Already linked to this patient")
+    await db.care_invitations.delete_one({"id": invitation_id})
+    await invalidate_cohort(user_id)
+    return link
+
+@api_router.delete("/care-links/invitations/{invitation_id}")
+async def delete_care_invitation(invitation_id: str, user_id: str = Depends(get_current_user)):
+    """The patient may withdraw an invitation and the caregiver may decline it."""
+    result = await db.care_invitations.delete_one(
+        {"id": invitation_id, "$or": [{"patient_id": user_id}, {"caregiver_email": await user_email(user_id)}]}
+    )
+    if not result.deleted_count:
+        raise HTTPException(status_code=404, detail="Invitation not found")
+    return {"message": "Invitation deleted"}
+
+@api_router.delete("/care-links/{link_id}")
+async def delete_care_link(link_id: str, user_id: str = Depends(get_current_user)):
+    """Either side of a link may remove it."""
+    link = await db.care_links.find_one_and_delete(
+        {"id": link_id, "$or": [{"patient_id": user_id}, {"caregiver_id": user_id}]},
+        projection={"_id": 0, "caregiver_id": 1}
+    )
+    if not link:
+        raise HTTPException(status_code=404, detail="Care link not found")
+    await release_care_slot(link['caregiver_id'])
+    await invalidate_cohort(link['caregiver_id'])
+    return {"message": "Care link deleted"}
+
+@api_router.get("/cohort/summary")
+async def get_cohort_summary(
+    user_id: str = Depends(get_current_user),
+    days: int = Query(30, ge=1, le=COHORT_WINDOW_DAYS_MAX),
+):
+    """Latest vitals, out-of-range flags and adherence for every linked patient."""
+    cached = await cohort_cache.get(_cohort_key(user_id)) or {}
+    if str(days) in cached:
+        return cached[str(days)]
+    try:
+        summary = await build_cohort_summary(user_id, days)
+    except ExecutionTimeout:
+        raise HTTPException(status_code=503, detail="Cohort summary timed out", headers={"Retry-After": "5"})
+    await cohort_cache.set(_cohort_key(user_id), {**cached, str(days): summary})
+    return summary
+
+# Job endpoints
+@api_router.post("/jobs", status_code=202)
+async def create_job(body: JobCreate, user_id: str = Depends(get_current_user)):
+    if body.type not in USER_JOB_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown job type, expected one of: {', '.join(sorted(USER_JOB_TYPES))}")
+    job = await enqueue_job(user_id, body.type, body.params)
+    return ORJSONResponse(job_view(job), status_code=202)
+
+@api_router.get("/jobs/{job_id}")
+async def get_job(job_id: str, user_id: str = Depends(get_current_user)):
+    job = await db.jobs.find_one({"id": job_id, "user_id": user_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return ORJSONResponse(job_view(job))
+
 # Analytics endpoints
 @api_router.get("/analytics/trends")
-async def get_trends(user_id: str = Depends(get_current_user), days: int = 30):
-    start_date = datetime.now(timezone.utc) - timedelta(days=days)
-    records = await db.health_records.find(
-        {"user_id": user_id},
-        {"_id": 0}
-    ).sort("recorded_at", 1).to_list(1000)
+async def get_trends(
+    user_id: str = Depends(get_current_user),
+    days: int = 30,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    granularity: Optional[str] = Query(None, pattern="^(day|week|month)$"),
+):
+    # Reads go to the primary, like the data version behind this route's ETag
+    query = {"user_id": user_id, "recorded_at": resolve_window(days, start, end)}
+    
+    # Bucketed rollups return O(buckets) rows instead of every reading
+    if granularity:
+        pipeline = rollup_pipeline(query, granularity, (await user_zone(user_id)).key)
+        buckets = await records_collection(db).aggregate(pipeline).to_list(None)
+        return {"granularity": granularity, "buckets": buckets}
+    
+    records = await records_collection(db).find(query, RECORD_PROJECTION).sort("recorded_at", 1).to_list(1000)
     
     return {"records": records}
 
 @api_router.get("/analytics/stats")
 async def get_stats(user_id: str = Depends(get_current_user)):
-    total_records = await db.health_records.count_documents({"user_id": user_id})
-    active_meds = await db.medications.count_documents({"user_id": user_id, "active": True})
+    # Read the version first: an entry may then include newer writes, but never older data
+    key = _stats_key(user_id, await data_version(user_id))
+    cached = await stats_cache.get(key)
+    if cached is not None:
+        return cached
     
-    # Get latest records for each vital
-    latest_record = await db.health_records.find_one(
-        {"user_id": user_id},
-        {"_id": 0}
-    , sort=[("recorded_at", -1)])
+    total_records, active_meds, latest_record = await asyncio.gather(
+        records_collection(db).count_documents({"user_id": user_id}),
+        db.medications.count_documents({"user_id": user_id, "active": True}),
+        # Get latest records for each vital
+        records_collection(db).find_one({"user_id": user_id}, RECORD_PROJECTION, sort=[("recorded_at", -1)]),
+    )
     
-    return {
+    stats = {
         "total_records": total_records,
         "active_medications": active_meds,
         "latest_vitals": latest_record or {}
     }
+    await stats_cache.set(key, stats)
+    return stats
 
-# Include router
-app.include_router(api_router)
+@api_router.get("/analytics/insights")
+async def get_insights(user_id: str = Depends(get_current_user)):
+    """Rolling means, variability, weekday patterns and range/anomaly flags per vital."""
+    version = await data_version(user_id)
+    cached = await insights_cache.get(_insights_key(user_id, version))
+    if cached is not None:
+        return cached
+    return await refresh_insights(user_id, version)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+@api_router.get("/achievements")
+async def get_achievements(user_id: str = Depends(get_current_user)):
+    progress = await db.user_progress.find_one({"user_id": user_id}, {"_id": 0, "days": 0}) or {}
+    unlocked = progress.get('achievements') or {}
+    return {
+        "current_streak": current_streak(progress, await user_zone(user_id)),
+        "longest_streak": progress.get('longest_streak', 0),
+        "total_records": progress.get('total_records', 0),
+        "achievements": [
+            {**achievement, "unlocked": achievement['id'] in unlocked, "unlocked_at": unlocked.get(achievement['id'])}
+            for achievement in ACHIEVEMENTS
+        ],
+    }
+
+# Health endpoints
+@api_router.get("/healthz")
+async def healthz():
+    """Liveness: the process is up. Reports pool usage without touching Mongo."""
+    return {"status": "ok", "pool": pool_monitor.stats()}
+
+@api_router.get("/readyz")
+async def readyz():
+    """Readiness: startup finished and Mongo answers a ping."""
+    if not current_runtime().ready:
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    started = time.perf_counter()
+    try:
+        await db.command("ping")
+    except Exception as e:
+        logger.warning("Readiness ping failed: %s", e)
+        return JSONResponse(status_code=503, content={"status": "unavailable", "pool": pool_monitor.stats()})
+    return {
+        "status": "ready",
+        "mongo_rtt_ms": round((time.perf_counter() - started) * 1000, 2),
+        "pool": pool_monitor.stats(),
+    }
+
+async def prometheus_metrics():
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+class ETagMiddleware:
+    """Conditional GET for the per-user list endpoints. The ETag
+    comes from the user's data version, so a matching If-None-Match gets a 304
+    after one indexed read, without running the endpoint's queries."""
+
+    def __init__(self, app, window_seconds: int = 300):
+        self.app = app
+        self.window_seconds = window_seconds
+        self._routes = None
+
+    def _route(self, path: str):
+        if self._routes is None:
+            self._routes = {route.path: route for route in api_router.routes if "GET" in getattr(route, "methods", ())}
+        return self._routes.get(path)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET" or scope["path"] not in ETAG_PATHS:
+            return await self.app(scope, receive, send)
+        headers = Headers(scope=scope)
+        scheme, _, token = headers.get("authorization", "").partition(" ")
+        try:
+            await sync_revocations()
+            user_id = verify_token(token) if scheme.lower() == "bearer" else None
+        except jwt.InvalidTokenError:
+            user_id = None
+        if user_id is None:
+            # Let the endpoint produce its usual auth error
+            return await self.app(scope, receive, send)
+
+        parts = [user_id, str(await data_version(user_id)), scope["path"], scope["query_string"].decode("latin-1")]
+        if ETAG_PATHS[scope["path"]] and b"from=" not in scope["query_string"]:
+            parts.append(str(int(time.time() // self.window_seconds)))
+        etag = 'W/"' + hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:24] + '"'
+        cache_headers = [(b"etag", etag.encode("latin-1")), (b"cache-control", b"private, no-cache")]
+
+        if etag in [tag.strip() for tag in headers.get("if-none-match", "").split(",")]:
+            scope["route"] = self._route(scope["path"])  # so metrics label the 304 by route
+            await send({"type": "http.response.start", "status": 304, "headers": cache_headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                message.setdefault("headers", []).extend(cache_headers)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+class RuntimeMiddleware:
+    """Makes the app's runtime the active one for everything a request runs."""
+
+    def __init__(self, app, runtime: Runtime):
+        self.app = app
+        self.runtime = runtime
+
+    async def __call__(self, scope, receive, send):
+        with use_runtime(self.runtime):
+            await self.app(scope, receive, send)
+
+def create_app(settings: Optional[Settings] = None) -> FastAPI:
+    """Build the API app from `settings` (Settings.from_env() by default), e.g.
+    create_app(Settings.from_env(job_worker_mode="external")). Each app gets its
+    own runtime; nothing connects to Mongo until the app's lifespan starts."""
+    runtime = Runtime(settings or Settings.from_env())
+    settings = runtime.settings
+
+    # Stored documents are already in response shape (native datetimes, written
+    # through the models), so list/read endpoints return them as ORJSONResponse
+    # directly and skip a second round of response_model validation.
+    app = FastAPI(lifespan=app_lifespan(runtime), default_response_class=ORJSONResponse)
+    app.state.runtime = runtime
+    app.include_router(api_router)
+    app.add_api_route("/metrics", prometheus_metrics, include_in_schema=False)
+
+    app.add_middleware(ETagMiddleware, window_seconds=settings.etag_window_seconds)
+    app.add_middleware(CompressionMiddleware, minimum_size=settings.compress_min_size)
+    if settings.rate_limit_enabled:
+        app.add_middleware(
+            RateLimitMiddleware,
+            store=make_rate_limit_store(settings),
+            limits=settings.rate_limits,
+            verify_token=verify_token,
+            proxy_hops=settings.rate_limit_proxy_hops,
+        )
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=settings.cors_origins.split(','),
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=[
+            "X-Next-Cursor", "Retry-After",
+            "RateLimit-Limit", "RateLimit-Remaining", "RateLimit-Reset", "RateLimit-Policy",
+        ],
+    )
+    app.add_middleware(
+        MetricsMiddleware,
+        metrics=runtime.metrics,
+        slow_request_seconds=settings.slow_request_seconds,
+        explain=runtime.explain_plan if settings.explain_slow_queries else None,
+    )
+    # Added last so it is outermost: everything below runs against this app's runtime
+    app.add_middleware(RuntimeMiddleware, runtime=runtime)
+    return app
+
+def __getattr__(name: str):
+    # `server:app` is built on first access, so importers that only need the
+    # helpers (the job worker, migration scripts, benchmarks) skip it
+    if name == "app":
+        globals()["app"] = create_app()
+        return globals()["app"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
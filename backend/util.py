@@ -0,0 +1,17 @@
+from datetime import datetime, timezone
+
+def as_utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+async def cursor_batches(cursor, batch_size: int):
+    """Yield a Motor cursor as lists of at most batch_size documents."""
+    batch = []
+    async for doc in cursor.batch_size(batch_size):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,27 @@
+"""Standalone background job worker.
+
+    cd backend && python -m worker
+
+Runs the same job handlers as the API's in-process worker. Set
+JOB_WORKER_MODE=external on the API processes to leave jobs to these.
+"""
+import asyncio
+import signal
+
+import server
+from config import Settings
+from jobs import JobWorker
+
+
+async def main():
+    async with server.Runtime(Settings.from_env()).running():
+        worker = JobWorker()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, worker.stop)
+        server.logger.info("Job worker %s started", worker.name)
+        await worker.run()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,10 +1,13 @@
 import requests
+import os
 import sys
 import json
 from datetime import datetime, timedelta
 
 class HealthDiaryAPITester:
-    def __init__(self, base_url="https://carecompanion-18.preview.emergentagent.com"):
+    def __init__(self, base_url=None):
+        # Functional smoke test; see bench/load_test.py for throughput numbers
+        base_url = base_url or os.environ.get('BACKEND_URL', 'http://localhost:8001')
         self.base_url = base_url
         self.api_url = f"{base_url}/api"
         self.token = None
@@ -329,7 +332,7 @@ class HealthDiaryAPITester:
             return False
 
 def main():
-    tester = HealthDiaryAPITester()
+    tester = HealthDiaryAPITester(sys.argv[1] if len(sys.argv) > 1 else None)
     success = tester.run_all_tests()
     return 0 if success else 1
 
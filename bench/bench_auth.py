@@ -0,0 +1,59 @@
+"""Microbenchmark for per-request bearer token verification.
+
+Compares the old path (full decode + HMAC verification of the JWT on every
+request) with the cached `verify_token` used by `get_current_user`.
+
+    python bench/bench_auth.py --requests 100000 --users 1000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "health_diary_bench")
+
+import jwt  # noqa: E402
+import server  # noqa: E402
+from config import Settings  # noqa: E402
+from runtime import use_runtime  # noqa: E402
+
+
+def uncached_verify(token: str) -> str:
+    payload = jwt.decode(token, server.settings.jwt_secret, algorithms=[server.JWT_ALGORITHM])
+    return payload['user_id']
+
+
+def measure(verify, tokens, requests: int) -> dict:
+    order = [random.choice(tokens) for _ in range(requests)]
+    start = time.perf_counter()
+    for token in order:
+        verify(token)
+    elapsed = time.perf_counter() - start
+    return {"requests": requests, "total_s": round(elapsed, 4), "per_request_us": round(elapsed / requests * 1e6, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=1000, help="distinct tokens in rotation")
+    args = parser.parse_args()
+
+    with use_runtime(server.Runtime(Settings.from_env())):
+        tokens = [server.create_token(f"bench-user-{i}") for i in range(args.users)]
+        results = {
+            "before_uncached_decode": measure(uncached_verify, tokens, args.requests),
+            "after_cached_verify": measure(server.verify_token, tokens, args.requests),
+        }
+    results["speedup"] = round(
+        results["before_uncached_decode"]["per_request_us"] / results["after_cached_verify"]["per_request_us"], 1
+    )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
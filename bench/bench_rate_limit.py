@@ -0,0 +1,84 @@
+"""Microbenchmark for the rate limiting middleware's per-request overhead.
+
+Drives a no-op ASGI app directly, with and without RateLimitMiddleware (in
+memory token buckets) in front of it, for authenticated reads spread over
+--users callers.
+
+    python bench/bench_rate_limit.py --requests 100000 --users 1000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "health_diary_bench")
+
+import server  # noqa: E402
+from config import Settings  # noqa: E402
+from ratelimit import MemoryRateLimitStore, RateLimitMiddleware  # noqa: E402
+from runtime import use_runtime  # noqa: E402
+
+
+async def noop_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+async def noop_send(message):
+    pass
+
+
+def make_scope(token: str) -> dict:
+    return {
+        "type": "http",
+        "method": "GET",
+        "path": "/api/health-records",
+        "headers": [(b"authorization", f"Bearer {token}".encode())],
+        "client": ("10.0.0.1", 50000),
+    }
+
+
+async def measure(app, scopes: list) -> dict:
+    start = time.perf_counter()
+    for scope in scopes:
+        await app(scope, None, noop_send)
+    elapsed = time.perf_counter() - start
+    return {"requests": len(scopes), "total_s": round(elapsed, 4), "per_request_us": round(elapsed / len(scopes) * 1e6, 2)}
+
+
+async def run(args) -> dict:
+    tokens = [server.create_token(f"bench-user-{i}") for i in range(args.users)]
+    scopes = [make_scope(random.choice(tokens)) for _ in range(args.requests)]
+    # Limits high enough that every request is let through
+    limited = RateLimitMiddleware(
+        noop_app, store=MemoryRateLimitStore(), verify_token=server.verify_token,
+        limits={group: "1000000/1" for group in server.settings.rate_limits},
+    )
+    await measure(limited, scopes[:1000])  # warm the token cache
+    results = {
+        "without_rate_limit": await measure(noop_app, scopes),
+        "with_rate_limit": await measure(limited, scopes),
+    }
+    results["overhead_us"] = round(
+        results["with_rate_limit"]["per_request_us"] - results["without_rate_limit"]["per_request_us"], 2
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=1000, help="distinct callers")
+    args = parser.parse_args()
+    with use_runtime(server.Runtime(Settings.from_env())):
+        print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
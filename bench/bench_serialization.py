@@ -0,0 +1,102 @@
+"""Microbenchmark for serializing a page of health records.
+
+Compares the old list path (ISO strings re-parsed per row, validated through
+the response model, then encoded with the stdlib json module) with the
+current one (stored documents with native datetimes encoded by orjson).
+
+    python bench/bench_serialization.py --records 10000 --rounds 20
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "health_diary_bench")
+
+import orjson  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+
+import server  # noqa: E402
+
+
+def stored_records(count: int) -> list:
+    now = datetime.now(timezone.utc)
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "user_id": "bench-user",
+            "systolic_bp": random.randint(100, 160),
+            "diastolic_bp": random.randint(60, 100),
+            "blood_sugar": round(random.uniform(70, 180), 1),
+            "weight": round(random.uniform(50, 110), 1),
+            "temperature": None,
+            "heart_rate": random.randint(50, 110),
+            "notes": None,
+            "recorded_at": now - timedelta(minutes=37 * i),
+            "created_at": now - timedelta(minutes=37 * i),
+        }
+        for i in range(count)
+    ]
+
+
+def old_path(records: list, adapter: TypeAdapter) -> bytes:
+    for record in records:
+        if isinstance(record.get('recorded_at'), str):
+            record['recorded_at'] = datetime.fromisoformat(record['recorded_at'])
+        if isinstance(record.get('created_at'), str):
+            record['created_at'] = datetime.fromisoformat(record['created_at'])
+    models = adapter.validate_python(records)
+    return json.dumps(adapter.dump_python(models, mode='json')).encode('utf-8')
+
+
+def new_path(records: list) -> bytes:
+    return orjson.dumps(records)
+
+
+def measure(serialize, make_input, rounds: int) -> dict:
+    elapsed = 0.0
+    size = 0
+    for _ in range(rounds):
+        records = make_input()
+        start = time.perf_counter()
+        size = len(serialize(records))
+        elapsed += time.perf_counter() - start
+    return {"rounds": rounds, "per_page_ms": round(elapsed / rounds * 1000, 2), "bytes": size}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=10000, help="records per page")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    base = stored_records(args.records)
+    # before the date migration documents came back with ISO string dates
+    legacy = [
+        {**doc, "recorded_at": doc["recorded_at"].isoformat(), "created_at": doc["created_at"].isoformat()}
+        for doc in base
+    ]
+    adapter = TypeAdapter(List[server.HealthRecord])
+
+    results = {
+        "before_reparse_validate_json": measure(
+            lambda records: old_path(records, adapter), lambda: [dict(doc) for doc in legacy], args.rounds
+        ),
+        "after_orjson": measure(new_path, lambda: [dict(doc) for doc in base], args.rounds),
+    }
+    results["speedup"] = round(
+        results["before_reparse_validate_json"]["per_page_ms"] / results["after_orjson"]["per_page_ms"], 1
+    )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
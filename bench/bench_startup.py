@@ -0,0 +1,118 @@
+"""Cold-start benchmark for the API.
+
+Each round starts a fresh interpreter with `python -X importtime` and records
+how long it takes to import server, build the app with create_app(), run the
+lifespan startup (connect, indexes, caches) and answer the first requests.
+Runs against the mongomock stand-in by default, or a local mongod with
+--mongo-url. Also lists the slowest imports under server.
+
+    python bench/bench_startup.py --rounds 5
+    python bench/bench_startup.py --mongo-url mongodb://localhost:27017
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+# Runs in the child; prints one JSON line of timings in milliseconds
+CHILD = """
+import asyncio, json, os, sys, time
+started = time.perf_counter()
+timings = {}
+def mark(name):
+    timings[name] = round((time.perf_counter() - started) * 1000, 1)
+
+import server
+mark("import_server")
+if not os.environ.get("BENCH_MONGO_URL"):
+    from mongomock_motor import AsyncMongoMockClient
+    server.AsyncIOMotorClient = AsyncMongoMockClient
+app = server.create_app()
+mark("create_app")
+
+async def main():
+    import httpx
+    async with app.router.lifespan_context(app):
+        mark("ready")
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            (await client.get("/api/healthz")).raise_for_status()
+            mark("first_response")
+            response = await client.post("/api/auth/register", json={
+                "name": "Bench", "email": f"bench-{time.time_ns()}@example.com", "password": "bench-pass",
+            })
+            response.raise_for_status()
+            headers = {"Authorization": f"Bearer {response.json()['token']}"}
+            (await client.get("/api/health-records", headers=headers)).raise_for_status()
+            mark("first_authenticated_read")
+        if os.environ.get("BENCH_MONGO_URL"):
+            await app.state.runtime.client.drop_database(app.state.runtime.settings.db_name)
+
+asyncio.run(main())
+print(json.dumps(timings))
+"""
+
+
+def parse_importtime(stderr: str) -> list:
+    """(cumulative_us, self_us, module) for every line of -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), int(self_us), module.rstrip()))
+    return rows
+
+
+def run_round(args) -> tuple:
+    env = {
+        **os.environ,
+        "MONGO_URL": args.mongo_url or "mongodb://localhost:27017",
+        "DB_NAME": args.db_name,
+        "BENCH_MONGO_URL": args.mongo_url or "",
+        "JOB_WORKER_MODE": "external",
+        "PRELOAD_ANALYTICS": "false",
+    }
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    rows = parse_importtime(result.stderr)
+    # Imports triggered by `import server` are listed before its own line
+    end = next(i for i, (_, _, module) in enumerate(rows) if module.strip() == "server")
+    return json.loads(result.stdout.strip().splitlines()[-1]), rows[:end + 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--mongo-url", help="local mongod to start against (default: mongomock stand-in)")
+    parser.add_argument("--db-name", default="health_diary_bench_startup")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    args = parser.parse_args()
+
+    rounds = [run_round(args) for _ in range(args.rounds)]
+    timings = {name: statistics.median(r[0][name] for r in rounds) for name in rounds[0][0]}
+    modules = {}
+    for _, rows in rounds:
+        for cumulative, _, module in rows:
+            modules.setdefault(module.strip(), []).append(cumulative)
+    slowest = sorted(((statistics.median(v), m) for m, v in modules.items() if m != "server"), reverse=True)
+    print(json.dumps({
+        "rounds": args.rounds,
+        "backend": "mongod" if args.mongo_url else "mongomock",
+        "median_ms": timings,
+        "server_import_ms": round(statistics.median(
+            next(c for c, _, m in rows if m.strip() == "server") for _, rows in rounds
+        ) / 1000, 1),
+        "slowest_imports_ms": [{"module": m, "cumulative_ms": round(us / 1000, 1)} for us, m in slowest[:args.top]],
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
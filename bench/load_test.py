@@ -0,0 +1,247 @@
+"""Concurrent load test for the hot API endpoints.
+
+Starts the FastAPI app in-process against a local mongod (--mongo-url) or the
+mongomock stand-in (the default), seeds users and records, then drives a
+weighted mix of register/login, record create, list, trends and stats with
+concurrent async clients. Results are printed (and optionally written) as
+JSON so runs can be compared across commits:
+
+    python bench/load_test.py --users 20 --records 500 --requests 5000 --output bench.json
+    python bench/load_test.py --compare bench.json   # exits 1 on a p95 regression
+
+Pass --base-url to drive an already running server over HTTP instead.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+import httpx  # noqa: E402
+
+# name -> relative weight in the request mix
+SCENARIO_WEIGHTS = {
+    "list_records": 30,
+    "stats": 25,
+    "trends": 15,
+    "create_record": 20,
+    "login": 5,
+    "register": 5,
+}
+
+
+def random_record(when: datetime) -> dict:
+    return {
+        "systolic_bp": random.randint(100, 160),
+        "diastolic_bp": random.randint(60, 100),
+        "blood_sugar": round(random.uniform(70, 180), 1),
+        "weight": round(random.uniform(50, 110), 1),
+        "heart_rate": random.randint(50, 110),
+        "recorded_at": when.isoformat(),
+    }
+
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, args):
+        self.client = client
+        self.args = args
+        self.users = []  # (email, password, headers)
+        self.latencies = {name: [] for name in SCENARIO_WEIGHTS}
+        self.errors = {name: 0 for name in SCENARIO_WEIGHTS}
+
+    async def register(self) -> tuple:
+        email = f"bench-{uuid.uuid4().hex[:12]}@example.com"
+        response = await self.client.post("/api/auth/register", json={"name": "Bench", "email": email, "password": "bench-pass"})
+        response.raise_for_status()
+        return email, "bench-pass", {"Authorization": f"Bearer {response.json()['token']}"}
+
+    async def seed(self):
+        now = datetime.now(timezone.utc)
+        for _ in range(self.args.users):
+            user = await self.register()
+            self.users.append(user)
+            for start in range(0, self.args.records, 1000):
+                batch = [
+                    random_record(now - timedelta(minutes=37 * i))
+                    for i in range(start, min(start + 1000, self.args.records))
+                ]
+                response = await self.client.post("/api/health-records/bulk", json=batch, headers=user[2])
+                response.raise_for_status()
+
+    async def run_scenario(self, name: str) -> httpx.Response:
+        email, password, headers = random.choice(self.users)
+        if name == "list_records":
+            return await self.client.get("/api/health-records", params={"days": 90, "limit": 100}, headers=headers)
+        if name == "stats":
+            return await self.client.get("/api/analytics/stats", headers=headers)
+        if name == "trends":
+            params = {"days": 90}
+            # mongomock has no $dateTrunc, so it can only serve raw trends
+            if not self.args.mongomock:
+                params["granularity"] = "day"
+            return await self.client.get("/api/analytics/trends", params=params, headers=headers)
+        if name == "create_record":
+            return await self.client.post("/api/health-records", json=random_record(datetime.now(timezone.utc)), headers=headers)
+        if name == "login":
+            return await self.client.post("/api/auth/login", json={"email": email, "password": password})
+        email = f"bench-{uuid.uuid4().hex[:12]}@example.com"
+        return await self.client.post("/api/auth/register", json={"name": "Bench", "email": email, "password": "bench-pass"})
+
+    async def worker(self, remaining: list):
+        names, weights = list(SCENARIO_WEIGHTS), list(SCENARIO_WEIGHTS.values())
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            name = random.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                response = await self.run_scenario(name)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            self.latencies[name].append(time.perf_counter() - started)
+            if not ok:
+                self.errors[name] += 1
+
+    async def run(self) -> dict:
+        remaining = [self.args.requests]
+        started = time.perf_counter()
+        await asyncio.gather(*(self.worker(remaining) for _ in range(self.args.concurrency)))
+        elapsed = time.perf_counter() - started
+        scenarios = {name: summarize(samples, self.errors[name], elapsed) for name, samples in self.latencies.items()}
+        every = [sample for samples in self.latencies.values() for sample in samples]
+        return {"scenarios": scenarios, "total": summarize(every, sum(self.errors.values()), elapsed)}
+
+
+def percentile(sorted_samples: list, pct: float) -> float:
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, max(0, round(pct / 100 * len(sorted_samples)) - 1))
+    return sorted_samples[index]
+
+
+def summarize(samples: list, errors: int, elapsed: float) -> dict:
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "errors": errors,
+        "rps": round(len(ordered) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2) if ordered else 0.0,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> list:
+    """Return the scenarios whose p95 regressed by more than `threshold`."""
+    regressions = []
+    for name, current in report["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous or not previous["p95_ms"] or not current["count"]:
+            continue
+        change = (current["p95_ms"] - previous["p95_ms"]) / previous["p95_ms"]
+        if change > threshold:
+            regressions.append({"scenario": name, "baseline_p95_ms": previous["p95_ms"], "p95_ms": current["p95_ms"], "change": round(change, 3)})
+    return regressions
+
+
+async def run_in_process(args) -> dict:
+    os.environ["MONGO_URL"] = args.mongo_url or "mongodb://localhost:27017"
+    os.environ["DB_NAME"] = args.db_name
+    # A few bench users drive thousands of requests; limits would skew latencies
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    import server
+
+    if not args.mongo_url:
+        from mongomock_motor import AsyncMongoMockClient
+        server.AsyncIOMotorClient = AsyncMongoMockClient
+
+    app = server.create_app()
+    runtime = app.state.runtime
+    async with app.router.lifespan_context(app):
+        if args.mongo_url:
+            await runtime.client.drop_database(args.db_name)
+            await server.ensure_indexes()
+        else:
+            # mongomock ignores partialFilterExpression, so keyless records
+            # would collide on the idempotency index
+            await runtime.db.health_records.drop_index("user_id_1_idempotency_key_1")
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            return await drive(client, args)
+
+
+async def drive(client: httpx.AsyncClient, args) -> dict:
+    test = LoadTest(client, args)
+    await test.seed()
+    return await test.run()
+
+
+async def main_async(args) -> dict:
+    if args.base_url:
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=60) as client:
+            return await drive(client, args)
+    return await run_in_process(args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--records", type=int, default=200, help="records seeded per user")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--mongo-url", help="local mongod to test against (default: mongomock stand-in)")
+    parser.add_argument("--db-name", default="health_diary_bench")
+    parser.add_argument("--base-url", help="drive a running server over HTTP instead of in-process")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--compare", help="baseline JSON report to check for p95 regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed p95 increase, as a fraction")
+    args = parser.parse_args()
+    args.mongomock = not (args.mongo_url or args.base_url)
+    random.seed(args.seed)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "backend": args.base_url or ("mongod" if args.mongo_url else "mongomock"),
+            "users": args.users,
+            "records_per_user": args.records,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "python": platform.python_version(),
+        },
+        **asyncio.run(main_async(args)),
+    }
+    exit_code = 0
+    if args.compare:
+        with open(args.compare) as f:
+            report["regressions"] = compare(report, json.load(f), args.threshold)
+        exit_code = 1 if report["regressions"] else 0
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -22,9 +22,11 @@ function AuthPage({ onLogin }) {
 
     try {
       const endpoint = isLogin ? '/auth/login' : '/auth/register';
+      // Streak days are counted in the browser's timezone
+      const timezone = Intl.DateTimeFormat().resolvedOptions().timeZone;
       const payload = isLogin 
-        ? { email: formData.email, password: formData.password }
-        : formData;
+        ? { email: formData.email, password: formData.password, timezone }
+        : { ...formData, timezone };
 
       const response = await api.post(endpoint, payload);
       onLogin(response.data.token, response.data.user);
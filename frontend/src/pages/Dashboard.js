@@ -9,7 +9,7 @@ import { toast } from 'sonner';
 import StreakDisplay from '@/components/StreakDisplay';
 import AchievementCard from '@/components/AchievementCard';
 import NotificationBanner from '@/components/NotificationBanner';
-import { calculateStreak, getUnlockedAchievements, getMotivationalMessage, achievements } from '@/utils/achievements';
+import { getMotivationalMessage, achievements } from '@/utils/achievements';
 import { notificationManager } from '@/utils/notifications';
 
 function Dashboard({ user, onLogout }) {
@@ -19,7 +19,6 @@ function Dashboard({ user, onLogout }) {
   const [loading, setLoading] = useState(true);
   const [streak, setStreak] = useState(0);
   const [unlockedAchievements, setUnlockedAchievements] = useState([]);
-  const [allRecords, setAllRecords] = useState([]);
 
   useEffect(() => {
     loadDashboardData();
@@ -27,14 +26,13 @@ function Dashboard({ user, onLogout }) {
 
   const loadDashboardData = async () => {
     try {
-      const [statsRes, trendsRes, recordsRes] = await Promise.all([
+      const [statsRes, trendsRes, achievementsRes] = await Promise.all([
         api.get('/analytics/stats'),
         api.get('/analytics/trends?days=7'),
-        api.get('/health-records?days=365')
+        api.get('/achievements')
       ]);
       
       setStats(statsRes.data);
-      setAllRecords(recordsRes.data);
       
       const chartData = trendsRes.data.records.map(record => ({
         date: new Date(record.recorded_at).toLocaleDateString('en-US', { month: 'short', day: 'numeric' }),
@@ -46,13 +44,11 @@ function Dashboard({ user, onLogout }) {
       
       setTrends(chartData);
       
-      // Calculate streak
-      const currentStreak = calculateStreak(recordsRes.data);
-      setStreak(currentStreak);
+      // Streak and achievements are maintained by the backend
+      setStreak(achievementsRes.data.current_streak);
       
-      // Calculate unlocked achievements
-      const statsWithStreak = { ...statsRes.data, streak: currentStreak };
-      const unlocked = getUnlockedAchievements(statsWithStreak);
+      const unlockedIds = achievementsRes.data.achievements.filter(a => a.unlocked).map(a => a.id);
+      const unlocked = achievements.filter(a => unlockedIds.includes(a.id));
       setUnlockedAchievements(unlocked);
       
       // Show achievement toast if new
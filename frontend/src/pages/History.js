@@ -10,6 +10,8 @@ import { format } from 'date-fns';
 function History({ user, onLogout }) {
   const [records, setRecords] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   useEffect(() => {
     loadRecords();
@@ -17,8 +19,9 @@ function History({ user, onLogout }) {
 
   const loadRecords = async () => {
     try {
-      const response = await api.get('/health-records?days=90');
+      const response = await api.get('/health-records?days=90&limit=50');
       setRecords(response.data);
+      setNextCursor(response.headers['x-next-cursor'] || null);
     } catch (error) {
       toast.error('Failed to load records');
     } finally {
@@ -26,6 +29,21 @@ function History({ user, onLogout }) {
     }
   };
 
+  const loadMore = async () => {
+    setLoadingMore(true);
+    try {
+      const response = await api.get('/health-records', {
+        params: { days: 90, limit: 50, cursor: nextCursor }
+      });
+      setRecords([...records, ...response.data]);
+      setNextCursor(response.headers['x-next-cursor'] || null);
+    } catch (error) {
+      toast.error('Failed to load records');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleDelete = async (recordId) => {
     if (!window.confirm('Are you sure you want to delete this record?')) return;
 
@@ -133,6 +151,19 @@ function History({ user, onLogout }) {
                 </CardContent>
               </Card>
             ))}
+            {nextCursor && (
+              <div className="flex justify-center">
+                <Button
+                  variant="outline"
+                  data-testid="load-more-records-btn"
+                  onClick={loadMore}
+                  disabled={loadingMore}
+                  className="border-emerald-200 text-emerald-700 hover:bg-emerald-50"
+                >
+                  {loadingMore ? 'Loading...' : 'Load more'}
+                </Button>
+              </div>
+            )}
           </div>
         )}
       </div>
@@ -13,6 +13,7 @@ import { format } from 'date-fns';
 
 function Medications({ user, onLogout }) {
   const [medications, setMedications] = useState([]);
+  const [adherence, setAdherence] = useState({});
   const [loading, setLoading] = useState(true);
   const [dialogOpen, setDialogOpen] = useState(false);
   const [formData, setFormData] = useState({
@@ -30,8 +31,12 @@ function Medications({ user, onLogout }) {
 
   const loadMedications = async () => {
     try {
-      const response = await api.get('/medications');
+      const [response, adherenceResponse] = await Promise.all([
+        api.get('/medications'),
+        api.get('/medications/adherence')
+      ]);
       setMedications(response.data);
+      setAdherence(adherenceResponse.data.medications);
     } catch (error) {
       toast.error('Failed to load medications');
     } finally {
@@ -50,7 +55,9 @@ function Medications({ user, onLogout }) {
     try {
       const payload = {
         ...formData,
-        start_date: new Date(formData.start_date).toISOString()
+        start_date: new Date(formData.start_date).toISOString(),
+        // Reminders fire at time_of_day in the browser's timezone
+        timezone: Intl.DateTimeFormat().resolvedOptions().timeZone
       };
 
       await api.post('/medications', payload);
@@ -259,6 +266,11 @@ function Medications({ user, onLogout }) {
                     <p className="text-xs text-emerald-600">
                       Started: {format(new Date(med.start_date), 'MMM d, yyyy')}
                     </p>
+                    {adherence[med.id]?.rate != null && (
+                      <p className="text-xs text-emerald-600" data-testid={`med-adherence-${idx}`}>
+                        Adherence: {Math.round(adherence[med.id].rate * 100)}% ({adherence[med.id].taken}/{adherence[med.id].scheduled} doses)
+                      </p>
+                    )}
                   </div>
                 </CardContent>
               </Card>
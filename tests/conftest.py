@@ -0,0 +1,67 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "health_diary_test")
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def runtime():
+    """A fresh server.Runtime, active for the test, without a Mongo connection."""
+    import server
+    from config import Settings
+    from runtime import use_runtime
+
+    runtime = server.Runtime(Settings.from_env())
+    with use_runtime(runtime):
+        yield runtime
+    runtime.password_executor.shutdown(wait=False)
+
+
+@pytest.fixture
+def mongo(runtime):
+    """A fresh mongomock database wired in as the runtime's db and analytics_db."""
+    from mongomock_motor import AsyncMongoMockClient
+
+    runtime.db = runtime.analytics_db = AsyncMongoMockClient()[runtime.settings.db_name]
+    return runtime.db
+
+
+@pytest.fixture
+async def api(monkeypatch):
+    """An httpx client for an app running its lifespan against mongomock. The
+    app is at `api.app`; its database at `api.app.state.runtime.db`."""
+    import httpx
+    import server
+    from config import Settings
+    from mongomock_motor import AsyncMongoMockClient
+
+    monkeypatch.setattr(server, "AsyncIOMotorClient", AsyncMongoMockClient)
+    app = server.create_app(Settings.from_env(job_worker_mode="external", preload_analytics=False, rate_limit_enabled=False))
+    async with app.router.lifespan_context(app):
+        # mongomock ignores partialFilterExpression and only skips a sparse
+        # document when every indexed field is missing, so key on the
+        # idempotency key alone; tests never reuse a key across users
+        records = app.state.runtime.db.health_records
+        await records.drop_index("user_id_1_idempotency_key_1")
+        await records.create_index("idempotency_key", unique=True, sparse=True)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            client.app = app
+            yield client
+
+
+@pytest.fixture
+async def auth_headers(api):
+    """Bearer headers for a freshly registered user."""
+    response = await api.post("/api/auth/register", json={"name": "Ann", "email": "ann@example.com", "password": "secret-pass"})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['token']}"}
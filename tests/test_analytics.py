@@ -0,0 +1,63 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+
+
+def test_rollup_buckets_start_at_local_midnight():
+    match = {"user_id": "u1"}
+    pipeline = server.rollup_pipeline(match, "week", "America/New_York")
+    assert pipeline[0] == {"$match": match}
+    bucket = pipeline[1]["$group"]["_id"]["$dateTrunc"]
+    assert bucket == {"date": "$recorded_at", "unit": "week", "timezone": "America/New_York", "startOfWeek": "monday"}
+    assert server.rollup_pipeline(match, "day")[1]["$group"]["_id"]["$dateTrunc"]["timezone"] == "UTC"
+    assert pipeline[-1]["$project"]["heart_rate"]["mean"] == "$heart_rate_mean"
+
+
+@pytest.mark.anyio
+async def test_trends_are_bucketed_in_the_users_zone(mongo, monkeypatch):
+    await mongo.users.insert_one({"id": "u1", "email": "a@example.com", "timezone": "Asia/Tokyo"})
+    pipelines = []
+
+    def aggregate(pipeline):
+        pipelines.append(pipeline)
+        return SimpleNamespace(to_list=lambda length: _async([]))
+
+    monkeypatch.setattr(server, "records_collection", lambda database: SimpleNamespace(aggregate=aggregate))
+    result = await server.get_trends(user_id="u1", days=30, start=None, end=None, granularity="day")
+    assert result == {"granularity": "day", "buckets": []}
+    assert pipelines[0][1]["$group"]["_id"]["$dateTrunc"]["timezone"] == "Asia/Tokyo"
+
+
+async def _async(value):
+    return value
+
+
+@pytest.mark.anyio
+async def test_stats_are_read_from_the_primary(mongo, runtime):
+    # A secondary that hasn't caught up with any write yet
+    runtime.analytics_db = AsyncMongoMockClient()["lagging"]
+    await mongo.health_records.insert_one({"id": "r1", "user_id": "u1", "heart_rate": 61})
+    await server.touch_data_version("u1")
+    stats = await server.get_stats(user_id="u1")
+    assert stats['total_records'] == 1 and stats['latest_vitals']['id'] == "r1"
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("path", ["/api/analytics/trends", "/api/analytics/stats"])
+async def test_analytics_etags_follow_the_primary(api, auth_headers, path):
+    # A secondary that hasn't caught up with any write yet
+    api.app.state.runtime.analytics_db = AsyncMongoMockClient()["lagging"]
+    first = await api.get(path, headers=auth_headers)
+    etag = first.headers['etag']
+    assert (await api.get(path, headers={**auth_headers, "If-None-Match": etag})).status_code == 304
+
+    reading = {"heart_rate": 61, "recorded_at": datetime.now(timezone.utc).isoformat()}
+    await api.post("/api/health-records", json=reading, headers=auth_headers)
+    response = await api.get(path, headers={**auth_headers, "If-None-Match": etag})
+    assert response.status_code == 200 and response.headers['etag'] != etag
+    body = response.json()
+    assert (body['records'][0] if path.endswith("trends") else body['latest_vitals'])['heart_rate'] == 61
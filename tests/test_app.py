@@ -0,0 +1,76 @@
+import httpx
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+from config import Settings
+
+
+async def _register(app, email: str) -> httpx.Response:
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/api/auth/register", json={"name": "A", "email": email, "password": "secret-pass"})
+
+
+def test_settings_take_overrides_and_reject_unknown_names():
+    settings = Settings.from_env(mongo_url="mongodb://other:27017", sync_page_size=50)
+    assert settings.mongo_url == "mongodb://other:27017"
+    assert settings.sync_page_size == 50
+    with pytest.raises(ValueError):
+        Settings.from_env(sync_page_sise=50)
+
+
+@pytest.mark.anyio
+async def test_apps_keep_their_own_settings_and_pools(monkeypatch):
+    monkeypatch.setattr(server, "AsyncIOMotorClient", AsyncMongoMockClient)
+    first = server.create_app(Settings.from_env(db_name="first", job_worker_mode="external", preload_analytics=False))
+    second = server.create_app(Settings.from_env(db_name="second", job_worker_mode="external",
+                                                 preload_analytics=False, compress_min_size=10))
+    assert first.state.runtime.settings.compress_min_size == 1024
+    assert first.state.runtime.password_executor is not second.state.runtime.password_executor
+
+    assert (await _register(first, "a@example.com")).status_code == 200
+    # Shutting the first app down leaves the second one's password pool alone
+    assert (await _register(second, "b@example.com")).status_code == 200
+
+
+@pytest.mark.anyio
+async def test_readyz_waits_for_startup(monkeypatch):
+    monkeypatch.setattr(server, "AsyncIOMotorClient", AsyncMongoMockClient)
+    app = server.create_app(Settings.from_env(job_worker_mode="external", preload_analytics=False))
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/api/readyz")
+        assert response.status_code == 503
+        assert response.json() == {"status": "starting"}
+        # Liveness never depends on startup or Mongo
+        assert (await client.get("/api/healthz")).status_code == 200
+
+        async with app.router.lifespan_context(app):
+            response = await client.get("/api/readyz")
+            assert response.status_code == 200
+            assert response.json()['status'] == "ready"
+            assert "pool" in (await client.get("/api/healthz")).json()
+        assert (await client.get("/api/readyz")).status_code == 503
+
+
+@pytest.mark.anyio
+async def test_readyz_reports_an_unreachable_database(api, monkeypatch):
+    async def fail(*args, **kwargs):
+        raise ConnectionError("no primary")
+
+    monkeypatch.setattr(api.app.state.runtime.db, "command", fail)
+    response = await api.get("/api/readyz")
+    assert response.status_code == 503
+    assert response.json()['status'] == "unavailable"
+
+
+@pytest.mark.anyio
+async def test_analytics_libraries_load_before_ready(monkeypatch):
+    monkeypatch.setattr(server, "AsyncIOMotorClient", AsyncMongoMockClient)
+    app = server.create_app(Settings.from_env(job_worker_mode="external", preload_analytics=True))
+    seen = []
+    monkeypatch.setattr(server, "preload_analytics", lambda: seen.append(app.state.runtime.ready))
+    async with app.router.lifespan_context(app):
+        assert seen == [False]
+        assert app.state.runtime.ready
@@ -0,0 +1,81 @@
+import pytest
+
+import cache
+import server
+from cache import LRUCache
+
+
+def test_lru_entries_expire_after_their_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    entries = LRUCache(10, ttl=30)
+    entries.set("profile", 1)
+    entries.set("token", 2, ttl=5)
+    now[0] += 10
+    assert entries.get("token") is None
+    assert entries.get("profile") == 1
+    now[0] += 30
+    assert entries.get("profile") is None
+    assert len(entries) == 0
+
+
+@pytest.mark.anyio
+async def test_cached_tokens_honour_exp(api, auth_headers):
+    runtime = api.app.state.runtime
+    token = auth_headers['Authorization'].split()[1]
+    assert (await api.get("/api/auth/me", headers=auth_headers)).status_code == 200
+    user_id, expires_at, issued_at = runtime.verified_tokens.get(server.token_key(token))
+    assert expires_at > server.time.time()
+
+    # A token whose exp has passed is rejected even with a cache entry for it
+    expired = server.jwt.encode({"user_id": user_id, "exp": 1, "iat": 0}, runtime.settings.jwt_secret,
+                                algorithm=server.JWT_ALGORITHM)
+    runtime.verified_tokens.set(server.token_key(expired), (user_id, 1, 0))
+    response = await api.get("/api/auth/me", headers={"Authorization": f"Bearer {expired}"})
+    assert response.status_code == 401
+    assert response.json()['detail'] == "Token expired"
+
+
+@pytest.mark.anyio
+async def test_profile_cache_expires(api, auth_headers):
+    runtime = api.app.state.runtime
+    runtime.profile_cache = LRUCache(10, ttl=0)
+    await api.get("/api/auth/me", headers=auth_headers)
+    await runtime.db.users.update_one({"email": "ann@example.com"}, {"$set": {"name": "Anna"}})
+    assert (await api.get("/api/auth/me", headers=auth_headers)).json()['name'] == "Anna"
+
+
+@pytest.mark.anyio
+async def test_password_change_revokes_cached_tokens(api, auth_headers):
+    assert (await api.get("/api/auth/me", headers=auth_headers)).status_code == 200
+    response = await api.post("/api/auth/password", headers=auth_headers,
+                              json={"current_password": "wrong", "new_password": "new-secret"})
+    assert response.status_code == 401
+
+    response = await api.post("/api/auth/password", headers=auth_headers,
+                              json={"current_password": "secret-pass", "new_password": "new-secret"})
+    assert response.status_code == 200
+    fresh = {"Authorization": f"Bearer {response.json()['token']}"}
+    # The old token is still in the verified-token cache but no longer accepted
+    assert (await api.get("/api/auth/me", headers=auth_headers)).status_code == 401
+    assert (await api.get("/api/auth/me", headers=fresh)).status_code == 200
+    login = await api.post("/api/auth/login", json={"email": "ann@example.com", "password": "new-secret"})
+    assert login.status_code == 200
+
+
+@pytest.mark.anyio
+async def test_other_workers_pick_up_user_revocations(api, auth_headers):
+    runtime = api.app.state.runtime
+    me = (await api.get("/api/auth/me", headers=auth_headers)).json()
+    assert runtime.profile_cache.get(me['id']) is not None
+
+    # Another worker revoked the user's tokens and removed the account
+    other = server.Runtime(runtime.settings)
+    other.db = runtime.db
+    with server.use_runtime(other):
+        await server.revoke_user_tokens(me['id'])
+    await runtime.db.users.delete_one({"id": me['id']})
+    runtime.revocations_synced_at = None
+
+    assert (await api.get("/api/auth/me", headers=auth_headers)).status_code == 401
+    assert runtime.profile_cache.get(me['id']) is None
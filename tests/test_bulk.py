@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+
+def _reading(heart_rate: int, **extra) -> dict:
+    return {"heart_rate": heart_rate, "recorded_at": "2024-03-01T08:00:00Z", **extra}
+
+
+@pytest.mark.anyio
+async def test_json_batch_reports_each_item(api, auth_headers):
+    items = [_reading(60), _reading("fast"), _reading(62, idempotency_key="k1"), _reading(63, idempotency_key="k1")]
+    response = await api.post("/api/health-records/bulk", json=items, headers=auth_headers)
+    assert response.status_code == 200
+    body = response.json()
+    assert [result['status'] for result in body['results']] == ["created", "invalid", "created", "duplicate"]
+    assert [result['index'] for result in body['results']] == [0, 1, 2, 3]
+    assert body['results'][1]['errors'][0]['loc'] == ["heart_rate"]
+    # The repeat inside the batch points at the record that was kept
+    assert body['results'][3]['id'] == body['results'][2]['id']
+    assert {key: body[key] for key in ("created", "duplicate", "invalid", "error")} == \
+        {"created": 2, "duplicate": 1, "invalid": 1, "error": 0}
+    assert await api.app.state.runtime.db.health_records.count_documents({}) == 2
+
+
+@pytest.mark.anyio
+async def test_ndjson_batch_dedupes_against_earlier_batches(api, auth_headers):
+    first = await api.post("/api/health-records/bulk", json=[_reading(70, idempotency_key="k1")], headers=auth_headers)
+    original = first.json()['results'][0]['id']
+
+    lines = [json.dumps(_reading(71)), "{not json", json.dumps(_reading(72, recorded_at="yesterday")), "",
+             json.dumps(_reading(73, idempotency_key="k1"))]
+    response = await api.post("/api/health-records/bulk", content="\n".join(lines), headers={
+        **auth_headers, "Content-Type": "application/x-ndjson",
+    })
+    results = response.json()['results']
+    assert [result['status'] for result in results] == ["created", "invalid", "invalid", "duplicate"]
+    assert results[1]['errors'][0]['msg'].startswith("Invalid JSON")
+    assert results[3]['id'] == original
+    assert await api.app.state.runtime.db.health_records.count_documents({"heart_rate": 73}) == 0
+
+
+@pytest.mark.anyio
+async def test_bodies_that_are_not_a_list_are_rejected(api, auth_headers):
+    response = await api.post("/api/health-records/bulk", json={"heart_rate": 60}, headers=auth_headers)
+    assert response.status_code == 400
@@ -0,0 +1,92 @@
+import asyncio
+import dataclasses
+
+import pytest
+
+import server
+
+
+async def _login(api, email: str) -> dict:
+    response = await api.post("/api/auth/register", json={"name": email, "email": email, "password": "secret-pass"})
+    return {"Authorization": f"Bearer {response.json()['token']}"}
+
+
+async def _invite(api, headers: dict, email: str):
+    return await api.post("/api/care-links", json={"caregiver_email": email}, headers=headers)
+
+
+@pytest.mark.anyio
+async def test_invitations_look_the_same_for_unknown_emails(api, auth_headers):
+    await _login(api, "carer@example.com")
+    known = await _invite(api, auth_headers, "carer@example.com")
+    unknown = await _invite(api, auth_headers, "nobody@example.com")
+    assert (known.status_code, known.json()) == (unknown.status_code, unknown.json()) == (202, {"message": "Invitation sent"})
+    # Sending one again is a no-op
+    assert (await _invite(api, auth_headers, "carer@example.com")).status_code == 202
+
+    links = (await api.get("/api/care-links", headers=auth_headers)).json()
+    assert links['caregivers'] == []
+    assert sorted(i['caregiver_email'] for i in links['invitations_sent']) == ["carer@example.com", "nobody@example.com"]
+    assert (await _invite(api, auth_headers, "ann@example.com")).status_code == 400
+
+
+@pytest.mark.anyio
+async def test_links_start_once_the_caregiver_accepts(api, auth_headers):
+    carer = await _login(api, "carer@example.com")
+    stranger = await _login(api, "stranger@example.com")
+    await _invite(api, auth_headers, "carer@example.com")
+    invitation = (await api.get("/api/care-links", headers=carer)).json()['invitations_received'][0]
+    assert (await api.get("/api/cohort/summary", headers=carer)).json()['patients'] == []
+
+    accept = f"/api/care-links/invitations/{invitation['id']}/accept"
+    assert (await api.post(accept, headers=stranger)).status_code == 404
+    assert (await api.post(accept, headers=auth_headers)).status_code == 404
+    link = (await api.post(accept, headers=carer)).json()
+    assert link['patient_id'] == invitation['patient_id']
+    assert (await api.post(accept, headers=carer)).status_code == 404
+
+    links = (await api.get("/api/care-links", headers=auth_headers)).json()
+    assert [l['id'] for l in links['caregivers']] == [link['id']] and links['invitations_sent'] == []
+    assert len((await api.get("/api/cohort/summary", headers=carer)).json()['patients']) == 1
+
+
+@pytest.mark.anyio
+async def test_invitations_can_be_declined_or_withdrawn(api, auth_headers):
+    carer = await _login(api, "carer@example.com")
+    for headers in (carer, auth_headers):
+        await _invite(api, auth_headers, "carer@example.com")
+        invitation = (await api.get("/api/care-links", headers=auth_headers)).json()['invitations_sent'][0]
+        response = await api.delete(f"/api/care-links/invitations/{invitation['id']}", headers=headers)
+        assert response.status_code == 200
+        assert (await api.get("/api/care-links", headers=carer)).json()['invitations_received'] == []
+
+
+@pytest.mark.anyio
+async def test_concurrent_accepts_respect_the_patient_cap(api):
+    runtime = api.app.state.runtime
+    runtime.settings = dataclasses.replace(runtime.settings, cohort_max_patients=2)
+    carer = await _login(api, "carer@example.com")
+    for n in range(4):
+        await _invite(api, await _login(api, f"patient{n}@example.com"), "carer@example.com")
+    invitations = (await api.get("/api/care-links", headers=carer)).json()['invitations_received']
+
+    responses = await asyncio.gather(*(
+        api.post(f"/api/care-links/invitations/{i['id']}/accept", headers=carer) for i in invitations
+    ))
+    assert sorted(r.status_code for r in responses) == [200, 200, 400, 400]
+    assert await runtime.db.care_links.count_documents({}) == 2
+
+    # Unlinking frees a slot
+    link = next(r.json() for r in responses if r.status_code == 200)
+    await api.delete(f"/api/care-links/{link['id']}", headers=carer)
+    pending = next(i for i, r in zip(invitations, responses) if r.status_code == 400)
+    assert (await api.post(f"/api/care-links/invitations/{pending['id']}/accept", headers=carer)).status_code == 200
+
+
+@pytest.mark.anyio
+async def test_slot_count_is_seeded_from_existing_links(mongo, runtime):
+    runtime.settings = dataclasses.replace(runtime.settings, cohort_max_patients=2)
+    await mongo.care_links.insert_one(server.CareLink(caregiver_id="c1", patient_id="p1").model_dump())
+    assert await server.reserve_care_slot("c1")
+    assert not await server.reserve_care_slot("c1")
+    assert (await mongo.care_link_counts.find_one({"_id": "c1"}))['patients'] == 2
@@ -0,0 +1,53 @@
+import csv
+import io
+
+import pytest
+
+import server
+
+
+async def _ingest(api, headers, count: int) -> list:
+    items = [{"heart_rate": 60 + day, "notes": f"day {day}", "recorded_at": f"2024-03-{day:02d}T08:00:00Z"}
+             for day in range(1, count + 1)]
+    response = await api.post("/api/health-records/bulk", json=items, headers=headers)
+    return [result['id'] for result in response.json()['results']]
+
+
+@pytest.mark.anyio
+async def test_csv_export_has_a_column_per_field(api, auth_headers):
+    ids = await _ingest(api, auth_headers, 3)
+    response = await api.get("/api/health-records/export", params={"format": "csv"}, headers=auth_headers)
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert tuple(rows[0]) == server.EXPORT_FIELDS
+    assert [row['id'] for row in rows] == ids
+    assert [row['heart_rate'] for row in rows] == ["61", "62", "63"]
+    assert rows[0]['recorded_at'].startswith("2024-03-01T08:00:00")
+    assert rows[0]['weight'] == ""
+
+
+@pytest.mark.anyio
+async def test_export_resumes_after_since(api, auth_headers):
+    ids = await _ingest(api, auth_headers, 4)
+    response = await api.get("/api/health-records/export", params={"format": "csv", "since": ids[1]}, headers=auth_headers)
+    assert [row['id'] for row in csv.DictReader(io.StringIO(response.text))] == ids[2:]
+
+    response = await api.get("/api/health-records/export", params={"since": "missing"}, headers=auth_headers)
+    assert response.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_parquet_export_keeps_column_types(api, auth_headers):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    ids = await _ingest(api, auth_headers, 3)
+    response = await api.get("/api/health-records/export", params={"format": "parquet", "since": ids[0]}, headers=auth_headers)
+    assert response.status_code == 200
+    table = pq.read_table(io.BytesIO(response.content))
+    assert table.schema.names == list(server.EXPORT_FIELDS)
+    assert table.schema.field("heart_rate").type == pa.int64()
+    assert table.schema.field("recorded_at").type == pa.timestamp("ms", tz="UTC")
+    assert table.column("id").to_pylist() == ids[1:]
+    assert table.column("notes").to_pylist() == ["day 2", "day 3"]
@@ -0,0 +1,80 @@
+import dataclasses
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import jobs
+
+
+@pytest.fixture
+def worker(mongo, runtime, monkeypatch):
+    runtime.settings = dataclasses.replace(runtime.settings, job_user_concurrency=2, job_max_attempts=2)
+
+    async def echo(user_id, params):
+        if params.get('fail'):
+            raise ValueError("boom")
+        return {"user_id": user_id}
+
+    monkeypatch.setitem(jobs.JOB_HANDLERS, "echo", echo)
+    return jobs.JobWorker()
+
+
+async def _running(mongo, user_id: str) -> int:
+    return ((await mongo.job_slots.find_one({"_id": user_id})) or {}).get('running', 0)
+
+
+@pytest.mark.anyio
+async def test_claims_stop_at_each_users_concurrency(mongo, worker):
+    for _ in range(3):
+        await jobs.enqueue_job("u1", "echo")
+    await jobs.enqueue_job("u2", "echo")
+
+    claimed = [await worker.claim() for _ in range(4)]
+    assert sorted(job['user_id'] for job in claimed[:3]) == ["u1", "u1", "u2"]
+    assert claimed[3] is None
+    assert await _running(mongo, "u1") == 2
+    assert all(job['status'] == "running" and job['worker'] == worker.name for job in claimed[:3])
+
+
+@pytest.mark.anyio
+async def test_finished_jobs_release_their_slot(mongo, worker):
+    await jobs.enqueue_job("u1", "echo")
+    job = await worker.claim()
+    await worker.execute(job)
+    stored = await mongo.jobs.find_one({"id": job['id']})
+    assert stored['status'] == "succeeded" and stored['result'] == {"user_id": "u1"}
+    assert await _running(mongo, "u1") == 0
+
+
+@pytest.mark.anyio
+async def test_failures_back_off_then_fail_after_max_attempts(mongo, worker):
+    await jobs.enqueue_job("u1", "echo", {"fail": True})
+    job = await worker.claim()
+    await worker.execute(job)
+    stored = await mongo.jobs.find_one({"id": job['id']})
+    assert stored['status'] == "queued" and stored['error'] == "ValueError: boom"
+    assert stored['run_at'].replace(tzinfo=timezone.utc) > datetime.now(timezone.utc)
+
+    await mongo.jobs.update_one({"id": job['id']}, {"$set": {"run_at": datetime.now(timezone.utc)}})
+    await worker.execute(await worker.claim())
+    stored = await mongo.jobs.find_one({"id": job['id']})
+    assert stored['status'] == "failed" and stored['attempts'] == 2
+    assert await _running(mongo, "u1") == 0
+
+
+@pytest.mark.anyio
+async def test_expired_leases_are_requeued_and_released_once(mongo, worker):
+    await jobs.enqueue_job("u1", "echo")
+    job = await worker.claim()
+    # The worker stalls past its lease
+    await mongo.jobs.update_one({"id": job['id']}, {"$set": {"locked_until": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+    await worker.reap()
+    stored = await mongo.jobs.find_one({"id": job['id']})
+    assert stored['status'] == "queued" and stored['worker'] is None
+    assert await _running(mongo, "u1") == 0
+
+    # When the stalled worker finishes, its result is dropped and the slot isn't released twice
+    rerun = await jobs.JobWorker().claim()
+    await worker.execute(job)
+    assert (await mongo.jobs.find_one({"id": job['id']}))['worker'] == rerun['worker']
+    assert await _running(mongo, "u1") == 1
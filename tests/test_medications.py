@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+
+def _medication(user_id: str, **fields) -> dict:
+    return server.Medication(
+        user_id=user_id,
+        name="Metformin",
+        dosage="500mg",
+        frequency="daily",
+        time_of_day=["08:00"],
+        start_date=datetime(2024, 3, 1, tzinfo=timezone.utc),
+        **fields,
+    ).model_dump()
+
+
+@pytest.mark.anyio
+async def test_backfill_gives_medications_their_owners_timezone(mongo):
+    await mongo.users.insert_many([
+        {"id": "u1", "email": "a@example.com", "timezone": "Europe/Berlin"},
+        {"id": "u2", "email": "b@example.com"},
+    ])
+    await mongo.medications.insert_many([
+        _medication("u1"),
+        _medication("u1", timezone="Asia/Tokyo"),
+        _medication("u2"),
+    ])
+
+    await server.backfill_medication_timezones()
+
+    zones = {(doc['user_id'], doc.get('timezone')) async for doc in mongo.medications.find()}
+    assert zones == {("u1", "Europe/Berlin"), ("u1", "Asia/Tokyo"), ("u2", None)}
+
+
+@pytest.mark.anyio
+async def test_doses_missed_while_down_are_counted_once(mongo, runtime):
+    scheduler = runtime.reminder_scheduler
+    now = datetime.now(timezone.utc)
+    await mongo.medications.insert_one(_medication("u1", created_at=now - timedelta(days=5)))
+    last_due = (now - timedelta(days=2)).replace(hour=8, minute=0, second=0, microsecond=0)
+    medication_id = (await mongo.medications.find_one())['id']
+    await mongo.adherence_summaries.insert_one(
+        {"user_id": "u1", "medications": {medication_id: {"last_due": {"0800": last_due}}}}
+    )
+
+    await scheduler.load()
+    expected = sum(1 for days in range(1, 4) if last_due + timedelta(days=days) <= scheduler.loaded_at)
+    await server.count_missed_doses()
+    await server.count_missed_doses()  # another worker starting up
+
+    summary = await mongo.adherence_summaries.find_one({"user_id": "u1"})
+    assert summary['medications'][medication_id]['scheduled'] == expected
+    assert server.as_utc(summary['medications'][medication_id]['last_due']['0800']) > last_due
+
+
+
+@pytest.mark.anyio
+async def test_slots_without_last_due_count_from_their_first_load(mongo, runtime):
+    scheduler = runtime.reminder_scheduler
+    now = datetime.now(timezone.utc)
+    # Created long before counting began: its past doses are not back-filled
+    await mongo.medications.insert_one(_medication("u1", created_at=now - timedelta(days=5)))
+    medication_id = (await mongo.medications.find_one())['id']
+
+    await scheduler.load()
+    await server.count_missed_doses()
+    summary = await mongo.adherence_summaries.find_one({"user_id": "u1"})
+    counters = summary['medications'][medication_id]
+    assert counters.get('scheduled', 0) == 0
+    # BSON dates keep milliseconds
+    assert abs(server.as_utc(counters['counted_from']['0800']) - scheduler.loaded_at) < timedelta(milliseconds=1)
+
+    # A later start counts what came due since the slot was first loaded,
+    # and does not move counted_from
+    first_load = now - timedelta(days=2)
+    await mongo.adherence_summaries.update_one(
+        {"user_id": "u1"}, {"$set": {f"medications.{medication_id}.counted_from.0800": first_load}}
+    )
+    await scheduler.load()
+    expected = len(scheduler.missed({(medication_id, "08:00"): first_load}, scheduler.loaded_at))
+    await server.count_missed_doses()
+    counters = (await mongo.adherence_summaries.find_one({"user_id": "u1"}))['medications'][medication_id]
+    assert expected >= 1 and counters['scheduled'] == expected
+    assert abs(server.as_utc(counters['counted_from']['0800']) - first_load) < timedelta(milliseconds=1)
+
+
+def test_missed_skips_slots_without_a_start(runtime):
+    scheduler = runtime.reminder_scheduler
+    scheduler.upsert(_medication("u1", created_at=datetime(2024, 3, 1, tzinfo=timezone.utc)))
+    assert scheduler.missed({}, datetime.now(timezone.utc)) == []
+
+
+def test_bulk_endpoints_share_the_item_result_shape():
+    assert server.write_result(0, "a") == {"index": 0, "status": "created", "id": "a"}
+    assert server.write_result(1, "b", {"code": 11000}, duplicate=True) == {"index": 1, "status": "duplicate", "id": "b"}
+    assert server.write_result(2, "c", {"code": 2, "errmsg": "boom"}) == {
+        "index": 2, "status": "error", "errors": [{"msg": "boom"}],
+    }
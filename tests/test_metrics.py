@@ -0,0 +1,88 @@
+import re
+from types import SimpleNamespace
+
+import pytest
+
+from metrics import CommandMonitor, Metrics, PoolMonitor, RequestTrace, current_trace
+
+SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_][a-zA-Z0-9_]*="(\\.|[^"\\])*",?)*\})? -?[0-9.e+-]+$')
+
+
+def _samples(text: str) -> dict:
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith("#"):
+            assert re.match(r"^# (HELP|TYPE) [a-zA-Z_:][a-zA-Z0-9_:]* .+$", line), line
+            continue
+        assert SAMPLE.match(line), line
+        name, value = line.rsplit(" ", 1)
+        samples[name] = float(value)
+    return samples
+
+
+def _command(monitor: CommandMonitor, request_id: int, name: str, collection: str, reply: dict):
+    event = SimpleNamespace(connection_id=("db", 27017), request_id=request_id, command_name=name,
+                            command={name: collection}, database_name="health_diary")
+    monitor.started(event)
+    monitor.succeeded(SimpleNamespace(**vars(event), reply=reply, duration_micros=2500))
+
+
+def test_commands_are_attributed_to_the_request_that_issued_them():
+    metrics = Metrics(PoolMonitor(10))
+    monitor = CommandMonitor(metrics)
+    trace = RequestTrace()
+    token = current_trace.set(trace)
+    try:
+        _command(monitor, 1, "find", "health_records", {"cursor": {"firstBatch": [{}, {}, {}]}})
+        _command(monitor, 2, "update", "user_progress", {"n": 1})
+    finally:
+        current_trace.reset(token)
+    # Outside any request: counted per command, not per route
+    _command(monitor, 3, "find", "health_records", {"cursor": {"firstBatch": []}})
+    metrics.observe_request("GET", "/api/health-records", 200, 0.01, 512, trace)
+
+    assert [(c['command'], c['collection'], c['documents']) for c in trace.commands] == \
+        [("find", "health_records", 3), ("update", "user_progress", 1)]
+    samples = _samples(metrics.render())
+    assert samples['mongodb_route_commands_total{route="/api/health-records"}'] == 2
+    assert samples['mongodb_route_documents_returned_total{route="/api/health-records"}'] == 4
+    assert samples['mongodb_route_duration_seconds_total{route="/api/health-records"}'] == pytest.approx(0.005)
+    assert samples['mongodb_command_duration_seconds_count{command="find",collection="health_records"}'] == 2
+    assert samples['mongodb_documents_returned_total{command="find",collection="health_records"}'] == 3
+
+
+def test_histogram_buckets_are_cumulative():
+    metrics = Metrics(PoolMonitor(10))
+    for seconds in (0.002, 0.02, 20.0):
+        metrics.observe_request("GET", "/api/healthz", 200, seconds, 100, RequestTrace())
+    samples = _samples(metrics.render())
+    labels = 'method="GET",route="/api/healthz",status="200"'
+    assert samples[f'http_request_duration_seconds_bucket{{{labels},le="0.001"}}'] == 0
+    assert samples[f'http_request_duration_seconds_bucket{{{labels},le="0.005"}}'] == 1
+    assert samples[f'http_request_duration_seconds_bucket{{{labels},le="10.0"}}'] == 2
+    assert samples[f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}}'] == 3
+    assert samples[f'http_request_duration_seconds_count{{{labels}}}'] == 3
+    assert samples[f'http_request_duration_seconds_sum{{{labels}}}'] == pytest.approx(20.022)
+
+
+def test_label_values_are_escaped():
+    metrics = Metrics(PoolMonitor(10))
+    metrics.observe_command("find", 'odd"name\\', 0.001, 0)
+    assert 'collection="odd\\"name\\\\"' in metrics.render()
+    _samples(metrics.render())
+
+
+@pytest.mark.anyio
+async def test_metrics_endpoint_labels_routes_by_template(api, auth_headers):
+    for record_id in ("a", "b", "c"):
+        assert (await api.get(f"/api/health-records/{record_id}", headers=auth_headers)).status_code == 404
+    await api.get("/api/no-such-route")
+
+    response = await api.get("/metrics")
+    assert response.headers['content-type'].startswith("text/plain; version=0.0.4")
+    samples = _samples(response.text)
+    labels = 'method="GET",route="/api/health-records/{record_id}",status="404"'
+    assert samples[f'http_request_duration_seconds_count{{{labels}}}'] == 3
+    assert not any("/api/health-records/a" in name for name in samples)
+    assert any('route="unmatched"' in name for name in samples)
+    assert "mongodb_pool_connections_open" in samples
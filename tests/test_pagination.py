@@ -0,0 +1,66 @@
+import base64
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+def _raw_cursor(value) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip('=')
+
+
+def test_cursor_round_trips_its_position():
+    recorded_at = datetime(2024, 3, 1, 8, 30, tzinfo=timezone.utc)
+    assert server.decode_cursor(server.encode_cursor(recorded_at, "r1")) == (recorded_at, "r1")
+    # Naive datetimes from older documents are read as UTC
+    assert server.decode_cursor(server.encode_cursor(recorded_at.replace(tzinfo=None), "r1"))[0] == recorded_at
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", _raw_cursor(["2024-03-01T00:00:00", 7]),
+                                    _raw_cursor([1709251200, "r1"]), _raw_cursor({"at": "2024-03-01"})])
+def test_malformed_cursors_are_rejected(cursor):
+    with pytest.raises(HTTPException) as excinfo:
+        server.decode_cursor(cursor)
+    assert excinfo.value.status_code == 400
+
+
+def test_cursor_only_tightens_the_window():
+    recorded_at = datetime(2024, 3, 1, tzinfo=timezone.utc)
+    cursor = server.encode_cursor(recorded_at, "r1")
+    later = {"recorded_at": {"$lte": recorded_at + timedelta(days=1)}}
+    assert server.apply_cursor(later, cursor)["recorded_at"]["$lte"] == recorded_at
+    earlier = {"recorded_at": {"$lte": recorded_at - timedelta(days=1)}}
+    assert server.apply_cursor(earlier, cursor)["recorded_at"]["$lte"] == recorded_at - timedelta(days=1)
+    assert server.apply_cursor({"user_id": "u1"}, None) == {"user_id": "u1"}
+
+
+@pytest.mark.anyio
+async def test_pages_split_ties_without_gaps_or_repeats(mongo):
+    start = datetime(2024, 3, 1, tzinfo=timezone.utc)
+    # Several records share a timestamp, so only the id keeps the order total
+    await mongo.health_records.insert_many([
+        {"id": f"r{i}", "user_id": "u1", "recorded_at": start + timedelta(minutes=i // 3)} for i in range(10)
+    ])
+    seen, cursor = [], None
+    while True:
+        query = server.apply_cursor({"user_id": "u1"}, cursor)
+        page = await mongo.health_records.find(query).sort([("recorded_at", -1), ("id", -1)]).to_list(4)
+        if not page:
+            break
+        seen += [doc['id'] for doc in page]
+        cursor = server.encode_cursor(page[-1]['recorded_at'], page[-1]['id'])
+    assert sorted(seen) == sorted(f"r{i}" for i in range(10))
+    assert len(seen) == len(set(seen))
+
+
+@pytest.mark.anyio
+async def test_naive_cursor_combines_with_an_explicit_end(mongo):
+    await mongo.health_records.insert_one({"id": "r1", "user_id": "u1", "recorded_at": datetime(2023, 12, 31, tzinfo=timezone.utc)})
+    response = await server.get_health_records(
+        user_id="u1", days=30, start=datetime(2023, 1, 1, tzinfo=timezone.utc), end=datetime(2026, 1, 1, tzinfo=timezone.utc),
+        limit=None, cursor=_raw_cursor(["2024-01-01T00:00:00", "x"]), format="json",
+    )
+    assert [doc['id'] for doc in json.loads(response.body)] == ["r1"]
@@ -0,0 +1,36 @@
+import asyncio
+import threading
+
+import pytest
+
+import server
+
+
+@pytest.mark.anyio
+async def test_cancelled_request_keeps_its_slot_until_bcrypt_finishes(runtime):
+    release = threading.Event()
+    task = asyncio.create_task(server.run_password_job(release.wait, 5))
+    await asyncio.sleep(0.05)
+    assert runtime.password_jobs == 1
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    # the thread is still hashing, so the slot is still taken
+    assert runtime.password_jobs == 1
+
+    release.set()
+    for _ in range(100):
+        if runtime.password_jobs == 0:
+            break
+        await asyncio.sleep(0.01)
+    assert runtime.password_jobs == 0
+
+
+@pytest.mark.anyio
+async def test_sheds_load_beyond_workers_and_queue(runtime):
+    runtime.password_jobs = runtime.settings.password_hash_workers + runtime.settings.password_hash_queue_limit
+    with pytest.raises(server.HTTPException) as excinfo:
+        await server.run_password_job(lambda: None)
+    assert excinfo.value.status_code == 503
+    assert excinfo.value.headers["Retry-After"] == str(runtime.settings.password_hash_retry_after)
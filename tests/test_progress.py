@@ -0,0 +1,72 @@
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+import server
+
+
+def test_summarize_days_finds_longest_and_latest_run():
+    days = {"2024-03-01": 2, "2024-03-02": 1, "2024-03-03": 1, "2024-03-07": 1, "2024-03-08": 3}
+    assert server.summarize_days(days) == {
+        "longest_streak": 3,
+        "last_active_day": "2024-03-08",
+        "last_run_length": 2,
+    }
+
+
+def test_summarize_days_ignores_emptied_days():
+    days = {"2024-03-01": 1, "2024-03-02": 0, "2024-03-03": 1}
+    assert server.summarize_days(days)["longest_streak"] == 1
+    assert server.summarize_days({}) == {"longest_streak": 0, "last_active_day": None, "last_run_length": 0}
+
+
+def test_extend_summary_continues_and_restarts_runs():
+    before = {"version": 4, "summary_version": 4, "longest_streak": 3, "last_active_day": "2024-03-08", "last_run_length": 2}
+    assert server._extend_summary(before, ["2024-03-09", "2024-03-08"]) == {
+        "longest_streak": 3,
+        "last_active_day": "2024-03-09",
+        "last_run_length": 3,
+    }
+    assert server._extend_summary(before, ["2024-03-11"])["last_run_length"] == 1
+
+
+def test_extend_summary_falls_back_to_rescan():
+    before = {"version": 4, "summary_version": 4, "last_active_day": "2024-03-08", "last_run_length": 2}
+    # A day before the last active one can join or split runs
+    assert server._extend_summary(before, ["2024-03-05"]) is None
+    # The stored summary lags the counters
+    assert server._extend_summary({**before, "summary_version": 3}, ["2024-03-09"]) is None
+
+
+def test_day_key_uses_the_users_zone():
+    late_evening = datetime(2024, 3, 2, 3, 30, tzinfo=timezone.utc)
+    assert server._day_key(late_evening) == "2024-03-02"
+    assert server._day_key(late_evening, ZoneInfo("America/New_York")) == "2024-03-01"
+    assert server._day_key(late_evening, ZoneInfo("Asia/Kolkata")) == "2024-03-02"
+
+
+def test_current_streak_checks_today_in_the_users_zone():
+    zone = ZoneInfo("Pacific/Kiritimati")  # UTC+14, a different date from UTC most of the day
+    today = datetime.now(zone).date()
+    progress = {"last_active_day": today.isoformat(), "last_run_length": 5}
+    assert server.current_streak(progress, zone) == 5
+    stale = {"last_active_day": (today - timedelta(days=1)).isoformat(), "last_run_length": 5}
+    assert server.current_streak(stale, zone) == 0
+
+
+@pytest.mark.anyio
+async def test_records_are_bucketed_in_the_owners_zone(mongo):
+    await mongo.users.insert_one({"id": "u1", "name": "A", "email": "a@example.com", "timezone": "America/New_York"})
+    recorded = datetime(2024, 3, 2, 3, 30, tzinfo=timezone.utc)
+    await server.progress_records_created("u1", [{"recorded_at": recorded}, {"recorded_at": recorded + timedelta(days=1)}])
+
+    progress = await mongo.user_progress.find_one({"user_id": "u1"})
+    assert progress["days"] == {"2024-03-01": 1, "2024-03-02": 1}
+    assert progress["longest_streak"] == 2
+    assert date.fromisoformat(progress["last_active_day"]) == date(2024, 3, 2)
+
+    await server.progress_record_deleted("u1", recorded)
+    progress = await mongo.user_progress.find_one({"user_id": "u1"})
+    assert "2024-03-01" not in progress["days"]
+    assert progress["total_records"] == 1
@@ -0,0 +1,115 @@
+import os
+import uuid
+
+import httpx
+import jwt
+import pytest
+from fastapi import FastAPI
+
+from ratelimit import MemoryRateLimitStore, RateLimitMiddleware, RedisRateLimitStore
+
+
+@pytest.mark.anyio
+async def test_bucket_empties_then_refills_at_its_rate():
+    store = MemoryRateLimitStore()
+    taken = [await store.take("u1", capacity=3, rate=1.0, now=100.0) for _ in range(4)]
+    assert [allowed for allowed, _ in taken] == [True, True, True, False]
+    assert taken[2][1] == 0
+
+    # Half a second refills half a token: still not enough for a request, but kept
+    assert await store.take("u1", capacity=3, rate=1.0, now=100.5) == (False, 0.5)
+    assert await store.take("u1", capacity=3, rate=1.0, now=102.0) == (True, 1.0)
+
+
+@pytest.mark.anyio
+async def test_buckets_are_per_key_and_never_overfill():
+    store = MemoryRateLimitStore()
+    for _ in range(2):
+        await store.take("u1", capacity=2, rate=1.0, now=0.0)
+    assert (await store.take("u2", capacity=2, rate=1.0, now=0.0))[0] is True
+    # A long idle spell refills to capacity, not beyond it
+    assert await store.take("u1", capacity=2, rate=1.0, now=1000.0) == (True, 1)
+
+
+@pytest.mark.anyio
+async def test_redis_store_matches_the_memory_store():
+    pytest.importorskip("redis")
+    url = os.environ.get("TEST_REDIS_URL")
+    if not url:
+        pytest.skip("TEST_REDIS_URL is not set")
+    store = RedisRateLimitStore(url, prefix=f"test:{uuid.uuid4().hex}:")
+    taken = [await store.take("u1", capacity=3, rate=1.0, now=100.0) for _ in range(4)]
+    assert [allowed for allowed, _ in taken] == [True, True, True, False]
+    assert await store.take("u1", capacity=3, rate=1.0, now=100.5) == (False, 0.5)
+    assert await store.take("u1", capacity=3, rate=1.0, now=102.0) == (True, 1.0)
+    assert await store.take("u1", capacity=3, rate=1.0, now=1000.0) == (True, 2.0)
+
+
+def _verify(token: str) -> str:
+    if not token.startswith("user-"):
+        raise jwt.InvalidTokenError("bad token")
+    return token
+
+
+@pytest.fixture
+async def limited():
+    """A client for a small app behind RateLimitMiddleware: 2 requests per
+    10 seconds for reads and logins, 1 per 10 seconds for writes."""
+    app = FastAPI()
+
+    @app.get("/api/items")
+    @app.get("/api/healthz")
+    async def read():
+        return {"ok": True}
+
+    @app.post("/api/items")
+    @app.post("/api/auth/login")
+    async def write():
+        return {"ok": True}
+
+    limits = {"auth": "2/10", "reads": "2/10", "writes": "1/10", "analytics": "1/10"}
+    app.add_middleware(RateLimitMiddleware, store=MemoryRateLimitStore(), limits=limits, verify_token=_verify, proxy_hops=1)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+
+@pytest.mark.anyio
+async def test_429_once_the_bucket_is_empty(limited):
+    first, second, third = [await limited.get("/api/items") for _ in range(3)]
+    assert first.headers['ratelimit-limit'] == "2"
+    assert first.headers['ratelimit-policy'] == "2;w=10"
+    assert [r.headers['ratelimit-remaining'] for r in (first, second, third)] == ["1", "0", "0"]
+    assert second.headers['ratelimit-reset'] == "10"
+    assert third.status_code == 429
+    assert third.json() == {"detail": "Too many requests"}
+    assert 1 <= int(third.headers['retry-after']) <= 5
+    assert "retry-after" not in second.headers
+
+
+@pytest.mark.anyio
+async def test_callers_are_keyed_by_user_then_by_ip(limited):
+    ann, bob = {"Authorization": "Bearer user-ann"}, {"Authorization": "Bearer user-bob"}
+    assert (await limited.post("/api/items", headers=ann)).status_code == 200
+    assert (await limited.post("/api/items", headers=ann)).status_code == 429
+    # Same IP, different user: a separate bucket
+    assert (await limited.post("/api/items", headers=bob)).status_code == 200
+    # A token that doesn't verify falls back to the (forwarded) IP
+    bad = {"Authorization": "Bearer forged", "X-Forwarded-For": "203.0.113.7"}
+    assert (await limited.post("/api/items", headers=bad)).status_code == 200
+    assert (await limited.post("/api/items", headers={"X-Forwarded-For": "203.0.113.7"})).status_code == 429
+    assert (await limited.post("/api/items", headers={"X-Forwarded-For": "203.0.113.8"})).status_code == 200
+
+
+@pytest.mark.anyio
+async def test_logins_are_keyed_by_ip_even_with_a_token(limited):
+    for user in ("user-ann", "user-bob"):
+        assert (await limited.post("/api/auth/login", headers={"Authorization": f"Bearer {user}"})).status_code == 200
+    assert (await limited.post("/api/auth/login", headers={"Authorization": "Bearer user-cat"})).status_code == 429
+
+
+@pytest.mark.anyio
+async def test_health_checks_are_exempt(limited):
+    for _ in range(5):
+        response = await limited.get("/api/healthz")
+        assert response.status_code == 200
+    assert "ratelimit-limit" not in response.headers
@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta, timezone
+
+import orjson
+import pytest
+
+import server
+
+
+def _record(user_id: str, minutes_ago: int, **extra) -> dict:
+    record = server.HealthRecord(
+        user_id=user_id,
+        heart_rate=60 + minutes_ago,
+        recorded_at=datetime.now(timezone.utc) - timedelta(minutes=minutes_ago),
+    )
+    return {**server.record_document(record), **extra}
+
+
+@pytest.mark.anyio
+async def test_record_responses_leave_out_bookkeeping_fields(mongo):
+    doc = _record("u1", 5, sync_seq=7, synced_at=datetime.now(timezone.utc))
+    await mongo.health_records.insert_one(dict(doc))
+
+    detail = orjson.loads((await server.get_health_record(doc['id'], user_id="u1")).body)
+    listed = await server.get_health_records(user_id="u1", days=30, start=None, end=None, limit=None, cursor=None, format="json")
+    for body in (detail, orjson.loads(listed.body)[0]):
+        assert body['id'] == doc['id']
+        assert set(body) <= set(server.HealthRecord.model_fields)
+        assert "sync_seq" not in body and "synced_at" not in body
+
+
+@pytest.mark.anyio
+async def test_insights_cache_follows_the_data_version(mongo):
+    await mongo.health_records.insert_one(_record("u1", 10))
+    assert (await server.get_insights(user_id="u1"))['records'] == 1
+
+    # A write from another worker: only the shared data version moves
+    await mongo.health_records.insert_one(_record("u1", 5))
+    await server.touch_data_version("u1")
+    assert (await server.get_insights(user_id="u1"))['records'] == 2
+
+
+@pytest.mark.anyio
+async def test_stats_are_fresh_once_the_version_moves(mongo):
+    await mongo.health_records.insert_one(_record("u1", 10))
+    assert (await server.get_stats(user_id="u1"))['total_records'] == 1
+
+    newer = _record("u1", 1)
+    await mongo.health_records.insert_one(dict(newer))
+    await server.after_records_created("u1", [newer])
+    stats = await server.get_stats(user_id="u1")
+    assert stats['total_records'] == 2
+    assert stats['latest_vitals']['id'] == newer['id']
+
+
+@pytest.mark.anyio
+async def test_iso_date_migration_converts_strings_once(mongo):
+    await mongo.health_records.insert_many([
+        {"id": "r1", "user_id": "u1", "recorded_at": "2024-03-01T08:30:00+00:00", "created_at": "2024-03-01T08:31:00"},
+        {"id": "r2", "user_id": "u1", "recorded_at": datetime(2024, 3, 2, tzinfo=timezone.utc), "created_at": "not a date"},
+    ])
+    await server.migrate_iso_dates(batch_size=1)
+    first = {doc['id']: doc async for doc in mongo.health_records.find({}, {"_id": 0})}
+    assert first['r1']['recorded_at'] == datetime(2024, 3, 1, 8, 30)
+    assert first['r1']['created_at'] == datetime(2024, 3, 1, 8, 31)
+    assert first['r2']['created_at'] == "not a date"  # left for a human to look at
+
+    await server.migrate_iso_dates()
+    assert {doc['id']: doc async for doc in mongo.health_records.find({}, {"_id": 0})} == first
+
+
+@pytest.mark.anyio
+async def test_windows_filter_on_recorded_at(mongo):
+    await mongo.health_records.insert_many([_record("u1", minutes) for minutes in (60, 3 * 24 * 60, 10 * 24 * 60)]
+                                           + [_record("u2", 60)])
+
+    async def heart_rates(**window):
+        params = {"days": 30, "start": None, "end": None, **window}
+        response = await server.get_health_records(user_id="u1", limit=None, cursor=None, format="json", **params)
+        return [doc['heart_rate'] for doc in orjson.loads(response.body)]
+
+    now = datetime.now(timezone.utc)
+    assert await heart_rates() == [120, 60 + 3 * 24 * 60, 60 + 10 * 24 * 60]
+    assert await heart_rates(days=5) == [120, 60 + 3 * 24 * 60]
+    assert await heart_rates(start=now - timedelta(days=11), end=now - timedelta(days=1)) == [60 + 3 * 24 * 60, 60 + 10 * 24 * 60]
+    # An explicit `from` takes precedence over `days`
+    assert await heart_rates(days=1, start=now - timedelta(days=4)) == [120, 60 + 3 * 24 * 60]
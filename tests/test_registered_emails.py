@@ -0,0 +1,55 @@
+import asyncio
+import dataclasses
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def emails(mongo, runtime):
+    runtime.settings = dataclasses.replace(runtime.settings, email_filter_sync_seconds=0.05, email_filter_min_capacity=1000)
+    return server.RegisteredEmails()
+
+
+@pytest.mark.anyio
+async def test_signup_on_another_worker_is_found_right_after_a_sync(mongo, emails):
+    await mongo.users.insert_one({"id": "u1", "email": "a@example.com", "created_at": datetime.now(timezone.utc)})
+    await emails.load()
+    assert await emails.may_contain("A@example.com")
+    assert not await emails.may_contain("nobody@example.com")  # this miss just synced
+
+    # Another worker stamped created_at before its slow insert landed
+    await mongo.users.insert_one({"id": "u2", "email": "b@example.com",
+                                  "created_at": datetime.now(timezone.utc) - timedelta(seconds=30)})
+    assert await emails.may_contain("b@example.com")
+
+
+@pytest.mark.anyio
+async def test_concurrent_misses_share_one_sync(mongo, emails, runtime, monkeypatch):
+    await emails.load()
+    queries = []
+    users = mongo.users
+    find = users.find
+
+    def counting_find(*args, **kwargs):
+        queries.append(args)
+        return find(*args, **kwargs)
+
+    monkeypatch.setattr(users, "find", counting_find)
+    monkeypatch.setattr(runtime, "db", SimpleNamespace(users=users))
+    results = await asyncio.gather(*(emails.may_contain(f"x{i}@example.com") for i in range(20)))
+    assert results == [False] * 20
+    assert len(queries) == 1
+
+
+def test_bloom_filter_has_no_false_negatives_and_few_false_positives():
+    emails = server.BloomFilter(capacity=5000, error_rate=0.01)
+    added = [f"user{i}@example.com" for i in range(5000)]
+    for email in added:
+        emails.add(email)
+    assert all(email in emails for email in added)
+    false_positives = sum(f"other{i}@example.com" in emails for i in range(20000))
+    assert false_positives / 20000 < 0.02
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from scheduler import ReminderScheduler
+
+
+def _medication(medication_id: str, **fields) -> dict:
+    return {
+        "id": medication_id, "user_id": "u1", "name": "Metformin", "dosage": "500mg",
+        "time_of_day": ["08:00"], "start_date": datetime(2024, 3, 1, tzinfo=timezone.utc),
+        "timezone": "UTC", "active": True, **fields,
+    }
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = ReminderScheduler()
+    scheduler.fired = []
+
+    async def record(fired):
+        scheduler.fired += [(medication.id, slot, due_at) for medication, slot, due_at in fired]
+
+    scheduler.handlers.append(record)
+    return scheduler
+
+
+@pytest.mark.anyio
+async def test_due_dose_fires_once_and_the_next_one_is_scheduled(scheduler):
+    scheduler.upsert(_medication("m1", time_of_day=["08:00", "Evening"]))
+    first = scheduler.heap[0][0]
+    await scheduler.fire_due(first - 1)
+    assert scheduler.fired == []
+
+    await scheduler.fire_due(first)
+    due_at = datetime.fromtimestamp(first, timezone.utc)
+    assert len(scheduler.fired) == 1 and scheduler.fired[0][0] == "m1" and scheduler.fired[0][2] == due_at
+    assert len(scheduler.heap) == 2
+    slot = scheduler.fired[0][1]
+    rescheduled = [entry[0] for entry in scheduler.heap if entry[3] == slot]
+    assert rescheduled == [(due_at + timedelta(days=1)).timestamp()]
+
+
+@pytest.mark.anyio
+async def test_updated_and_removed_medications_leave_only_stale_entries(scheduler):
+    scheduler.upsert(_medication("m1"))
+    scheduler.upsert(_medication("m1", dosage="1000mg"))
+    scheduler.upsert(_medication("m2"))
+    scheduler.remove("m2")
+    assert len(scheduler.heap) == 3 and scheduler.slot_count == 1
+
+    await scheduler.fire_due(scheduler.heap[0][0])
+    assert [medication_id for medication_id, _, _ in scheduler.fired] == ["m1"]
+    assert len(scheduler.heap) == 1  # the stale entries were popped and dropped
+
+
+def test_stale_entries_are_compacted_once_they_outnumber_live_ones(scheduler):
+    for version in range(1500):
+        scheduler.upsert(_medication("m1", dosage=f"{version}mg"))
+    assert scheduler.slot_count == 1
+    assert len(scheduler.heap) <= 1024
+    assert sum(scheduler._live(entry) for entry in scheduler.heap) == 1
+
+
+def test_inactive_and_finished_medications_are_not_scheduled(scheduler):
+    scheduler.upsert(_medication("m1", active=False))
+    scheduler.upsert(_medication("m2", end_date=datetime(2024, 3, 2, tzinfo=timezone.utc)))
+    assert scheduler.heap == [] and scheduler.medications == {}
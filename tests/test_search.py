@@ -0,0 +1,68 @@
+import os
+import uuid
+from datetime import datetime, timezone
+
+import orjson
+import pytest
+
+import server
+from config import Settings
+from runtime import use_runtime
+
+
+def test_search_query_scopes_to_the_user_and_date_range():
+    start = datetime(2024, 3, 1, 9, 0, tzinfo=timezone.utc)
+    query = server.search_query("u1", "dizzy", "recorded_at", start, None)
+    assert query == {"user_id": "u1", "recorded_at": {"$gte": start}, "$text": {"$search": "dizzy"}}
+    assert "recorded_at" not in server.search_query("u1", "dizzy", "recorded_at", None, None)
+
+
+def test_unranked_search_matches_the_literal_text():
+    end = datetime(2024, 3, 31)
+    query = server.search_query("u1", "a.b (c)", "start_date", None, end, ranked=False)
+    assert query == {"user_id": "u1", "start_date": {"$lte": end.replace(tzinfo=timezone.utc)},
+                     "notes": {"$regex": r"a\.b\ \(c\)", "$options": "i"}}
+
+
+# mongomock has no $text, so ranked search only runs against a real server
+@pytest.fixture
+async def real_db():
+    url = os.environ.get("TEST_MONGO_URL")
+    if not url:
+        pytest.skip("TEST_MONGO_URL is not set")
+    runtime = server.Runtime(Settings.from_env(mongo_url=url, db_name=f"health_diary_test_{uuid.uuid4().hex[:8]}",
+                                               mongo_min_pool_size=1))
+    with use_runtime(runtime):
+        await runtime.open()
+        try:
+            yield runtime.db
+        finally:
+            await runtime.client.drop_database(runtime.db.name)
+            runtime.close()
+
+
+@pytest.mark.anyio
+async def test_search_ranks_notes_and_pages(real_db):
+    def record(notes: str, day: int) -> dict:
+        return server.record_document(server.HealthRecord(
+            user_id="u1", heart_rate=60, notes=notes, recorded_at=datetime(2024, 3, day, tzinfo=timezone.utc),
+        ))
+
+    await real_db.health_records.insert_many([
+        record("dizzy after dose, very dizzy", 1), record("slightly dizzy", 2), record("fine", 3),
+        {**record("dizzy", 4), "user_id": "u2"},
+    ])
+
+    async def search(**params) -> dict:
+        params = {"start": None, "end": None, "type": "health_record", "limit": 20, "offset": 0, **params}
+        return orjson.loads((await server.search_notes(user_id="u1", **params)).body)
+
+    results = (await search(q="dizzy"))['results']
+    assert [hit['document']['notes'] for hit in results] == ["dizzy after dose, very dizzy", "slightly dizzy"]
+    assert results[0]['score'] > results[1]['score']
+
+    page = await search(q="dizzy", limit=1)
+    assert page['has_more'] and page['next_offset'] == 1
+    assert (await search(q="dizzy", offset=1))['results'][0]['document']['notes'] == "slightly dizzy"
+    in_range = await search(q="dizzy", start=datetime(2024, 3, 2, tzinfo=timezone.utc))
+    assert [hit['document']['notes'] for hit in in_range['results']] == ["slightly dizzy"]
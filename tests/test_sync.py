@@ -0,0 +1,139 @@
+import asyncio
+import base64
+import dataclasses
+import json
+from datetime import datetime, timedelta, timezone
+
+import orjson
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+async def _sync(user_id: str, since=None, limit: int = 100) -> dict:
+    return orjson.loads((await server.sync_changes(user_id=user_id, since=since, limit=limit)).body)
+
+
+async def _write(mongo, user_id: str, heart_rate: int) -> dict:
+    doc = server.record_document(server.HealthRecord(
+        user_id=user_id, heart_rate=heart_rate, recorded_at=datetime.now(timezone.utc),
+    ))
+    async with server.sync_stamped(user_id, [doc]):
+        await mongo.health_records.insert_one(dict(doc))
+    return doc
+
+
+@pytest.mark.anyio
+async def test_pages_follow_the_token_without_gaps_or_repeats(mongo):
+    ids = [(await _write(mongo, "u1", 60 + i))['id'] for i in range(5)]
+    await _write(mongo, "u2", 90)
+
+    seen, token, pages = [], None, []
+    while True:
+        page = await _sync("u1", token, limit=2)
+        seen += [doc['id'] for doc in page['health_records']]
+        pages.append(page['has_more'])
+        token = page['next']
+        if not page['has_more']:
+            break
+    assert seen == ids
+    assert pages == [True, True, False]
+
+    # Nothing new: the token stays put
+    assert (await _sync("u1", token))['next'] == token
+    later = await _write(mongo, "u1", 70)
+    assert [doc['id'] for doc in (await _sync("u1", token))['health_records']] == [later['id']]
+
+
+@pytest.mark.anyio
+async def test_sync_stops_below_writes_still_in_flight(mongo):
+    first = await _write(mongo, "u1", 60)
+    slow = server.record_document(server.HealthRecord(user_id="u1", heart_rate=61, recorded_at=datetime.now(timezone.utc)))
+    async with server.sync_stamped("u1", [slow]):
+        # A later write commits while the slow one still holds a lower number
+        fast = await _write(mongo, "u1", 62)
+        page = await _sync("u1")
+        assert [doc['id'] for doc in page['health_records']] == [first['id']]
+        await mongo.health_records.insert_one(dict(slow))
+    page = await _sync("u1", page['next'])
+    assert [doc['id'] for doc in page['health_records']] == [slow['id'], fast['id']]
+
+
+@pytest.mark.anyio
+async def test_abandoned_reservations_stop_holding_sync_back(mongo, runtime):
+    await server.allocate_sync_seqs("u1")  # the writer dies before its insert
+    done = await _write(mongo, "u1", 61)
+    assert (await _sync("u1"))['health_records'] == []
+
+    runtime.settings = dataclasses.replace(runtime.settings, sync_pending_seconds=0)
+    assert [doc['id'] for doc in (await _sync("u1"))['health_records']] == [done['id']]
+    counter = await mongo.sync_counters.find_one({"_id": "u1"})
+    assert counter.get('pending') == {}
+
+
+@pytest.mark.anyio
+async def test_deletes_are_reported_as_tombstones(mongo):
+    doc = await _write(mongo, "u1", 60)
+    token = (await _sync("u1"))['next']
+    tombstone = {"user_id": "u1", "collection": "health_records", "id": doc['id'], "deleted_at": datetime.now(timezone.utc)}
+    async with server.sync_stamped("u1", [tombstone]):
+        await mongo.sync_tombstones.insert_one(tombstone)
+    page = await _sync("u1", token)
+    assert page['health_records'] == []
+    assert [entry['id'] for entry in page['deleted']] == [doc['id']]
+
+
+@pytest.mark.anyio
+async def test_bad_and_expired_tokens_are_rejected(mongo, runtime):
+    with pytest.raises(HTTPException) as invalid:
+        await _sync("u1", "not-a-token")
+    assert invalid.value.status_code == 400
+
+    issued = datetime.now(timezone.utc) - timedelta(days=runtime.settings.sync_tombstone_days + 1)
+    stale = base64.urlsafe_b64encode(json.dumps([3, issued.timestamp()]).encode()).decode().rstrip('=')
+    with pytest.raises(HTTPException) as expired:
+        await _sync("u1", stale)
+    assert expired.value.status_code == 410
+
+
+@pytest.mark.anyio
+async def test_backfill_reserves_numbers_alongside_live_writes(mongo):
+    await mongo.health_records.insert_many([{"id": f"r{i}", "user_id": "u1"} for i in range(3)])
+    live = await _write(mongo, "u1", 60)
+    await server.backfill_sync_seqs(batch_size=2)
+    seqs = [doc['sync_seq'] async for doc in mongo.health_records.find({"user_id": "u1"})]
+    assert sorted(seqs) == [1, 2, 3, 4]
+    assert live['sync_seq'] == 1
+
+
+@pytest.mark.anyio
+async def test_concurrent_startups_apply_a_migration_once(mongo, monkeypatch):
+    calls = []
+
+    async def migration():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+
+    monkeypatch.setattr(server, "MIGRATIONS", [("9999_test", migration)])
+    await asyncio.gather(server.run_migrations(), server.run_migrations())
+    assert calls == [1]
+    assert (await mongo.migrations.find_one({"_id": "9999_test"}))['applied_at']
+
+
+@pytest.mark.anyio
+async def test_sync_documents_leave_out_bookkeeping_fields(mongo):
+    doc = server.record_document(server.HealthRecord(
+        user_id="u1", heart_rate=60, recorded_at=datetime.now(timezone.utc), idempotency_key="k1",
+    ))
+    async with server.sync_stamped("u1", [doc]):
+        await mongo.health_records.insert_one(dict(doc))
+    medication = server.Medication(user_id="u1", name="A", dosage="1", frequency="daily", time_of_day=["08:00"],
+                                   start_date=datetime.now(timezone.utc)).model_dump()
+    async with server.sync_stamped("u1", [medication]):
+        await mongo.medications.insert_one(dict(medication))
+
+    page = await _sync("u1")
+    assert set(page['health_records'][0]) <= set(server.HealthRecord.model_fields)
+    assert set(page['medications'][0]) <= set(server.Medication.model_fields)
+    assert page['health_records'][0]['id'] == doc['id']
@@ -0,0 +1,133 @@
+import dataclasses
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+from mongomock_motor import AsyncMongoMockClient
+from pymongo import ASCENDING
+
+import migrate_timeseries
+import server
+
+
+async def _skip():
+    pass
+
+
+@pytest.fixture
+def storage(mongo, runtime, monkeypatch):
+    """Switch records_storage for the test; returns (health_records, readings)."""
+    # mongomock can't create time-series collections; a plain one stands in
+    monkeypatch.setattr(server, "ensure_timeseries_collection", _skip)
+
+    async def use(mode: str):
+        runtime.settings = dataclasses.replace(runtime.settings, records_storage=mode)
+        await mongo.record_keys.create_index([("user_id", ASCENDING), ("idempotency_key", ASCENDING)], unique=True)
+        return mongo.health_records, mongo[runtime.settings.records_timeseries_collection]
+    return use
+
+
+def _record(heart_rate: int, key=None) -> dict:
+    return server.record_document(server.HealthRecord(
+        user_id="u1", heart_rate=heart_rate, idempotency_key=key, recorded_at=datetime(2024, 3, 1, tzinfo=timezone.utc),
+    ))
+
+
+@pytest.mark.anyio
+async def test_timeseries_writes_claim_keys_and_deletes_release_them(storage, mongo):
+    records, readings = await storage("timeseries")
+    first, plain = _record(60, "k1"), _record(61)
+    assert await server.insert_records([first, plain]) == {}
+    failed = await server.insert_records([_record(62, "k1")])
+    assert failed[0]['code'] == 11000
+    assert await readings.count_documents({}) == 2 and await records.count_documents({}) == 0
+    assert (await mongo.record_keys.find_one({"idempotency_key": "k1"}))['id'] == first['id']
+
+    assert (await server.delete_record("u1", first['id']))['id'] == first['id']
+    assert await server.delete_record("u1", first['id']) is None
+    assert await mongo.record_keys.count_documents({}) == 0
+    assert await server.insert_records([_record(63, "k1")]) == {}
+
+
+@pytest.mark.anyio
+async def test_a_failed_reading_releases_its_key(storage, mongo, monkeypatch):
+    await storage("timeseries")
+
+    async def fail(docs):
+        return {0: {"code": 2, "errmsg": "boom"}}
+
+    monkeypatch.setattr(server, "insert_readings", fail)
+    assert (await server.insert_records([_record(60, "k1")]))[0]['code'] == 2
+    assert await mongo.record_keys.count_documents({}) == 0
+
+
+@pytest.mark.anyio
+async def test_a_retry_while_the_key_is_claimed_gets_a_409(storage, mongo):
+    records, readings = await storage("timeseries")
+    create = server.HealthRecordCreate(heart_rate=60, idempotency_key="k1")
+    # The first request has claimed the key but its reading hasn't landed
+    await mongo.record_keys.insert_one({"user_id": "u1", "idempotency_key": "k1", "id": "r1"})
+    with pytest.raises(HTTPException) as error:
+        await server.create_health_record(create, user_id="u1")
+    assert error.value.status_code == 409
+
+    await readings.insert_one({**_record(60, "k1"), "id": "r1"})
+    assert (await server.create_health_record(create, user_id="u1"))['id'] == "r1"
+    # Bulk duplicates take the id from the claimed key
+    results = [None]
+    await server.insert_records_chunk("u1", [_record(61, "k1")], [0], results)
+    assert results[0] == {"index": 0, "status": "duplicate", "id": "r1"}
+
+
+@pytest.mark.anyio
+async def test_dual_writes_and_deletes_both_layouts(storage, mongo):
+    records, readings = await storage("dual")
+    record = _record(60, "k1")
+    assert await server.insert_records([record]) == {}
+    assert await records.count_documents({"id": record['id']}) == 1
+    assert await readings.count_documents({"id": record['id']}) == 1
+    assert await mongo.record_keys.count_documents({"id": record['id']}) == 1
+
+    await server.delete_record("u1", record['id'])
+    for collection in (records, readings, mongo.record_keys):
+        assert await collection.count_documents({}) == 0
+
+
+@pytest.mark.anyio
+async def test_copy_skips_copied_records_and_resumes_from_its_checkpoint(storage, mongo):
+    records, readings = await storage("dual")
+    # Four records from before dual mode, then one written in it
+    await records.insert_many([_record(60 + i, f"k{i}") for i in range(4)])
+    await server.insert_records([_record(64, "k4")])
+
+    # settle_seconds < 0 puts the cutoff after the records just written
+    result = await server.copy_records_to_timeseries(batch_size=2, settle_seconds=-5)
+    assert result == {"copied": 4, "skipped": 1}
+    assert sorted([doc['heart_rate'] async for doc in readings.find()]) == [60, 61, 62, 63, 64]
+    assert await mongo.record_keys.count_documents({}) == 5
+
+    # Rerunning picks up from the checkpoint, past everything already copied
+    assert await server.copy_records_to_timeseries(batch_size=2) == result
+    assert await readings.count_documents({}) == 5
+
+
+@pytest.mark.anyio
+async def test_migrate_timeseries_copies_with_a_fresh_checkpoint(monkeypatch, capsys):
+    client = AsyncMongoMockClient()
+    monkeypatch.setattr(server, "AsyncIOMotorClient", lambda *args, **kwargs: client)
+    # Startup's indexes and migrations use features mongomock lacks
+    for name in ("ensure_timeseries_collection", "ensure_indexes", "run_migrations"):
+        monkeypatch.setattr(server, name, _skip)
+    monkeypatch.setenv("RECORDS_STORAGE", "dual")
+    db = client[server.Settings.from_env().db_name]
+    await db.migrations.insert_one({"_id": "timeseries_copy", "applied_at": datetime.now(timezone.utc), "copied": 0})
+    await db.health_records.insert_one({**_record(60), "_id": ObjectId.from_datetime(datetime(2024, 3, 1))})
+
+    await migrate_timeseries.main(SimpleNamespace(restart=True, batch_size=10, pause=0))
+    assert '"copied": 1' in capsys.readouterr().out
+
+    monkeypatch.setenv("RECORDS_STORAGE", "collection")
+    with pytest.raises(SystemExit):
+        await migrate_timeseries.main(SimpleNamespace(restart=False, batch_size=10, pause=0))